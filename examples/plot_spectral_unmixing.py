@@ -85,7 +85,9 @@ _ = wget.download(url, data_file_path, bar=None)
 #data_file_path = px.io.uiGetFile(filter='Anasys NanoIR text export (*.txt)')
 
 # Load the data from file to memory
-data_mat = np.loadtxt(data_file_path, delimiter ='\t', skiprows =1 )
+with open(data_file_path, 'r') as file_handle:
+    file_handle.readline()  # skip the line with the column names
+    data_mat = px.io.translators.utils.read_text_rows(file_handle, delimiter='\t', dtype=np.float64)
 print('Data currently of shape:', data_mat.shape)
 
 # Only every fifth column is of interest (position)
@@ -8,7 +8,7 @@ Created on Mon Jan 23 11:13:22 2017
 from __future__ import division, print_function, absolute_import, unicode_literals
 import numpy as np
 from scipy.optimize import least_squares
-import itertools as itt
+from scipy.spatial import cKDTree
 import multiprocessing as mp
 import time as tm
 from _warnings import warn
@@ -34,6 +34,43 @@ atom_dtype = np.dtype({'names': ['x', 'y', 'type'],
 atom_coeff_dtype = np.dtype({'names': ['Amplitude', 'x', 'y', 'Sigma'],
                              'formats': [np.float32, np.float32, np.float32, np.float32]})
 
+def find_nearest_neighbors(atom_pos, num_neighbors, kd_tree=None):
+    """
+    Finds the nearest neighbors of each atom using a KD-tree instead of the full matrix of distances between atoms
+
+    Parameters
+    ----------
+    atom_pos : 2D numpy array
+        Positions of the atoms arranged as [atom index, row(0) and column(1)]
+    num_neighbors : unsigned int
+        Number of nearest neighbors to find for each atom
+    kd_tree : scipy.spatial.cKDTree (Optional)
+        Tree already built on atom_pos. A new tree is built if not provided
+
+    Returns
+    -------
+    closest_neighbors_mat : 2D numpy array
+        Indices of the nearest neighbors of each atom sorted by distance, excluding the atom itself.
+        Arranged as [atom index, neighbor]
+    """
+    atom_pos = np.atleast_2d(atom_pos)[:, :2]
+    num_atoms = atom_pos.shape[0]
+    num_neighbors = int(min(num_neighbors, num_atoms - 1))
+    if num_neighbors < 1:
+        return np.zeros(shape=(num_atoms, 0), dtype=np.intp)
+
+    if kd_tree is None:
+        kd_tree = cKDTree(atom_pos)
+
+    _, neighbor_inds = kd_tree.query(atom_pos, k=num_neighbors + 1)
+
+    # Drop the atom itself. If an identical position was returned in its place, drop the farthest neighbor instead
+    is_self = neighbor_inds == np.arange(num_atoms)[:, None]
+    is_self[np.invert(np.any(is_self, axis=1)), -1] = True
+
+    return neighbor_inds[np.invert(is_self)].reshape(num_atoms, num_neighbors)
+
+
 def multi_gauss_surface_fit(coef_mat, s_mat):
     """
     Evaluates the provided coefficients for N gaussian peaks to generate a 2D matrix
@@ -67,6 +104,87 @@ def multi_gauss_surface_fit(coef_mat, s_mat):
     return multi_gauss
 
 
+def multi_gauss_surface_jacobian(coef_mat, s_mat):
+    """
+    Evaluates the partial derivatives of the surface from multi_gauss_surface_fit with respect to each coefficient
+
+    Parameters
+    ----------
+    coef_mat : 2D numpy array
+        Coefficients arranged as [atom, parameter] where the parameters are:
+            height, row, column, sigma (width of the gaussian)
+    s_mat : 3D numpy array
+        Stack of the mesh grid
+
+    Returns
+    -------
+    jac_mat : 2D numpy array
+        Derivatives arranged as [pixel, coefficient] where the coefficients are ordered as in the raveled coef_mat
+    """
+    x = s_mat[:, :, 0, np.newaxis]
+    y = s_mat[:, :, 1, np.newaxis]
+    amp, x_val, y_val, sigma = np.transpose(coef_mat)
+
+    x_diff = x - x_val
+    y_diff = y - y_val
+    dist_sq = x_diff ** 2 + y_diff ** 2
+    gauss = np.exp(-dist_sq / sigma ** 2)
+    amp_gauss = 2 * amp * gauss / sigma ** 2
+
+    jac_mat = np.stack((gauss,
+                        amp_gauss * x_diff,
+                        amp_gauss * y_diff,
+                        amp_gauss * dist_sq / sigma), axis=-1)
+
+    return jac_mat.reshape(-1, coef_mat.size)
+
+
+def gauss_2d_residuals(parms_vec, orig_data_mat, x_data_mat):
+    """
+    Calculates the residual
+
+    Parameters
+    ----------
+    parms_vec : 1D numpy array
+        Raveled version of the parameters matrix
+    orig_data_mat : 2D numpy array
+        Section of the image being fitted
+    x_data_mat : 3D numpy array
+        Stack of the mesh grid
+
+    Returns
+    -------
+    err_vec : 1D numpy array
+        Difference between the original data and the matrix obtained by evaluating parms_vec with x_data_mat
+    """
+    # Only need to reshape the parms from 1D to 2D
+    parms_mat = np.reshape(parms_vec, (-1, 4))
+
+    err = orig_data_mat - multi_gauss_surface_fit(parms_mat, x_data_mat)
+    return err.ravel()
+
+
+def gauss_2d_residuals_jacobian(parms_vec, orig_data_mat, x_data_mat):
+    """
+    Calculates the jacobian of the residual from gauss_2d_residuals
+
+    Parameters
+    ----------
+    parms_vec : 1D numpy array
+        Raveled version of the parameters matrix
+    orig_data_mat : 2D numpy array
+        Section of the image being fitted. Unused but required by least_squares
+    x_data_mat : 3D numpy array
+        Stack of the mesh grid
+
+    Returns
+    -------
+    jac_mat : 2D numpy array
+        Derivatives of the residual arranged as [pixel, parameter]
+    """
+    return -multi_gauss_surface_jacobian(np.reshape(parms_vec, (-1, 4)), x_data_mat)
+
+
 def fit_atom_pos(single_parm):
     """
     Fits the position of a single atom.
@@ -175,34 +293,11 @@ def fit_atom_pos(single_parm):
         plsq = None
     else:
         # Now refine the positions!
-
-        def gauss_2d_residuals(parms_vec, orig_data_mat, x_data_mat):
-            """
-            Calculates the residual
-            Parameters
-            ----------
-            parms_vec : 1D numpy array
-                Raveled version of the parameters matrix
-            orig_data_mat : 2D numpy array
-                Section of the image being fitted
-            x_data_mat : 3D numpy array
-
-            Returns
-            -------
-            err_vec : 1D numpy array
-                Difference between the original data and the matrix obtained by evaluating parms_vec with x_data_mat
-            """
-            # Only need to reshape the parms from 1D to 2D
-            parms_mat = np.reshape(parms_vec, (-1, 4))
-
-            err = orig_data_mat - multi_gauss_surface_fit(parms_mat, x_data_mat)
-            return err.ravel()
-
         plsq = least_squares(gauss_2d_residuals,
                              coef_guess_mat.ravel(),
                              args=(fit_region, s_mat),
                              bounds=(lb_mat.ravel(), ub_mat.ravel()),
-                             jac='2-point', max_nfev=max_function_evals)
+                             jac=gauss_2d_residuals_jacobian, max_nfev=max_function_evals)
         coef_fit_mat = np.reshape(plsq.x, (-1, 4))
 
     if verbose:
@@ -211,9 +306,85 @@ def fit_atom_pos(single_parm):
         return coef_guess_mat, coef_fit_mat
 
 
+# Inputs shared by the worker processes of fit_atom_positions_parallel. Set once per worker by _init_atom_fit_worker
+_worker_parms = None
+
+
+def _init_atom_fit_worker(shared_image, image_shape, atom_pos_guess, nearest_neighbors, fitting_parms):
+    """
+    Makes the image in shared memory and the fitting inputs available to the atom fitting tasks of this worker
+
+    Parameters
+    ----------
+    shared_image : multiprocessing.RawArray
+        Flattened image to fit to
+    image_shape : tuple of unsigned ints
+        Shape of the image
+    atom_pos_guess : 2D numpy array
+        Guesses of atom positions arranged as [atom index, row(0) and column(1)]
+    nearest_neighbors : 2D numpy array
+        Indices of the nearest neighbors of each atom
+    fitting_parms : dictionary
+        Parameters used for atom position fitting
+    """
+    global _worker_parms
+    image = np.frombuffer(shared_image, dtype=np.dtype(shared_image._type_)).reshape(image_shape)
+    _worker_parms = ({'atom_pos_guess': atom_pos_guess,
+                      'nearest_neighbors': nearest_neighbors,
+                      'cropped_cleaned_image': image,
+                      'verbose': False},
+                     fitting_parms)
+
+
+def _fit_atom_block(atom_inds):
+    """
+    Fits the positions of a block of atoms using the inputs set by _init_atom_fit_worker
+
+    Parameters
+    ----------
+    atom_inds : 1D numpy array of unsigned ints
+        Indices of the atoms to fit
+
+    Returns
+    -------
+    results : list of tuples
+        Guess and fit coefficients for each atom in the block
+    """
+    parm_dict, fitting_parms = _worker_parms
+    return [fit_atom_pos((atom_ind, parm_dict, fitting_parms)) for atom_ind in atom_inds]
+
+
+def get_atom_blocks(atom_pos, band_width, num_blocks):
+    """
+    Splits the atoms into spatially compact blocks. The image is divided into horizontal bands and the atoms are
+    ordered along the bands in a serpentine manner so that consecutive atoms are close to each other.
+
+    Parameters
+    ----------
+    atom_pos : 2D numpy array
+        Positions of the atoms arranged as [atom index, row(0) and column(1)]
+    band_width : float
+        Height of each band in pixels. Typically the size of the fitting region
+    num_blocks : unsigned int
+        Number of blocks to split the atoms into
+
+    Returns
+    -------
+    atom_blocks : list of 1D numpy arrays
+        Indices of the atoms in each block
+    """
+    band_ind = np.floor((atom_pos[:, 0] - np.min(atom_pos[:, 0])) / max(band_width, 1)).astype(np.int64)
+    # reverse the direction along every other band:
+    col_key = np.where(band_ind % 2 == 0, atom_pos[:, 1], -atom_pos[:, 1])
+    atom_order = np.lexsort((col_key, band_ind))
+    num_blocks = int(max(1, min(num_blocks, atom_order.size)))
+    return np.array_split(atom_order, num_blocks)
+
+
 def fit_atom_positions_parallel(parm_dict, fitting_parms, num_cores=None):
     """
-    Fits the positions of N atoms in parallel
+    Fits the positions of N atoms in parallel.
+    The image is placed in shared memory once and the workers are only sent blocks of neighboring atoms to fit
 
     Parameters
     ----------
@@ -231,18 +402,31 @@ def fit_atom_positions_parallel(parm_dict, fitting_parms, num_cores=None):
     """
     parm_dict['verbose'] = False
     all_atom_guesses = parm_dict['atom_pos_guess']
+    num_atoms = all_atom_guesses.shape[0]
     t_start = tm.time()
-    num_cores = recommendCores(all_atom_guesses.shape[0], requested_cores=num_cores, lengthy_computation=False)
-    if num_cores>1:
-        pool = mp.Pool(processes=num_cores)
-        parm_list = itt.izip(range(all_atom_guesses.shape[0]), itt.repeat(parm_dict), itt.repeat(fitting_parms))
-        chunk = int(all_atom_guesses.shape[0] / num_cores)
-        jobs = pool.imap(fit_atom_pos, parm_list, chunksize=chunk)
-        results = [j for j in jobs]
+    num_cores = recommendCores(num_atoms, requested_cores=num_cores, lengthy_computation=False)
+    if num_cores > 1:
+        cropped_clean_image = parm_dict['cropped_cleaned_image']
+        if cropped_clean_image.dtype != np.float32:
+            cropped_clean_image = np.float64(cropped_clean_image)
+        shared_image = mp.RawArray('f' if cropped_clean_image.dtype == np.float32 else 'd',
+                                   cropped_clean_image.size)
+        np.frombuffer(shared_image, dtype=cropped_clean_image.dtype)[:] = cropped_clean_image.ravel()
+
+        # several blocks per core so that cores that finish early can pick up more work
+        atom_blocks = get_atom_blocks(all_atom_guesses, 2 * fitting_parms['fit_region_size'], 8 * num_cores)
+
+        pool = mp.Pool(processes=num_cores, initializer=_init_atom_fit_worker,
+                       initargs=(shared_image, cropped_clean_image.shape, all_atom_guesses,
+                                 parm_dict['nearest_neighbors'], fitting_parms))
+        results = [None] * num_atoms
+        for atom_inds, block_results in zip(atom_blocks, pool.imap(_fit_atom_block, atom_blocks)):
+            for atom_ind, atom_result in zip(atom_inds, block_results):
+                results[atom_ind] = atom_result
         pool.close()
+        pool.join()
     else:
-        parm_list = itt.izip(range(all_atom_guesses.shape[0]), itt.repeat(parm_dict), itt.repeat(fitting_parms))
-        results = [fit_atom_pos(parm) for parm in parm_list]
+        results = [fit_atom_pos((atom_ind, parm_dict, fitting_parms)) for atom_ind in range(num_atoms)]
 
     tot_time = np.round(tm.time() - t_start)
     print('Took {} sec to find {} atoms with {} cores'.format(tot_time, len(results), num_cores))
@@ -280,15 +464,6 @@ def fit_atom_positions_dset(h5_grp, fitting_parms=None, num_cores=None):
 
     num_atoms = all_atom_guesses.shape[0]  # number of atoms
 
-    # build distance matrix
-    pos_vec = all_atom_guesses[:, 0] + 1j * all_atom_guesses[:, 1]
-
-    pos_mat1 = np.tile(np.transpose(np.atleast_2d(pos_vec)), [1, num_atoms])
-    pos_mat2 = np.transpose(pos_mat1)
-    d_mat = np.abs(pos_mat2 - pos_mat1)  # matrix of distances between all atoms
-    # sort the distance matrix and keep only the atoms within the nearest neighbor limit
-    neighbor_dist_order = np.argsort(d_mat)
-
     if fitting_parms is None:
         num_nearest_neighbors = 6  # to consider when fitting
         fitting_parms = {'fit_region_size': win_size * 0.80,  # region to consider when fitting
@@ -305,8 +480,8 @@ def fit_atom_positions_dset(h5_grp, fitting_parms=None, num_cores=None):
 
     num_nearest_neighbors = fitting_parms['num_nearest_neighbors']
 
-    # neighbor dist order has the (indices of the) neighbors for each atom sorted by distance
-    closest_neighbors_mat = neighbor_dist_order[:, 1:num_nearest_neighbors + 1]
+    # indices of the neighbors for each atom sorted by distance
+    closest_neighbors_mat = find_nearest_neighbors(all_atom_guesses, num_nearest_neighbors)
 
     parm_dict = {'atom_pos_guess': all_atom_guesses,
                  'nearest_neighbors': closest_neighbors_mat,
@@ -468,19 +643,10 @@ def remove_duplicate_labels(atom_labels, psf_width, double_cropped_image, distan
         atom_families.append(np.ones(shape=family.shape[0], dtype=np.uint32) * family_ind)
     atom_families = np.hstack(atom_families)
 
-    # build distance matrix
-    pos_vec = all_atom_pos[:, 0] + 1j * all_atom_pos[:, 1]
-
-    pos_mat1 = np.tile(np.transpose(np.atleast_2d(pos_vec)), [1, all_atom_pos.shape[0]])
-    pos_mat2 = np.transpose(pos_mat1)
-    d_mat = np.abs(pos_mat2 - pos_mat1)  # matrix of distances between all atoms
-
-    # replace the diagonal with zeros and then by some large number:
-    d_mat = np.tril(d_mat, -1)
-    d_mat[d_mat == 0] = 100 * psf_width
-
     # Now find the atoms which are too close to each other:
-    culprits = np.vstack(np.where(d_mat <= distance_multiplier * psf_width)).T
+    close_pairs = cKDTree(all_atom_pos).query_pairs(distance_multiplier * psf_width)
+    culprits = np.array(sorted(close_pairs), dtype=np.intp).reshape(-1, 2)[:, ::-1]
+    culprits = culprits[np.lexsort((culprits[:, 1], culprits[:, 0]))]
     # the culprits should be arranged as pairs in a N,2 matrix
 
     if culprits.size == 0:
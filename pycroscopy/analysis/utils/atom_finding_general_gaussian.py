@@ -7,6 +7,7 @@ from __future__ import division, print_function, absolute_import, unicode_litera
 import os
 import numpy as np
 from scipy.optimize import least_squares
+from scipy.spatial import cKDTree
 import itertools as itt
 import multiprocessing as mp
 import time as tm
@@ -23,6 +24,7 @@ from ...io.microdata import MicroDataset, MicroDataGroup
 from ...io.io_hdf5 import ioHDF5
 from ...viz import plot_utils
 from ..model import Model
+from .atom_finding import find_nearest_neighbors, get_atom_blocks
 
 def do_fit(single_parm):
     parms = single_parm[0]
@@ -39,7 +41,7 @@ def do_fit(single_parm):
                          args=(fit_region.ravel(), s1.T, s2.T),
                          kwargs=kwargs,
                          bounds=(lb_mat.ravel(), ub_mat.ravel()),
-                         jac='2-point', max_nfev=max_function_evals)
+                         jac=gauss_2d_residuals_jacobian, max_nfev=max_function_evals)
 
     coef_fit_mat = np.reshape(plsq.x, (-1, 7))
 
@@ -78,6 +80,77 @@ def gauss_2d_residuals(parms_vec, orig_data_mat, x_data, y_data, **kwargs):
     return err
 
 
+def gauss_2d_residuals_jacobian(parms_vec, orig_data_mat, x_data, y_data, **kwargs):
+    """
+    Calculates the jacobian of the residual from gauss_2d_residuals analytically
+
+    Parameters
+    ----------
+    parms_vec : 1D numpy.ndarray
+        Raveled version of the parameters matrix
+    orig_data_mat : 2D numpy array
+        Section of the image being fitted. Unused but required by least_squares
+    x_data : 2D numpy.ndarray
+        x values of each pixel
+    y_data : 2D numpy.ndarray
+        y values of each pixel
+
+    Returns
+    -------
+    jac_mat : 2D numpy.ndarray
+        Derivatives of the residual arranged as [pixel, parameter]
+
+    """
+    parms_mat = np.reshape(parms_vec, (-1, 7))
+    X = np.ravel(x_data)[:, np.newaxis]
+    Y = np.ravel(y_data)[:, np.newaxis]
+    A, x0, y0, sigma_x, sigma_y, theta, _ = np.transpose(parms_mat)
+    if kwargs['symmetric']:
+        sigma_y = sigma_x
+
+    cos_sq = np.cos(theta) ** 2
+    sin_sq = np.sin(theta) ** 2
+    sin_2 = np.sin(2 * theta)
+    cos_2 = np.cos(2 * theta)
+
+    a = cos_sq / (2 * sigma_x ** 2) + sin_sq / (2 * sigma_y ** 2)
+    b = -sin_2 / (4 * sigma_x ** 2) + sin_2 / (4 * sigma_y ** 2)
+    c = sin_sq / (2 * sigma_x ** 2) + cos_sq / (2 * sigma_y ** 2)
+
+    x_diff = X - x0
+    y_diff = Y - y0
+    x_sq = x_diff ** 2
+    xy = x_diff * y_diff
+    y_sq = y_diff ** 2
+    amp_gauss = A * np.exp(-(a * x_sq - 2 * b * xy + c * y_sq))
+
+    def __d_quad(d_a, d_b, d_c):
+        # derivative of the gaussian with respect to a parameter that changes a, b and c
+        return -amp_gauss * (d_a * x_sq - 2 * d_b * xy + d_c * y_sq)
+
+    d_sigma_x = __d_quad(-cos_sq / sigma_x ** 3, sin_2 / (2 * sigma_x ** 3), -sin_sq / sigma_x ** 3)
+    d_sigma_y = __d_quad(-sin_sq / sigma_y ** 3, -sin_2 / (2 * sigma_y ** 3), -cos_sq / sigma_y ** 3)
+    if kwargs['symmetric']:
+        d_sigma_x = d_sigma_x + d_sigma_y
+        d_sigma_y = np.zeros_like(d_sigma_y)
+
+    # The background of the first gaussian is added once for every gaussian
+    d_background = np.zeros_like(amp_gauss)
+    d_background[:, 0] = parms_mat.shape[0]
+
+    jac_mat = np.stack((np.exp(-(a * x_sq - 2 * b * xy + c * y_sq)),
+                        amp_gauss * (2 * a * x_diff - 2 * b * y_diff),
+                        amp_gauss * (2 * c * y_diff - 2 * b * x_diff),
+                        d_sigma_x,
+                        d_sigma_y,
+                        __d_quad(-sin_2 / (2 * sigma_x ** 2) + sin_2 / (2 * sigma_y ** 2),
+                                 -cos_2 / (2 * sigma_x ** 2) + cos_2 / (2 * sigma_y ** 2),
+                                 sin_2 / (2 * sigma_x ** 2) - sin_2 / (2 * sigma_y ** 2)),
+                        d_background), axis=-1)
+
+    return -jac_mat.reshape(X.shape[0], -1)
+
+
 def gauss2d(X, Y, *parms, **kwargs):
     """
     Calculates a general 2d elliptic gaussian
@@ -199,25 +272,17 @@ class Gauss_Fit(object):
 
         self.num_atoms = self.all_atom_guesses.shape[0]  # number of atoms
 
-        # build distance matrix
-        pos_vec = self.all_atom_guesses[:, 0] + 1j * self.all_atom_guesses[:, 1]
-
-        pos_mat1 = np.tile(np.transpose(np.atleast_2d(pos_vec)), [1, self.num_atoms])
-        pos_mat2 = np.transpose(pos_mat1)
-        d_mat = np.abs(pos_mat2 - pos_mat1)  # matrix of distances between all atoms
-        # sort the distance matrix and keep only the atoms within the nearest neighbor limit
-        neighbor_dist_order = np.argsort(d_mat)
+        # spatial index of the atom positions used for all neighbor searches
+        self.atom_tree = cKDTree(self.all_atom_guesses[:, :2])
 
         self.num_nearest_neighbors = self.fitting_parms['num_nearest_neighbors']
 
-        # neighbor dist order has the (indices of the) neighbors for each atom sorted by distance
-        self.closest_neighbors_mat = neighbor_dist_order[:, 1:self.num_nearest_neighbors + 1]
+        # indices of the neighbors for each atom sorted by distance
+        self.closest_neighbors_mat = find_nearest_neighbors(self.all_atom_guesses, self.num_nearest_neighbors,
+                                                            kd_tree=self.atom_tree)
 
         # find which atoms are at the centers of the motifs
-        self.center_atom_vec = (self.motif_centers[:, 0]) + (1j * self.motif_centers[:, 1])
-        self.center_atom_dists = [np.abs(pos_vec - item) for item in self.center_atom_vec]
-        self.center_atom_sorted = np.argsort(self.center_atom_dists)
-        self.center_atom_indices = self.center_atom_sorted[:, 0]
+        _, self.center_atom_indices = self.atom_tree.query(self.motif_centers[:, :2], k=1)
 
     def fit_atom_positions_parallel(self, plot_results=True, num_cores=None):
         """
@@ -252,14 +317,21 @@ class Gauss_Fit(object):
 
         print('Fitting...')
         if num_cores > 1:
+            # send the atoms in spatially compact blocks, several per core to balance the load
+            atom_blocks = get_atom_blocks(self.all_atom_guesses, 2 * self.fitting_parms['fit_region_size'],
+                                          8 * num_cores)
+            atom_order = np.hstack(atom_blocks)
+            chunk = max(1, int(np.ceil(self.num_atoms / len(atom_blocks))))
             pool = mp.Pool(processes=num_cores)
-            parm_list = itt.izip(self.guess_parms, itt.repeat(self.fitting_parms))
-            chunk = int(self.num_atoms / num_cores)
+            parm_list = zip([self.guess_parms[atom_ind] for atom_ind in atom_order], itt.repeat(self.fitting_parms))
             jobs = pool.imap(do_fit, parm_list, chunksize=chunk)
-            self.fitting_results = [j for j in jobs]
+            self.fitting_results = [None] * self.num_atoms
+            for atom_ind, result in zip(atom_order, jobs):
+                self.fitting_results[atom_ind] = result
             pool.close()
+            pool.join()
         else:
-            parm_list = itt.izip(self.guess_parms, itt.repeat(self.fitting_parms))
+            parm_list = zip(self.guess_parms, itt.repeat(self.fitting_parms))
             self.fitting_results = [do_fit(parm) for parm in parm_list]
 
         print ('Finalizing datasets...')
@@ -267,7 +339,7 @@ class Gauss_Fit(object):
         self.fit_dataset = np.zeros(shape=self.guess_dataset.shape, dtype=self.guess_dataset.dtype)
 
         for atom_ind, single_atom_results in enumerate(self.fitting_results):
-            types = np.hstack((self.h5_guess['type'][atom_ind], [self.h5_guess['type'][neighbor] for neighbor in self.closest_neighbors_mat[atom_ind]]))
+            types = self.all_atom_guesses[np.hstack((atom_ind, self.closest_neighbors_mat[atom_ind])), 2]
             atom_data = np.hstack((np.vstack(types), single_atom_results))
             atom_data = [tuple(element) for element in atom_data]
             self.fit_dataset[atom_ind] = atom_data
@@ -329,12 +401,10 @@ class Gauss_Fit(object):
         position_range = self.fitting_parms['position_range']
 
         # start writing down initial guesses
-        x_center_atom = self.h5_guess['x'][atom_ind]
-        y_center_atom = self.h5_guess['y'][atom_ind]
-        x_neighbor_atoms = [self.h5_guess['x'][self.closest_neighbors_mat[atom_ind][i]] for i in
-                            range(self.num_nearest_neighbors)]
-        y_neighbor_atoms = [self.h5_guess['y'][self.closest_neighbors_mat[atom_ind][i]] for i in
-                            range(self.num_nearest_neighbors)]
+        x_center_atom = self.all_atom_guesses[atom_ind, 0]
+        y_center_atom = self.all_atom_guesses[atom_ind, 1]
+        x_neighbor_atoms = self.all_atom_guesses[self.closest_neighbors_mat[atom_ind], 0]
+        y_neighbor_atoms = self.all_atom_guesses[self.closest_neighbors_mat[atom_ind], 1]
 
         # select the window we're going to be fitting
         x_range = slice(max(int(np.round(x_center_atom - fit_region_size)), 0),
@@ -388,10 +458,10 @@ class Gauss_Fit(object):
                                                      theta_guess, background_guess)))
         else:
             # otherwise better guesses are assumed to exist
-            motif_type = self.h5_guess['type'][atom_ind]
+            motif_type = int(self.all_atom_guesses[atom_ind, 2])
             coef_guess_mat = np.copy(self.motif_converged_parms[motif_type])
-            coef_guess_mat[:, 1] = self.h5_guess['x'][atom_ind] + coef_guess_mat[:, 1]
-            coef_guess_mat[:, 2] = self.h5_guess['y'][atom_ind] + coef_guess_mat[:, 2]
+            coef_guess_mat[:, 1] = x_center_atom + coef_guess_mat[:, 1]
+            coef_guess_mat[:, 2] = y_center_atom + coef_guess_mat[:, 2]
 
         # Choose upper and lower bounds for the fitting
         #
@@ -12,11 +12,13 @@ import h5py
 from warnings import warn
 import numpy as np
 from .microdata import MicroDataset
+from .io_utils import check_dtype, getAvailableMem
 
 __all__ = ['get_attr', 'getDataSet', 'getH5DsetRefs', 'getH5RegRefIndices', 'get_dimensionality', 'get_sort_order',
            'getAuxData', 'get_attributes', 'getH5GroupRefs', 'checkIfMain', 'checkAndLinkAncillary',
            'createRefFromIndices', 'copyAttributes', 'reshape_to_Ndims', 'linkRefs', 'linkRefAsAlias',
-           'findH5group', 'get_formatted_labels', 'reshape_from_Ndims', 'findDataset', 'print_tree', 'get_all_main']
+           'findH5group', 'get_formatted_labels', 'reshape_from_Ndims', 'findDataset', 'print_tree', 'get_all_main',
+           'get_real_view', 'mark_as_modified']
 
 if sys.version_info.major == 3:
     unicode = str
@@ -1506,3 +1508,109 @@ def create_spec_inds_from_vals(ds_spec_val_mat):
         ds_spec_inds_mat[change_sort, jcol] = indices
 
     return ds_spec_inds_mat
+
+
+def get_real_view(h5_main, max_mem_mb=1024, force=False):
+    """
+    Returns a float32 copy of the provided dataset where complex or compound values have been converted to real
+    scalars using the function provided by io_utils.check_dtype. The copy is written to the file only once, in
+    a group named <dataset name>-Real_View next to the source dataset, and is reused by subsequent analyses until
+    the source dataset changes. Checking whether the real view is up-to-date does not read the source dataset. Only
+    its shape, datatype and its modification counter, which is incremented by mark_as_modified, are compared.
+
+    Parameters
+    ----------
+    h5_main : h5py.Dataset
+        2D dataset arranged as [position, spectroscopic]
+    max_mem_mb : unsigned int, optional
+        Maximum memory (in megabytes) to use for each batch while building the real view. Default 1024Mb
+    force : bool, optional
+        Whether or not to rebuild the real view even if an up-to-date one already exists. Default False.
+        Use this if the source was modified in place without calling mark_as_modified
+
+    Returns
+    -------
+    h5_real : h5py.Dataset
+        Real view arranged as [position, features]. The features of complex data are arranged as
+        [real, imaginary] and those of compound data are arranged field by field
+    """
+    func, is_complex, is_compound, n_features, n_samples, type_mult = check_dtype(h5_main)
+    fingerprint = _get_source_fingerprint(h5_main)
+
+    h5_parent = h5_main.parent
+    grp_name = h5_main.name.split('/')[-1] + '-Real_View'
+    if grp_name in h5_parent:
+        h5_real = h5_parent[grp_name]['Real_View']
+        if not force and h5_real.shape == (n_samples, n_features) and \
+                get_attr(h5_real, 'source_fingerprint') == fingerprint:
+            return h5_real
+        # The source has changed since the real view was built
+        del h5_real, h5_parent[grp_name]
+
+    print('Building real view of {}'.format(h5_main.name))
+    h5_grp = h5_parent.create_group(grp_name)
+    # Roughly square chunks allow both batches of positions and subsets of features to be read efficiently
+    real_chunks = calc_chunks((n_samples, n_features), np.float32(0).itemsize, max_chunk_mem=1024 ** 2)
+    h5_real = h5_grp.create_dataset('Real_View', shape=(n_samples, n_features), dtype=np.float32,
+                                    chunks=real_chunks)
+
+    max_memory = min(max_mem_mb * 1024 ** 2, 0.75 * getAvailableMem())
+    mem_per_pos = h5_main.shape[1] * (h5_main.dtype.itemsize + type_mult)
+    batch_size = max(1, int(max_memory // mem_per_pos))
+    for start_pos in range(0, n_samples, batch_size):
+        batch = slice(start_pos, min(start_pos + batch_size, n_samples))
+        h5_real[batch] = np.float32(func(h5_main[batch]))
+
+    h5_real.attrs['source_fingerprint'] = fingerprint
+    h5_main.file.flush()
+
+    return h5_real
+
+
+def mark_as_modified(h5_main):
+    """
+    Increments the modification counter of a dataset. Call this after modifying the contents of a dataset in place
+    so that copies derived from it, such as the real view, are rebuilt the next time they are requested.
+
+    Parameters
+    ----------
+    h5_main : h5py.Dataset
+        Dataset whose contents were modified
+    """
+    h5_main.attrs['modification_count'] = _get_modification_count(h5_main) + 1
+
+
+def _get_modification_count(h5_main):
+    """
+    Returns the number of times a dataset was marked as modified
+
+    Parameters
+    ----------
+    h5_main : h5py.Dataset
+        Dataset of interest
+
+    Returns
+    -------
+    count : unsigned int
+        Value of the modification_count attribute. 0 if the dataset was never marked as modified
+    """
+    return int(h5_main.attrs.get('modification_count', 0))
+
+
+def _get_source_fingerprint(h5_main):
+    """
+    Computes an inexpensive fingerprint of a dataset from its shape, datatype and modification counter.
+    Used to detect whether a cached real view needs to be rebuilt without reading the dataset.
+
+    Parameters
+    ----------
+    h5_main : h5py.Dataset
+        2D dataset of interest
+
+    Returns
+    -------
+    fingerprint : str
+        Fingerprint of the dataset
+    """
+    return '{}-{}-{}'.format('x'.join([str(dim) for dim in h5_main.shape]), h5_main.dtype.str,
+                             _get_modification_count(h5_main))
@@ -0,0 +1,110 @@
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+import h5py
+
+from pycroscopy.io.translators import batch
+from pycroscopy.io.translators.translator import Translator
+
+
+def _square(value):
+    return value ** 2
+
+
+class PoolTranslator(Translator):
+    """
+    Translator that starts its own pool of processes like the BE and image translators
+    """
+
+    def translate(self, file_path):
+        with open(file_path) as file_handle:
+            values = [int(item) for item in file_handle.read().split()]
+        pool = mp.Pool(processes=2)
+        try:
+            squares = pool.map(_square, values)
+        finally:
+            pool.close()
+            pool.join()
+        return sum(squares)
+
+
+class H5Translator(Translator):
+    """
+    Translator that returns an h5py.Dataset like the image translators
+    """
+
+    def translate(self, file_path):
+        h5_path = file_path.replace('.txt', '.h5')
+        h5_file = h5py.File(h5_path, 'w')
+        return h5_file.create_dataset('Raw_Data', data=[1, 2, 3])
+
+
+class LockTranslator(Translator):
+    """
+    Translator whose output cannot be pickled
+    """
+
+    def translate(self, file_path):
+        return threading.Lock()
+
+
+class SilentExitTranslator(Translator):
+    """
+    Translator whose process exits normally without reporting its outcome
+    """
+
+    def translate(self, file_path):
+        os._exit(0)
+
+
+class TestBatchTranslate(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.file_paths = list()
+        for ind in range(3):
+            file_path = os.path.join(self.folder, 'data_{}.txt'.format(ind))
+            with open(file_path, 'w') as file_handle:
+                file_handle.write(' '.join([str(ind + val) for val in range(4)]))
+            self.file_paths.append(file_path)
+        self.recommend_cores = batch.recommendCores
+        batch.recommendCores = lambda num_jobs, **kwargs: 2
+
+    def tearDown(self):
+        batch.recommendCores = self.recommend_cores
+        shutil.rmtree(self.folder)
+
+    def test_parallel_translators_with_inner_pools(self):
+        results = batch.batch_translate(os.path.join(self.folder, '*.txt'), translator=PoolTranslator,
+                                        max_mem_mb=16, total_mem_mb=64, verbose=False)
+        self.assertEqual([result['input'] for result in results], self.file_paths)
+        for ind, result in enumerate(results):
+            self.assertIsNone(result['error'], msg=result['error'])
+            self.assertEqual(result['output'], sum([(ind + val) ** 2 for val in range(4)]))
+
+    def __translate(self, translator):
+        return batch.batch_translate(os.path.join(self.folder, '*.txt'), translator=translator,
+                                     max_mem_mb=16, total_mem_mb=64, verbose=False)
+
+    def test_parallel_h5py_outputs(self):
+        results = self.__translate(H5Translator)
+        for file_path, result in zip(self.file_paths, results):
+            self.assertIsNone(result['error'], msg=result['error'])
+            self.assertEqual(result['output'], file_path.replace('.txt', '.h5'))
+
+    def test_parallel_unpicklable_outputs(self):
+        results = self.__translate(LockTranslator)
+        for result in results:
+            self.assertIsNone(result['error'], msg=result['error'])
+            self.assertIn('lock', result['output'])
+
+    def test_parallel_process_exits_without_outcome(self):
+        results = self.__translate(SilentExitTranslator)
+        self.assertEqual([result['input'] for result in results], self.file_paths)
+        for result in results:
+            self.assertIsNotNone(result['error'])
+            self.assertIsNone(result['output'])
@@ -0,0 +1,24 @@
+import io
+from unittest import TestCase
+
+import numpy as np
+
+from pycroscopy.io.translators.utils import read_text_rows
+
+
+class TestReadTextRows(TestCase):
+
+    def test_skips_comments_and_blank_lines(self):
+        file_handle = io.StringIO('# header\n1 2 3\n\n4 5 6 # note\n# more\n7 8 9\n')
+        self.assertTrue(np.allclose(read_text_rows(file_handle, num_rows=2), [[1, 2, 3], [4, 5, 6]]))
+        self.assertTrue(np.allclose(read_text_rows(file_handle, num_rows=2), [[7, 8, 9]]))
+        self.assertEqual(read_text_rows(file_handle).shape, (0, 0))
+
+    def test_delimiter(self):
+        data_mat = read_text_rows(io.StringIO('1, 2, 3\n4, 5, 6\n'), delimiter=',')
+        self.assertTrue(np.allclose(data_mat, [[1, 2, 3], [4, 5, 6]]))
+
+    def test_malformed_text_raises(self):
+        for text, delimiter in [('1, 2, abc\n4, 5, 6', ','), ('1 2\n3\n4 5 6', None), ('1 2 3\n4 5\n', None)]:
+            with self.assertRaises(ValueError):
+                read_text_rows(io.StringIO(text), delimiter=delimiter)
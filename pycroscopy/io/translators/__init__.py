@@ -18,6 +18,7 @@ from . import translator
 from . import utils
 from . import df_utils
 from . import beps_data_generator
+from . import batch
 
 from .be_odf import BEodfTranslator
 from .be_odf_relaxation import BEodfRelaxationTranslator
@@ -38,9 +39,10 @@ from .time_series import MovieTranslator
 from .translator import Translator
 from .beps_data_generator import FakeDataGenerator
 from .labview_h5_patcher import LabViewH5Patcher
+from .batch import batch_translate
 
 __all__ = ['Translator', 'BEodfTranslator', 'BEPSndfTranslator', 'BEodfRelaxationTranslator',
            'GIVTranslator', 'GLineTranslator', 'GTuneTranslator', 'GDMTranslator', 'PtychographyTranslator',
            'SporcTranslator', 'MovieTranslator', 'IgorIBWTranslator', 'NumpyTranslator',
            'OneViewTranslator', 'ImageTranslator', 'NDataTranslator', 'FakeDataGenerator',
-           'LabViewH5Patcher']
+           'LabViewH5Patcher', 'batch_translate']
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Oct 15 10:21:03 2026
+
+Translates several raw data files concurrently
+"""
+
+from __future__ import division, print_function, absolute_import, unicode_literals
+
+import multiprocessing as mp
+import pickle
+import time as tm
+import traceback
+from fnmatch import fnmatch
+from glob import glob
+from os import path
+from warnings import warn
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+from .be_odf import BEodfTranslator
+from .beps_ndf import BEPSndfTranslator
+from .gmode_line import GLineTranslator
+from .igor_ibw import IgorIBWTranslator
+from ..io_utils import recommendCores, getAvailableMem
+
+"""
+File name patterns used to pick the translator for a raw data file. The first matching pattern is used.
+Translators that need more than the path of a single file (image stacks, ndata, etc.) must be requested explicitly
+"""
+translator_patterns = [('*.ibw', IgorIBWTranslator),
+                       ('*bigtime_0*.dat', GLineTranslator),
+                       ('*_1_[0-9]*.dat', BEPSndfTranslator),
+                       ('*_1_r[0-9]*.dat', BEPSndfTranslator),
+                       ('*real*.dat', BEodfTranslator),
+                       ('*imag*.dat', BEodfTranslator)]
+
+"""
+These translators translate all the files in the folder of the provided file.
+Only one translation is performed per folder
+"""
+folder_translators = (BEodfTranslator, BEPSndfTranslator, GLineTranslator)
+
+
+def find_translator(file_path):
+    """
+    Finds the translator that can translate the provided raw data file
+
+    Parameters
+    ----------
+    file_path : String / unicode
+        Absolute path of the raw data file
+
+    Returns
+    -------
+    translator : subclass of Translator or None
+        Translator class for this file. None if no translator matches this file
+    """
+    file_name = path.basename(file_path)
+    for pattern, translator in translator_patterns:
+        if fnmatch(file_name, pattern):
+            return translator
+    return None
+
+
+def _empty_result(job):
+    """
+    Outcome of a translation that has not produced anything yet
+
+    Parameters
+    ----------
+    job : tuple
+        Translation job as passed to _translate_file
+
+    Returns
+    -------
+    result : dict
+        Outcome of this translation with no output, no error and no timing
+    """
+    job_ind, file_path, translator, num_bytes = job[:4]
+    return {'index': job_ind,
+            'input': file_path,
+            'translator': translator.__name__,
+            'output': None,
+            'error': None,
+            'seconds': 0.0,
+            'megabytes': num_bytes / 1024 ** 2,
+            'mb_per_sec': 0.0}
+
+
+def _translate_file(job):
+    """
+    Translates a single dataset. Any exception is caught and reported so that the batch is not interrupted
+
+    Parameters
+    ----------
+    job : tuple
+        Index of the job, path of the raw data file, translator class, total size of the raw data files in bytes,
+        keyword arguments for the translator constructor and keyword arguments for translate()
+
+    Returns
+    -------
+    result : dict
+        Outcome of this translation
+    """
+    job_ind, file_path, translator, num_bytes, init_kwargs, translate_kwargs = job
+    result = _empty_result(job)
+
+    t_start = tm.time()
+    try:
+        tran = translator(**init_kwargs)
+        result['output'] = tran.translate(file_path, **translate_kwargs)
+    except Exception:
+        result['error'] = traceback.format_exc()
+    result['seconds'] = tm.time() - t_start
+
+    if result['error'] is None and result['seconds'] > 0:
+        result['mb_per_sec'] = result['megabytes'] / result['seconds']
+
+    return result
+
+
+def _translate_file_to_queue(job, queue):
+    """
+    Translates a single dataset in a child process and sends the outcome back to the parent
+
+    Parameters
+    ----------
+    job : tuple
+        Translation job as passed to _translate_file
+    queue : multiprocessing.Queue
+        Queue on which the outcome of this translation is put
+    """
+    result = _translate_file(job)
+    '''
+    The output must be pickled to reach the parent. h5py objects are replaced by the path of their file
+    and anything else that cannot be pickled by its representation
+    '''
+    output = result['output']
+    if hasattr(output, 'file') and hasattr(output.file, 'filename'):
+        result['output'] = output.file.filename
+    else:
+        try:
+            pickle.dumps(output)
+        except Exception:
+            result['output'] = repr(output)
+    queue.put(result)
+
+
+def batch_translate(inputs, translator=None, translate_kwargs=None, max_mem_mb=1024, total_mem_mb=None,
+                    cores=None, verbose=True):
+    """
+    Translates several raw data files concurrently in a pool of processes.
+    A failed translation is reported but does not stop the rest of the batch.
+
+    Parameters
+    ----------
+    inputs : String / unicode or list of String / unicode
+        Absolute paths or glob patterns of the raw data files
+    translator : subclass of Translator, optional
+        Translator used for all the files. Default - None - the translator is picked for each file
+        using the patterns in translator_patterns. Files that match no pattern are skipped
+    translate_kwargs : dict, optional
+        Keyword arguments passed on to the translate method of every translator,
+        eg. - {'show_plots': False} for the BE translators
+    max_mem_mb : unsigned int, optional
+        Maximum memory in megabytes that each translation may use. Default 1024
+    total_mem_mb : unsigned int, optional
+        Memory in megabytes shared by all the concurrent translations.
+        Default - None - 75 % of the available memory
+    cores : unsigned int, optional
+        Maximum number of translations to run at once. Default - None - set by recommendCores
+    verbose : Boolean, optional
+        Whether or not to print the outcome of each translation. Default True
+
+    Returns
+    -------
+    results : list of dict
+        Outcome of each translation in the order of the inputs. Each dictionary contains the input file, the name of
+        the translator, the path returned by translate (output), the traceback if the translation failed (error),
+        the duration in seconds and the throughput in megabytes of raw data per second. When the translations run in
+        separate processes, h5py objects returned by translate are replaced by the path of their file
+    """
+    if translate_kwargs is None:
+        translate_kwargs = dict()
+    if not isinstance(inputs, (list, tuple)):
+        inputs = [inputs]
+
+    file_paths = list()
+    for item in inputs:
+        matches = sorted(glob(item)) if any([char in item for char in '*?[']) else [item]
+        for file_path in matches:
+            file_path = path.abspath(file_path)
+            if file_path not in file_paths:
+                file_paths.append(file_path)
+
+    '''
+    Group the files into translation jobs. Translators that read a whole folder get one job per folder
+    '''
+    jobs = list()
+    folder_jobs = dict()
+    for file_path in file_paths:
+        this_translator = translator
+        if this_translator is None:
+            this_translator = find_translator(file_path)
+            if this_translator is None:
+                warn('No translator found for {}. Skipping this file'.format(file_path))
+                continue
+
+        num_bytes = path.getsize(file_path) if path.isfile(file_path) else 0
+
+        if issubclass(this_translator, folder_translators):
+            key = (this_translator, path.dirname(file_path))
+            if key in folder_jobs:
+                folder_jobs[key][3] += num_bytes
+                continue
+            folder_jobs[key] = [len(jobs), file_path, this_translator, num_bytes]
+            jobs.append(folder_jobs[key])
+        else:
+            jobs.append([len(jobs), file_path, this_translator, num_bytes])
+
+    if len(jobs) == 0:
+        return list()
+
+    init_kwargs = {'max_mem_mb': max_mem_mb}
+    jobs = [tuple(job) + (init_kwargs, translate_kwargs) for job in jobs]
+
+    '''
+    Run as many translations at once as the cores and the shared memory allow
+    '''
+    if total_mem_mb is None:
+        total_mem_mb = 0.75 * getAvailableMem() / 1024 ** 2
+    processes = recommendCores(len(jobs), requested_cores=cores, lengthy_computation=True)
+    processes = int(max(1, min(processes, len(jobs), total_mem_mb // max_mem_mb)))
+
+    if verbose:
+        print('Translating {} dataset(s) with {} process(es) of up to {} MB each'.format(len(jobs), processes,
+                                                                                        max_mem_mb))
+
+    results = [None] * len(jobs)
+    t_start = tm.time()
+
+    def report(result):
+        results[result['index']] = result
+        if not verbose:
+            return
+        if result['error'] is None:
+            print('Translated {} with {} in {:.2f} sec ({:.2f} MB/sec)'.format(result['input'],
+                                                                             result['translator'],
+                                                                             result['seconds'],
+                                                                             result['mb_per_sec']))
+        else:
+            print('Failed to translate {} with {}:\n{}'.format(result['input'], result['translator'],
+                                                               result['error']))
+
+    if processes == 1:
+        for job in jobs:
+            report(_translate_file(job))
+    else:
+        '''
+        Start a fresh process for each translation so that all its memory is released when it is done.
+        The translators start their own pools of processes, so these cannot be the daemonic workers of a Pool
+        '''
+        queue = mp.Queue()
+        pending = list(jobs)
+        running = dict()
+
+        def collect(result):
+            if result['index'] in running:
+                running.pop(result['index'])[0].join()
+            report(result)
+
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                while len(pending) > 0 and len(running) < processes:
+                    job = pending.pop(0)
+                    proc = mp.Process(target=_translate_file_to_queue, args=(job, queue))
+                    proc.start()
+                    running[job[0]] = (proc, job)
+                try:
+                    collect(queue.get(timeout=1))
+                    continue
+                except Empty:
+                    pass
+                dead = [job_ind for job_ind, (proc, _) in running.items() if not proc.is_alive()]
+                if len(dead) == 0:
+                    continue
+                # The outcomes of processes that have just exited may still be on their way
+                try:
+                    while True:
+                        collect(queue.get(timeout=0.1))
+                except Empty:
+                    pass
+                # Any other process died without sending back its outcome (eg. - killed for lack of memory)
+                for job_ind in dead:
+                    if job_ind not in running:
+                        continue
+                    proc, job = running.pop(job_ind)
+                    proc.join()
+                    result = _empty_result(job)
+                    result['error'] = 'Translation process exited with code {} without reporting ' \
+                                      'its outcome'.format(proc.exitcode)
+                    report(result)
+        finally:
+            for proc, _ in running.values():
+                proc.terminate()
+                proc.join()
+
+    if verbose:
+        num_failed = len([result for result in results if result['error'] is not None])
+        tot_mb = sum([result['megabytes'] for result in results])
+        tot_time = tm.time() - t_start
+        print('Translated {} of {} dataset(s) ({:.2f} MB) in {:.2f} sec'.format(len(results) - num_failed,
+                                                                             len(results), tot_mb, tot_time))
+
+    return results
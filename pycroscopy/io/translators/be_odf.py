@@ -332,7 +332,7 @@ class BEodfTranslator(Translator):
         self._read_data(UDVS_mat, parm_dict, path_dict, real_size, isBEPS, add_pix)
         
         generatePlotGroups(self.h5_raw, self.hdf, self.mean_resp, folder_path, basename,
-                           self.max_resp, self.min_resp, max_mem_mb=self.max_ram,
+                           self.max_resp, self.min_resp, max_mem_mb=self.max_ram / 1024 ** 2,
                            spec_label=spec_label, show_plots=show_plots, save_plots=save_plots,
                            do_histogram=do_histogram, debug=verbose)
         
@@ -381,7 +381,7 @@ class BEodfTranslator(Translator):
 
     def __read_beps_data(self, path_dict, udvs_steps, mode, add_pixel=False):
         """
-        Reads the imaginary and real data files pixelwise and writes to the H5 file 
+        Reads the imaginary and real data files in blocks of pixels and writes to the H5 file 
         
         Parameters 
         --------------------
@@ -399,7 +399,7 @@ class BEodfTranslator(Translator):
         None
         """
         
-        print('---- reading pixel-by-pixel ----------')
+        print('---- reading in blocks of pixels ----------')
         
         bytes_per_pix = self.h5_raw.shape[1]*4 
         step_size = self.h5_raw.shape[1]/udvs_steps          
@@ -431,9 +431,9 @@ class BEodfTranslator(Translator):
                                                  num_spectra=self.num_rand_spectra)
         take_conjugate = requires_conjugate(rand_spectra)
 
-        self.mean_resp = np.zeros(shape=(self.h5_raw.shape[1]), dtype=np.complex64)
         self.max_resp = np.zeros(shape=(self.h5_raw.shape[0]), dtype=np.float32)
         self.min_resp = np.zeros(shape=(self.h5_raw.shape[0]), dtype=np.float32)
+        sum_resp = np.zeros(shape=(self.h5_raw.shape[1]), dtype=np.complex128)
 
         numpix = self.h5_raw.shape[0] 
         """ 
@@ -442,40 +442,45 @@ class BEodfTranslator(Translator):
         """ 
         if add_pixel: 
             numpix -= 1 
-        
-        for pix_indx in range(numpix):
-            if self.h5_raw.shape[0] > 5:
-                if pix_indx % int(round(self.h5_raw.shape[0]/10)) == 0:
-                    print('Reading... {} complete'.format(round(100*pix_indx / self.h5_raw.shape[0])))
-                    
-            # get the raw stream from each parser
-            pxl_data = list()
-            for prsr in parsers:
-                pxl_data.append(prsr.read_pixel())
-            
-            # interleave if both in and out of field
+
+        """
+        The block and the write buffer of h5py each take one complex64 pixel worth of memory per pixel
+        and the amplitude of the block takes one float32 pixel
+        """
+        mem_per_pix = self.h5_raw.shape[1] * (2 * np.complex64(0).itemsize + np.float32(0).itemsize)
+        block_size = max(1, int(self.max_ram / mem_per_pix))
+        block_size = min(block_size, max(numpix, 1))
+
+        for start_pix in range(0, numpix, block_size):
+            end_pix = min(start_pix + block_size, numpix)
+            print('Reading... {} complete'.format(round(100 * start_pix / self.h5_raw.shape[0])))
+
+            # interleave if both in and out of field by reading each file straight into alternate UDVS steps
             # we are ignoring user defined possibilities...
             if mode == 'in and out-of-field':
-                in_fld = pxl_data[0]
-                out_fld = pxl_data[1]
-                
-                in_fld_2 = in_fld.reshape(udvs_steps, step_size)
-                out_fld_2 = out_fld.reshape(udvs_steps, step_size)
-                raw_mat = np.empty((udvs_steps*2, step_size), dtype=out_fld.dtype)
-                raw_mat[0::2, :] = in_fld_2
-                raw_mat[1::2, :] = out_fld_2
-                raw_vec = raw_mat.reshape(in_fld.size + out_fld.size).transpose()
+                raw_mat = np.empty((end_pix - start_pix, udvs_steps * 2, step_size), dtype=np.complex64)
+                parsers[0].read_pixels(start_pix, end_pix, out=raw_mat[:, 0::2, :])
+                parsers[1].read_pixels(start_pix, end_pix, out=raw_mat[:, 1::2, :])
+                raw_mat = raw_mat.reshape(end_pix - start_pix, -1)
             else:
-                raw_vec = pxl_data[0]  # only one parser
-            self.max_resp[pix_indx] = np.max(np.abs(raw_vec))
-            self.min_resp[pix_indx] = np.min(np.abs(raw_vec))
-            self.mean_resp = (1/(pix_indx+1))*(raw_vec + pix_indx * self.mean_resp)
+                raw_mat = parsers[0].read_pixels(start_pix, end_pix)  # only one parser
+
+            amp_mat = np.abs(raw_mat)
+            self.max_resp[start_pix:end_pix] = np.max(amp_mat, axis=1)
+            self.min_resp[start_pix:end_pix] = np.min(amp_mat, axis=1)
+            del amp_mat
+            sum_resp += np.sum(raw_mat, axis=0, dtype=np.complex128)
 
             if take_conjugate:
-                raw_vec = np.conjugate(raw_vec)
-            self.h5_raw[pix_indx, :] = np.complex64(raw_vec[:])
+                np.conjugate(raw_mat, out=raw_mat)
+            self.h5_raw[start_pix:end_pix, :] = raw_mat
             self.hdf.file.flush()
-            
+
+        self.mean_resp = np.complex64(sum_resp / max(numpix, 1))
+
+        for prsr in parsers:
+            prsr.close()
+
         # Add zeros to main_data for the missing pixel. 
         if add_pixel: 
             self.h5_raw[-1, :] = 0+0j             
@@ -503,18 +508,19 @@ class BEodfTranslator(Translator):
         rand_spectra = self.__get_random_spectra([parser], self.h5_raw.shape[0], udvs_steps, step_size,
                                                  num_spectra=self.num_rand_spectra)
         take_conjugate = requires_conjugate(rand_spectra)
-        raw_vec = parser.read_all_data()
+        raw_mat = parser.read_pixels(0, self.h5_raw.shape[0])
+        parser.close()
         if take_conjugate:
             print('Taking conjugate to ensure positive Quality factors')
-            raw_vec = np.conjugate(raw_vec)
-                                      
-        raw_mat = raw_vec.reshape(self.h5_raw.shape[0], self.h5_raw.shape[1])
+            np.conjugate(raw_mat, out=raw_mat)
                 
         # Write to the h5 dataset:
-        self.mean_resp = np.mean(raw_mat, axis=0)
-        self.max_resp = np.amax(np.abs(raw_mat), axis=0)
-        self.min_resp = np.amin(np.abs(raw_mat), axis=0)
-        self.h5_raw[:, :] = np.complex64(raw_mat)
+        self.mean_resp = np.complex64(np.mean(raw_mat, axis=0, dtype=np.complex128))
+        amp_mat = np.abs(raw_mat)
+        self.max_resp = np.amax(amp_mat, axis=0)
+        self.min_resp = np.amin(amp_mat, axis=0)
+        del amp_mat
+        self.h5_raw[:, :] = raw_mat
         self.hdf.file.flush()
 
         print('---- Finished reading files -----')       
@@ -974,14 +980,10 @@ class BEodfTranslator(Translator):
 
         for spectra_index in range(num_spectra):
             prsr = parsers[selected_parsers[spectra_index]]
-            prsr.seek_to_pixel(selected_pixels[spectra_index])
-            raw_vec = prsr.read_pixel()
-            spectrogram = raw_vec.reshape(num_udvs_steps, -1)
+            pix_ind = min(selected_pixels[spectra_index], prsr.pixels_in_file - 1)
+            spectrogram = prsr.read_pixels(pix_ind, pix_ind + 1).reshape(num_udvs_steps, -1)
             chosen_spectra[spectra_index] = spectrogram[selected_steps[spectra_index]]
 
-        for prsr in parsers:
-            prsr.reset()
-
         return chosen_spectra
 
 
@@ -991,6 +993,8 @@ class BEodfParser(object):
         """
         This object reads the two binary data files (real and imaginary data).
         Use separate parser instances for in-field and out-field data sets.
+        Both files are memory-mapped so that blocks of pixels can be read without
+        seeking or reading the files one pixel at a time.
         
         Parameters 
         --------------------
@@ -1003,12 +1007,54 @@ class BEodfParser(object):
         bytes_per_pix : unsigned int
             Number of bytes per pixel
         """
-        self.f_real = open(real_path, "rb")
-        self.f_imag = open(imag_path, "rb")               
-        
+        self.f_real = np.memmap(real_path, dtype=np.float32, mode='r')
+        self.f_imag = np.memmap(imag_path, dtype=np.float32, mode='r')
+
         self.__num_pix__ = num_pix
         self.__bytes_per_pix__ = bytes_per_pix
+        self.__bins_per_pix__ = int(bytes_per_pix / 4)
         self.__pix_indx__ = 0
+
+    @property
+    def pixels_in_file(self):
+        """
+        Number of complete pixels present in the files
+        """
+        return int(min(self.f_real.size, self.f_imag.size) / self.__bins_per_pix__)
+
+    def read_pixels(self, start_pix, end_pix, out=None):
+        """
+        Returns the contents of a contiguous block of pixels.
+        The real and imaginary parts are copied straight from the mapped files into the output
+
+        Parameters
+        ----------
+        start_pix : unsigned int
+            Index of the first pixel to read
+        end_pix : unsigned int
+            Index of the pixel after the last pixel to read
+        out : numpy complex64 array, optional
+            Array to fill. Must hold (end_pix - start_pix) * bins per pixel elements and may be a
+            strided view, for example the in-field half of an interleaved block.
+            Default - None - a new [pixel, bin] array is created
+
+        Returns
+        -------
+        raw_mat : 2D numpy complex64 array
+            Data of the pixels arranged as [pixel, bin] or out if provided
+        """
+        start_bin = start_pix * self.__bins_per_pix__
+        end_bin = end_pix * self.__bins_per_pix__
+        if end_bin > self.f_real.size or end_bin > self.f_imag.size:
+            raise ValueError('BEodfParser - pixels {} to {} are beyond the end of the files'.format(start_pix,
+                                                                                                 end_pix))
+        if out is None:
+            out = np.empty(shape=(end_pix - start_pix, self.__bins_per_pix__), dtype=np.complex64)
+
+        out.real = self.f_real[start_bin:end_bin].reshape(out.shape)
+        out.imag = self.f_imag[start_bin:end_bin].reshape(out.shape)
+
+        return out
             
     def read_pixel(self):
         """
@@ -1020,26 +1066,14 @@ class BEodfParser(object):
             Content of one pixel's data
         """
         if self.__num_pix__ is not None:
-            if self.__pix_indx__ is self.__num_pix__:
+            if self.__pix_indx__ == self.__num_pix__:
                 warn('BEodfParser - No more pixels to read!')
                 return None
-        
-        self.f_real.seek(self.__pix_indx__*self.__bytes_per_pix__, 0)
-        real_vec = np.fromstring(self.f_real.read(self.__bytes_per_pix__), dtype='f')
-        
-        self.f_imag.seek(self.__pix_indx__*self.__bytes_per_pix__, 0)
-        imag_vec = np.fromstring(self.f_imag.read(self.__bytes_per_pix__), dtype='f')
-        
-        raw_vec = np.zeros(len(real_vec), dtype=np.complex64)
-        raw_vec.real = real_vec
-        raw_vec.imag = imag_vec
-        
+
+        raw_vec = self.read_pixels(self.__pix_indx__, self.__pix_indx__ + 1)[0]
+
         self.__pix_indx__ += 1
-        
-        if self.__pix_indx__ is self.__num_pix__:
-            self.f_real.close()
-            self.f_imag.close()
-        
+
         return raw_vec
         
     def read_all_data(self):
@@ -1051,29 +1085,20 @@ class BEodfParser(object):
         raw_vec : 1D numpy complex64 array
             Entire content of the file pair
         """
-        self.f_real.seek(0, 0)
-        self.f_imag.seek(0, 0)
-        
-        d_real = np.fromstring(self.f_real.read(), dtype='f')
-        d_imag = np.fromstring(self.f_imag.read(), dtype='f')
-        
-        full_file = d_real + 1j*d_imag
-        
-        self.f_real.close()
-        self.f_imag.close()
-        
-        return full_file
+        raw_vec = np.empty(shape=min(self.f_real.size, self.f_imag.size), dtype=np.complex64)
+        raw_vec.real = self.f_real[:raw_vec.size]
+        raw_vec.imag = self.f_imag[:raw_vec.size]
+
+        return raw_vec
 
     def seek_to_pixel(self, pixel_ind):
         """
+        Sets the pixel that will be returned by the next call to read_pixel
 
         Parameters
         ----------
-        pixel_ind
-
-        Returns
-        -------
-
+        pixel_ind : unsigned int
+            Index of the pixel
         """
         if self.__num_pix__ is not None:
             pixel_ind = min(pixel_ind, self.__num_pix__ )
@@ -1081,8 +1106,13 @@ class BEodfParser(object):
 
     def reset(self):
         """
-
+        Returns to the first pixel
         """
-        self.f_real.seek(0, 0)
-        self.f_imag.seek(0, 0)
         self.__pix_indx__ = 0
+
+    def close(self):
+        """
+        Releases the memory maps of the data files
+        """
+        del self.f_real
+        del self.f_imag
@@ -271,7 +271,7 @@ class BEodfRelaxationTranslator(Translator):
         self.hdf.flush()
         
         generatePlotGroups(self.ds_main, self.hdf, self.mean_resp, folder_path, basename,
-                           self.max_resp, self.min_resp, max_mem_mb=self.max_ram,
+                           self.max_resp, self.min_resp, max_mem_mb=self.max_ram / 1024 ** 2,
                            spec_label = spec_label, show_plots = show_plots, save_plots=save_plots,
                            do_histogram=do_histogram, ignore_plot_groups=ignored_plt_grps) #We ignored in-field plot group.
         
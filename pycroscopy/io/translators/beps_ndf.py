@@ -8,6 +8,8 @@ Created on Tue Nov  3 15:07:16 2015
 
 from __future__ import division, print_function, absolute_import, unicode_literals
 
+import multiprocessing as mp
+from copy import copy
 from os import path, listdir, remove
 from warnings import warn
 
@@ -21,6 +23,7 @@ from .translator import Translator
 from .utils import make_position_mat, generate_dummy_main_parms
 from ..hdf_utils import getH5DsetRefs, linkRefs, calc_chunks
 from ..io_hdf5 import ioHDF5
+from ..io_utils import recommendCores
 from ..microdata import MicroDataGroup, MicroDataset
 
 
@@ -183,40 +186,71 @@ class BEPSndfTranslator(Translator):
         print('Reading data file(s)')
         self.dset_index = 0
         self.ds_pixel_start_indx = 0
-        for pixel_ind in range(self.max_pixels):
-
-            if (100.0 * (pixel_ind + 1) / self.max_pixels) % 10 == 0:
-                print('{} % complete'.format(int(100 * (pixel_ind + 1) / self.max_pixels)))
-
-            # First read the next pixel from all parsers:
-            current_pixels = {}
-            for prsr in parsers:
-                wave_type = prsr.get_wave_type()
-                if self.parm_dict['VS_mode'] == 'AC modulation mode with time reversal' and \
-                                self.BE_bin_inds is not None:
-                    if np.sign(wave_type) == -1:
-                        bin_fft = self.BE_wave[self.BE_bin_inds]
-                    elif np.sign(wave_type) == 1:
-                        bin_fft = self.BE_wave_rev[self.BE_bin_inds]
-                else:
-                    bin_fft = None
-
-                current_pixels[wave_type] = prsr.read_pixel(bin_fft)
-
-            if pixel_ind == 0:
-                h5_refs = self.__initialize_meas_group(self.max_pixels, current_pixels)
-                prev_pixels = current_pixels  # This is here only to avoid annoying warnings.
+
+        # Each parser parses its file in parallel and hands back blocks of pixels in order. The cores are shared
+        cores = max(1, int(recommendCores(self.max_pixels) / len(parsers)))
+        block_iters = dict()
+        for prsr in parsers:
+            wave_type = prsr.get_wave_type()
+            if self.parm_dict['VS_mode'] == 'AC modulation mode with time reversal' and \
+                            self.BE_bin_inds is not None:
+                if np.sign(wave_type) == -1:
+                    bin_fft = self.BE_wave[self.BE_bin_inds]
+                elif np.sign(wave_type) == 1:
+                    bin_fft = self.BE_wave_rev[self.BE_bin_inds]
             else:
-                if current_pixels[unique_waves[0]].is_different_from(prev_pixels[unique_waves[0]]):
-                    # Some parameter has changed. Write current group and make new group
-                    self.__close_meas_group(h5_refs, show_plots, save_plots, do_histogram)
-                    self.ds_pixel_start_indx = pixel_ind
-                    h5_refs = self.__initialize_meas_group(self.max_pixels - pixel_ind, current_pixels)
+                bin_fft = None
 
-            # print('reading Pixel {} of {}'.format(pixel_ind,self.max_pixels))
-            self.__append_pixel_data(current_pixels)
+            block_iters[wave_type] = prsr.iter_pixel_blocks(bin_fft, cores=cores)
 
-            prev_pixels = current_pixels
+        """
+        The blocks from the different files need not line up. Take the pixels that are available from all files,
+        find the pixels where the parameters change and write the pixels in between together
+        """
+        pending_blocks = dict()
+        prev_block = None
+        h5_refs = None
+        pixel_ind = 0
+        while pixel_ind < self.max_pixels:
+            for wave_type, block_iter in block_iters.items():
+                if wave_type not in pending_blocks or len(pending_blocks[wave_type]) == 0:
+                    pending_blocks[wave_type] = next(block_iter)
+
+            num_pix = min([len(block) for block in pending_blocks.values()] + [self.max_pixels - pixel_ind])
+            current_blocks = dict()
+            for wave_type, block in pending_blocks.items():
+                current_blocks[wave_type] = block[:num_pix]
+                pending_blocks[wave_type] = block[num_pix:]
+
+            first_block = current_blocks[unique_waves[0]]
+            seg_starts = list(first_block.find_changes(prev_block))
+            if h5_refs is None and 0 not in seg_starts:
+                seg_starts.insert(0, 0)
+
+            seg_bounds = [0] + seg_starts + [num_pix]
+            for seg_start, seg_end in zip(seg_bounds[:-1], seg_bounds[1:]):
+                if seg_end == seg_start:
+                    continue
+                segment = dict()
+                for wave_type, block in current_blocks.items():
+                    segment[wave_type] = block[seg_start:seg_end]
+
+                if seg_start in seg_starts:
+                    if h5_refs is not None:
+                        # Some parameter has changed. Write current group and make new group
+                        self.__close_meas_group(h5_refs, show_plots, save_plots, do_histogram)
+                    self.ds_pixel_start_indx = pixel_ind + seg_start
+                    h5_refs = self.__initialize_meas_group(self.max_pixels - self.ds_pixel_start_indx, segment)
+
+                self.__append_pixel_block(segment)
+
+            prev_block = first_block
+            if int(10 * (pixel_ind + num_pix) / self.max_pixels) > int(10 * pixel_ind / self.max_pixels):
+                print('{} % complete'.format(10 * int(10 * (pixel_ind + num_pix) / self.max_pixels)))
+            pixel_ind += num_pix
+
+        for block_iter in block_iters.values():
+            block_iter.close()
         self.__close_meas_group(h5_refs, show_plots, save_plots, do_histogram)
 
     ###################################################################################################
@@ -259,7 +293,7 @@ class BEPSndfTranslator(Translator):
         ds_pos_ind.attrs['labels'] = pos_slice_dict
         ds_pos_ind.attrs['units'] = self.pos_units
 
-        self.pos_vals_list = np.array(self.pos_vals_list)
+        self.pos_vals_list = self.pos_vals[:self.ds_pixel_index]
         # Ensuring that the X and Y values vary from 0 to N instead of -0.5 N to + 0.5 N
         for col_ind in range(2):
             min_val = np.min(self.pos_vals_list[:, col_ind])
@@ -301,11 +335,13 @@ class BEPSndfTranslator(Translator):
                         'Bin_Frequencies', 'Bin_FFT', 'UDVS', 'UDVS_Labels', 'Noise_Floor', 'Spectroscopic_Values']
         linkRefs(self.ds_main, getH5DsetRefs(aux_ds_names, h5_refs))
 
+        self.mean_resp = np.complex64(self.sum_resp / self.ds_pixel_index)
+
         # While we have all the references and mean data, write the plot groups as well:
         generatePlotGroups(self.ds_main, self.hdf, self.mean_resp, 
                            self.folder_path, self.basename,
                            self.max_resp, self.min_resp, 
-                           max_mem_mb=self.max_ram,
+                           max_mem_mb=self.max_ram / 1024 ** 2,
                            spec_label=self.spec_label,
                            show_plots=show_plots, save_plots=save_plots,
                            do_histogram=do_histogram)
@@ -324,8 +360,8 @@ class BEPSndfTranslator(Translator):
         ----------
         num_pix : unsigned int
             Number of pixels this datagroup is expected to hold
-        current_pixels : dictionary of BEPSndfPixel objects
-            Extracted data for the first pixel in this group
+        current_pixels : dictionary of BEPSndfPixelBlock objects
+            Extracted data for the first pixels in this group
             
         Returns
         ---------
@@ -355,9 +391,9 @@ class BEPSndfTranslator(Translator):
         for wave_type in self.__unique_waves__:
             pixl = current_pixels[wave_type]
             exec_bin_vec[stind:stind+pixl.num_bins] = wave_type*np.ones(pixl.num_bins)
-            bin_inds[stind:stind+pixl.num_bins] = pixl.BE_bin_ind
-            bin_freqs[stind:stind+pixl.num_bins] = pixl.BE_bin_w
-            bin_FFT[stind:stind+pixl.num_bins] = pixl.FFT_BE_wave
+            bin_inds[stind:stind+pixl.num_bins] = pixl.BE_bin_ind[0]
+            bin_freqs[stind:stind+pixl.num_bins] = pixl.BE_bin_w[0]
+            bin_FFT[stind:stind+pixl.num_bins] = pixl.FFT_BE_wave[0]
             pixel_bins[wave_type] = [stind, pixl.num_bins]
             stind += pixl.num_bins
         del pixl, stind 
@@ -365,15 +401,41 @@ class BEPSndfTranslator(Translator):
         # Make the index matrix that has the UDVS step number and bin indices
         spec_inds = np.zeros(shape=(2, tot_pts), dtype=np.uint32)
         stind = 0
+        step_counter = 0
+        '''
+        Also find where each bin and step of the spectrogram of each wave type goes in the rows of the main dataset.
+        Each wave type has its own counter of steps which also runs over the skipped steps
+        '''
+        internal_step_index = dict()
+        reassembly_inds = dict()
+        for wave_type in self.__unique_waves__:
+            internal_step_index[wave_type] = 0
+            reassembly_inds[wave_type] = ([], [], [], [])
         # Need to go through the UDVS file and reconstruct chronologically
         for step_index, wave_type in enumerate(self.excit_type_vec):
             if self.halve_udvs_steps and self.udvs_mat[step_index, 2] < 1E-3:  # invalid AC amplitude
-                    continue  # skip
+                internal_step_index[wave_type] += 1
+                continue  # skip
             vals = pixel_bins[wave_type]
             spec_inds[1, stind:stind+vals[1]] = step_index * np.ones(vals[1])  # UDVS step
             spec_inds[0, stind:stind+vals[1]] = np.arange(vals[0], vals[0]+vals[1])  # Bin step
+            data_dest, data_src, noise_dest, noise_src = reassembly_inds[wave_type]
+            data_dest.append(np.arange(stind, stind+vals[1]))
+            # Position of each bin of this step in the flattened [bin, step] spectrogram
+            data_src.append(np.arange(vals[1]) * current_pixels[wave_type].num_steps + internal_step_index[wave_type])
+            noise_dest.append(step_counter)
+            noise_src.append(internal_step_index[wave_type])
             stind += vals[1]
-        del stind, wave_type, step_index
+            internal_step_index[wave_type] += 1
+            step_counter += 1
+        del stind, wave_type, step_index, step_counter, internal_step_index
+
+        self.__reassembly_inds = dict()
+        for wave_type, (data_dest, data_src, noise_dest, noise_src) in reassembly_inds.items():
+            if len(data_dest) == 0:
+                continue
+            self.__reassembly_inds[wave_type] = (np.hstack(data_dest), np.hstack(data_src),
+                                                 np.array(noise_dest), np.array(noise_src))
         
         self.spec_inds = spec_inds  # will need this for plot group generation
 
@@ -448,7 +510,7 @@ class BEPSndfTranslator(Translator):
         
         Chris Smith -- csmith55@utk.edu
         '''
-        max_bins_per_pixel = np.max(pixel_bins.values())
+        max_bins_per_pixel = np.max([vals[1] for vals in pixel_bins.values()])
 
         beps_chunks = calc_chunks([num_pix, tot_pts],
                                   np.complex64(0).itemsize,
@@ -474,13 +536,13 @@ class BEPSndfTranslator(Translator):
         
         self.ds_noise = getH5DsetRefs(['Noise_Floor'], h5_refs)[0] 
         self.ds_main = getH5DsetRefs(['Raw_Data'], h5_refs)[0]
-        self.pos_vals_list = list()
+        self.pos_vals = np.zeros(shape=(num_pix, 3), dtype=np.float32)
                 
         # self.dset_index += 1 #  raise dset index after closing only
         self.ds_pixel_index = 0
         
         # Use this for plot groups:
-        self.mean_resp = np.zeros(shape=tot_pts, dtype=np.complex64)
+        self.sum_resp = np.zeros(shape=tot_pts, dtype=np.complex128)
         
         # Used for Histograms
         self.max_resp = np.zeros(shape=num_pix, dtype=np.float32)
@@ -490,92 +552,69 @@ class BEPSndfTranslator(Translator):
         
     # ##################################################################################################
         
-    def __append_pixel_data(self, pixel_data):
+    def __append_pixel_block(self, pixel_blocks):
         """
-        Goes through the list of pixel objects and populates the raw dataset 
-        and noise dataset for this spatial pixel.
+        Reassembles the spectrograms of a block of consecutive spatial pixels into the 
+        chronological order of the UDVS table and populates the raw dataset and noise dataset
+        for these pixels.
         
         Parameters
         ----------
-        pixel_data : List of BEPSndfPixel objects 
-            List containing parsed data for this particular spatial pixel
+        pixel_blocks : dictionary of BEPSndfPixelBlock objects 
+            Parsed data for these spatial pixels for each wave type
         
         Returns
         ---------
         None
 
         """
-        
+        zero_pix = self.__unique_waves__[0]
+        num_pix = len(pixel_blocks[zero_pix])
+
         if self.__num_wave_types__ == 1 and not self.halve_udvs_steps:
             """Technically, this will be taken care of in the later (general) part but 
             since this condition is more common it is worth writing for specifically"""
-
-            zero_pix = self.__unique_waves__[0]
-
-            data_vec = pixel_data[zero_pix].spectrogram_vec
-            noise_mat = np.float32(pixel_data[zero_pix].noise_floor_mat)
-
-            # Storing a list of lists since we don't know how many pixels we will find in this measurement group
-            self.pos_vals_list.append([pixel_data[zero_pix].x_value, pixel_data[zero_pix].y_value,
-                                       pixel_data[zero_pix].z_value])
-            
+            data_mat = pixel_blocks[zero_pix].spectrogram_mat.transpose(0, 2, 1).reshape(num_pix, -1)
+            noise_mat = pixel_blocks[zero_pix].noise_floor_mat
+            pos_pix = pixel_blocks[zero_pix]
         else:
-
-            data_vec = np.zeros(shape=(self.ds_main.shape[1]), dtype=np.complex64)
-            noise_mat = np.zeros(shape=(3, self.ds_noise.shape[1]), dtype=np.float32)
-            
-            internal_step_index = {}
-            for wave_type in self.__unique_waves__:
-                internal_step_index[wave_type] = 0
-                
-            stind = 0
-            step_counter = 0    
-            # Go through each line in the UDVS file and reconstruct chronologically
-            for step_index, wave_type in enumerate(self.excit_type_vec):
-                # get the noise and data from correct pixel -> address by wave_number.
-                
-                if self.halve_udvs_steps and self.udvs_mat[step_index, 2] < 1E-3:  # invalid AC amplitude
-                    # print('Step index {} was skipped'.format(step_index))
-                    # Not sure why each wave type has its own counter but there must have been a good reason
-                    internal_step_index[wave_type] += 1 
-                    continue  # skip
-                
-                data_pix = pixel_data[wave_type].spectrogram_mat
-                noise_pix = pixel_data[wave_type].noise_floor_mat
-                enind = stind + pixel_data[wave_type].num_bins
-                                
-                data_vec[stind:enind] = data_pix[:, internal_step_index[wave_type]]
-                noise_mat[:, step_counter] = np.float32(noise_pix[:, internal_step_index[wave_type]])
-                
-                stind = enind
-                internal_step_index[wave_type] += 1
-                step_counter += 1
-
-            # Storing a list of lists since we don't know how many pixels we will find in this measurement group
-            self.pos_vals_list.append([pixel_data[wave_type].x_value, pixel_data[wave_type].y_value,
-                                       pixel_data[wave_type].z_value])
-            
-            del internal_step_index, stind, enind, step_index, wave_type, step_counter
-        
-        if self.ds_pixel_index > 0:
-            # in the case of the first pixel, we already reserved zeros- no extension
-            # for all other lines - we extend the dataset before writing
-            self.ds_main.resize(self.ds_main.shape[0]+1, axis=0)
-            self.ds_noise.resize(self.ds_noise.shape[0]+1, axis=0)
-
-        self.ds_main[-1, :] = data_vec
-        self.ds_noise[-1] = np.array([tuple(noise) for noise in noise_mat.T], dtype=nf32)
+            data_mat = np.zeros(shape=(num_pix, self.ds_main.shape[1]), dtype=np.complex64)
+            noise_mat = np.zeros(shape=(num_pix, 3, self.ds_noise.shape[1]), dtype=np.float32)
+            for wave_type, (data_dest, data_src, noise_dest, noise_src) in self.__reassembly_inds.items():
+                spectrograms = pixel_blocks[wave_type].spectrogram_mat.reshape(num_pix, -1)
+                data_mat[:, data_dest] = spectrograms[:, data_src]
+                noise_mat[:, :, noise_dest] = pixel_blocks[wave_type].noise_floor_mat[:, :, noise_src]
+            # Positions are taken from the wave type of the last UDVS step
+            pos_pix = pixel_blocks[self.excit_type_vec[-1]]
+
+        noise_data = np.zeros(shape=(num_pix, noise_mat.shape[2]), dtype=nf32)
+        for row_ind, field in enumerate(nf32.names):
+            noise_data[field] = noise_mat[:, row_ind]
+
+        pix_slice = slice(self.ds_pixel_index, self.ds_pixel_index + num_pix)
+        self.pos_vals[pix_slice, 0] = pos_pix.x_value
+        self.pos_vals[pix_slice, 1] = pos_pix.y_value
+        self.pos_vals[pix_slice, 2] = pos_pix.z_value
+
+        if self.ds_pixel_index + num_pix > self.ds_main.shape[0]:
+            # Space for the first pixel was already reserved when the group was created
+            self.ds_main.resize(self.ds_pixel_index + num_pix, axis=0)
+            self.ds_noise.resize(self.ds_pixel_index + num_pix, axis=0)
+
+        self.ds_main[pix_slice, :] = data_mat
+        self.ds_noise[pix_slice] = noise_data
 
         self.hdf.file.flush()
         
-        # Take mean response here:
-        self.mean_resp = (1/(self.ds_pixel_index + 1))*(data_vec + self.ds_pixel_index*self.mean_resp)
-        
-        self.max_resp[self.ds_pixel_index] = np.amax(np.abs(data_vec))
-        self.min_resp[self.ds_pixel_index] = np.amin(np.abs(data_vec))
+        # Accumulate the sum here and take the mean response when closing the group:
+        self.sum_resp += np.sum(data_mat, axis=0, dtype=np.complex128)
+
+        amp_mat = np.abs(data_mat)
+        self.max_resp[pix_slice] = np.amax(amp_mat, axis=1)
+        self.min_resp[pix_slice] = np.amin(amp_mat, axis=1)
         
-        self.ds_pixel_index += 1
-               
+        self.ds_pixel_index += num_pix
+
     ###################################################################################################
     
     def _parse_file_path(self, file_path):
@@ -794,6 +833,92 @@ class BEPSndfTranslator(Translator):
         return np.array(uniq)
 
 
+# Inputs shared by the NDF parsing workers. Set once per worker by _init_ndf_worker
+_worker_ndf = None
+
+
+def _init_ndf_worker(file_path, pixel_indices, harm, bin_fft):
+    """
+    Memory-maps the data file and makes the pixel index available to the parsing tasks of this worker
+
+    Parameters
+    ----------
+    file_path : string or unicode
+        Absolute path of the .dat file
+    pixel_indices : 1D numpy array of int64
+        Byte offset of each pixel in the file
+    harm : unsigned int
+        Harmonic of the BE waveform
+    bin_fft : 1D numpy complex array
+        FFT of the BE waveform in the bins to normalize the response with. May be None
+    """
+    global _worker_ndf
+    _worker_ndf = {'data': np.memmap(file_path, dtype=np.float32, mode='r'),
+                   'pixel_indices': pixel_indices, 'harm': harm, 'bin_fft': bin_fft}
+
+
+def _parse_ndf_pixels(pix_range):
+    """
+    Parses a range of pixels using the file given to this worker
+
+    Parameters
+    ----------
+    pix_range : tuple of unsigned ints
+        Index of the first pixel and of the pixel after the last one
+
+    Returns
+    -------
+    blocks : list of BEPSndfPixelBlock objects
+        Parsed pixels in the order they appear in the file
+    """
+    return parse_ndf_pixels(_worker_ndf['data'], _worker_ndf['pixel_indices'], pix_range[0], pix_range[1],
+                            _worker_ndf['harm'], _worker_ndf['bin_fft'])
+
+
+def parse_ndf_pixels(data, pixel_indices, start_pix, end_pix, harm=1, bin_fft=None):
+    """
+    Parses a range of pixels from the contents of a BEPS new data format file.
+    Consecutive pixels of the same layout are decoded together as one block
+
+    Parameters
+    ----------
+    data : 1D numpy float32 array
+        Contents of the .dat file. Typically a memory map
+    pixel_indices : 1D numpy array of int64
+        Byte offset of each pixel in the file
+    start_pix : unsigned int
+        Index of the first pixel to parse
+    end_pix : unsigned int
+        Index of the pixel after the last pixel to parse
+    harm : unsigned int, optional
+        Harmonic of the BE waveform. Default 1
+    bin_fft : 1D numpy complex array, optional
+        FFT of the BE waveform in the bins to normalize the response with
+
+    Returns
+    -------
+    blocks : list of BEPSndfPixelBlock objects
+        Parsed pixels in the order they appear in the file
+    """
+    start_words = np.asarray(pixel_indices[start_pix:end_pix], dtype=np.int64) // 4
+    lengths = np.asarray(data[start_words], dtype=np.int64)
+    num_cols = np.asarray(data[start_words + 3], dtype=np.int64)
+    # Length, rows and columns of the pixel and the rows and columns of the spectrogram set
+    layouts = np.vstack((lengths, data[start_words + 2], num_cols, data[start_words + 2 + num_cols],
+                         data[start_words + 3 + num_cols])).T
+
+    # Pixels are stored back to back so a run of pixels with the same layout is a 2D block of the file
+    run_starts = np.hstack(([0], np.flatnonzero(np.any(np.diff(layouts, axis=0) != 0, axis=1)) + 1,
+                            [len(lengths)]))
+    blocks = list()
+    for run_start, run_end in zip(run_starts[:-1], run_starts[1:]):
+        start_word = start_words[run_start]
+        length = lengths[run_start]
+        data_mat = np.array(data[start_word: start_word + (run_end - run_start) * length])
+        blocks.append(BEPSndfPixelBlock(data_mat.reshape(run_end - run_start, length), harm, bin_fft))
+    return blocks
+
+
 class BEPSndfParser(object):
     """
     An object of this class is given the responsibility to step through a 
@@ -818,13 +943,14 @@ class BEPSndfParser(object):
             the number of pixels, and the spatial dimensionality
 
         """
-        self.__file_handle__ = open(file_path, "rb")
+        self.__file_path__ = file_path
+        self.__data__ = np.memmap(file_path, dtype=np.float32, mode='r')
         self.__EOF__ = False
         self.__curr_Pixel__ = 0
         self.__start_point__ = 0
         self.__wave_type__ = wave_type
         self.__filesize__ = path.getsize(file_path)
-        self.__pixel_indices__ = list()
+        self.__pixel_indices__ = None
         if scout:
             self.__scout()
         
@@ -869,55 +995,106 @@ class BEPSndfParser(object):
             Number of rows
         """
         return self.__num_laser_steps__, self.__num_z_steps__, self.__num_x_steps__, self.__num_y_steps__
-    
+
+    def get_index_path(self):
+        """
+        Returns the path of the file that stores the byte offsets of the pixels
+
+        Returns
+        -------
+        index_path : string or unicode
+            Absolute path of the pixel index file
+        """
+        return path.splitext(self.__file_path__)[0] + '_pixel_index.npz'
+
+    def __load_pixel_index(self):
+        """
+        Loads the pixel index saved by a previous translation of the same, unmodified, file
+
+        Returns
+        -------
+        pixel_indices : 1D numpy array of int64 or None
+            Byte offset of each pixel in the file. None if no valid index was found
+        """
+        index_path = self.get_index_path()
+        if not path.exists(index_path):
+            return None
+        try:
+            index_file = np.load(index_path)
+            if int(index_file['file_size']) != self.__filesize__ or \
+                    float(index_file['mtime']) != path.getmtime(self.__file_path__):
+                return None
+            return index_file['pixel_indices']
+        except (IOError, KeyError, ValueError):
+            return None
+
+    def __build_pixel_index(self):
+        """
+        Walks the memory-mapped file from one pixel header to the next without parsing the pixels.
+        Only the length of each pixel is read, and the operating system reads ahead in large blocks
+
+        Returns
+        -------
+        pixel_indices : 1D numpy array of int64
+            Byte offset of each pixel in the file
+        """
+        num_words = self.__data__.size
+        pixel_indices = list()
+        start_word = 0
+        while start_word < num_words:
+            spectrogram_length = int(self.__data__[start_word])
+            if spectrogram_length < 1 or start_word + spectrogram_length > num_words:
+                warn('BEPS NDF Parser - incomplete pixel at byte {} will be ignored'.format(start_word * 4))
+                break
+            pixel_indices.append(start_word * 4)
+            start_word += spectrogram_length
+
+        return np.array(pixel_indices, dtype=np.int64)
+
+    def __save_pixel_index(self):
+        """
+        Saves the pixel index next to the data file so that the file need not be scouted again
+        """
+        try:
+            np.savez(self.get_index_path(), pixel_indices=self.__pixel_indices__,
+                     file_size=self.__filesize__, mtime=path.getmtime(self.__file_path__))
+        except IOError:
+            warn('BEPS NDF Parser - could not save the pixel index for {}'.format(self.__file_path__))
+
     # Don't use this to figure out if something changes. You need pixel to previous pixel comparison    
     def __scout(self):
         """
-        Steps through the file quickly without parsing it. 
+        Finds the byte offset of every pixel without parsing the file. 
         The idea is to calculate the number of pixels ahead of time so that 
-        it is easier to parse the dataset. 
-        For phase checking, it is recommended that this function be modified to 
-        also keep track of the byte positions of the pixels so that pixels can be 
-        directly accessed if need be.
+        it is easier to parse the dataset. The offsets are saved next to the 
+        data file and reused if the same file is translated again. They also 
+        allow pixels to be directly accessed and parsed in parallel.
 
         """
-        count = 0
-        self.__num_pixels__ = 0
-        while True:
-            self.__pixel_indices__.append(self.__start_point__*4)
-            self.__file_handle__.seek(self.__start_point__*4, 0)
-            spectrogram_length = int(np.fromstring(self.__file_handle__.read(4), dtype='f')[0])  # length of spectrogram
-            
-            if count == 0:
-                self.__file_handle__.seek(self.__start_point__*4, 0)
-                data_vec = np.fromstring(self.__file_handle__.read(spectrogram_length*4), dtype='f')
-                pix = BEPSndfPixel(data_vec, self.__wave_type__)
-                self.__num_x_steps__ = pix.num_x_steps
-                self.__num_y_steps__ = pix.num_y_steps
-                self.__num_z_steps__ = pix.num_z_steps
-                self.__num_bins__ = pix.num_bins
-                
-            count += 1
-            self.__start_point__ += spectrogram_length
-            
-            if self.__filesize__ == self.__start_point__*4:
-                self.__num_pixels__ = count
-                
-                # Laser position spectroscopy is NOT accounted for anywhere. 
-                # It is impossible to find out from the parms.txt, UD_VS, or the binary .dat file
-                num_laser_steps = 1.0*count/(self.__num_z_steps__*self.__num_y_steps__*self.__num_x_steps__)                
-                if num_laser_steps % 1.0 != 0:
-                    print('Some parameter changed inbetween. \
-                          BEPS NDF Translator does not handle this usecase at the moment')
-                else:
-                    self.__num_laser_steps__ = int(num_laser_steps)
-                
-                break
-            
-            if self.__filesize__ > self.__start_point__*4:
-                self.__num_pixels__ = -1
-                
-        self.__start_point__ = 0
+        self.__pixel_indices__ = self.__load_pixel_index()
+        if self.__pixel_indices__ is None:
+            self.__pixel_indices__ = self.__build_pixel_index()
+            self.__save_pixel_index()
+
+        count = len(self.__pixel_indices__)
+        self.__num_pixels__ = count
+
+        start_word = self.__pixel_indices__[0] // 4
+        pix = BEPSndfPixel(np.array(self.__data__[start_word: start_word + int(self.__data__[start_word])]),
+                           abs(self.__wave_type__))
+        self.__num_x_steps__ = pix.num_x_steps
+        self.__num_y_steps__ = pix.num_y_steps
+        self.__num_z_steps__ = pix.num_z_steps
+        self.__num_bins__ = pix.num_bins
+
+        # Laser position spectroscopy is NOT accounted for anywhere. 
+        # It is impossible to find out from the parms.txt, UD_VS, or the binary .dat file
+        num_laser_steps = 1.0*count/(self.__num_z_steps__*self.__num_y_steps__*self.__num_x_steps__)                
+        if num_laser_steps % 1.0 != 0:
+            print('Some parameter changed inbetween. \
+                  BEPS NDF Translator does not handle this usecase at the moment')
+        else:
+            self.__num_laser_steps__ = int(num_laser_steps)
         
         spat_dim = 0
         if self.__num_z_steps__ > 1:
@@ -940,7 +1117,6 @@ class BEPSndfParser(object):
         """
         Returns a BEpixel object containing the parsed information within a pixel.
         Moves pixel index up by one.
-        This is where one could conceivably read the file in one pass instead of making 100,000 file I/Os.
 
         Returns
         -------
@@ -951,11 +1127,10 @@ class BEPSndfParser(object):
         if self.__filesize__ == self.__start_point__*4:
             print('BEPS NDF Parser - No more pixels left!')
             return -1
-        
-        self.__file_handle__.seek(self.__start_point__ * 4, 0)
-        spectrogram_length = int(np.fromstring(self.__file_handle__.read(4), dtype='f')[0])  # length of spectrogram
-        self.__file_handle__.seek(self.__start_point__ * 4, 0)
-        data_vec = np.fromstring(self.__file_handle__.read(spectrogram_length*4), dtype='f')
+
+        spectrogram_length = int(self.__data__[self.__start_point__])  # length of spectrogram
+        data_vec = np.array(self.__data__[self.__start_point__: self.__start_point__ + spectrogram_length])
+        pixel = BEPSndfPixel(data_vec, abs(self.__wave_type__), bin_fft)
        
         self.__start_point__ += spectrogram_length
         self.__curr_Pixel__ += 1
@@ -963,123 +1138,248 @@ class BEPSndfParser(object):
         if self.__filesize__ == self.__start_point__*4:
             print('BEPS NDF Parser reached End of File')
             self.__EOF__ = True
-            self.__file_handle__.close()
                 
-        return BEPSndfPixel(data_vec, abs(self.__wave_type__), bin_fft)
-        
+        return pixel
 
-class BEPSndfPixel(object):
+    def iter_pixel_blocks(self, bin_fft=None, cores=None, pixels_per_task=256):
+        """
+        Parses all the pixels in the file and yields them in order as blocks of pixels.
+        When more than one core is used, blocks of pixels are parsed in parallel using the pixel index
+
+        Parameters
+        ----------
+        bin_fft : 1D numpy complex array, optional
+            FFT of the BE waveform in the bins to normalize the response with
+        cores : unsigned int, optional
+            Number of processes to parse with. Default - None - set by recommendCores
+        pixels_per_task : unsigned int, optional
+            Maximum number of pixels in each block. Default 256
+
+        Returns
+        -------
+        blocks : generator of BEPSndfPixelBlock objects
+            Parsed pixels in the order they appear in the file
+        """
+        if self.__pixel_indices__ is None:
+            self.__scout()
+
+        harm = abs(self.__wave_type__)
+        pix_ranges = [(start_pix, min(start_pix + pixels_per_task, self.__num_pixels__))
+                      for start_pix in range(0, self.__num_pixels__, pixels_per_task)]
+        cores = max(1, recommendCores(self.__num_pixels__, requested_cores=cores, lengthy_computation=False))
+        cores = min(cores, len(pix_ranges))
+
+        if cores <= 1:
+            for start_pix, end_pix in pix_ranges:
+                for block in parse_ndf_pixels(self.__data__, self.__pixel_indices__, start_pix, end_pix, harm,
+                                              bin_fft):
+                    yield block
+            return
+
+        pool = mp.Pool(processes=cores, initializer=_init_ndf_worker,
+                       initargs=(self.__file_path__, self.__pixel_indices__, harm, bin_fft))
+        """
+        Keep at most two tasks per worker in flight and collect the results in the order of the tasks
+        """
+        pending = list()
+        try:
+            for pix_range in pix_ranges:
+                pending.append(pool.apply_async(_parse_ndf_pixels, (pix_range,)))
+                if len(pending) >= 2 * cores:
+                    for block in pending.pop(0).get():
+                        yield block
+            for job in pending:
+                for block in job.get():
+                    yield block
+        finally:
+            # Also shuts the workers down if the caller stops iterating early
+            pool.terminate()
+            pool.join()
+        
+
+class BEPSndfPixelBlock(object):
     """
-    Stands for BEPS (new data format) Pixel. 
-    This class parses (and keeps) the stream of data contained in a single cell of a BEPS data set of the new data 
-    format. Access desired parameter directly without get methods.
+    Parses (and keeps) the data contained in a block of consecutive pixels of the same layout
+    from a BEPS data set of the new data format. The pixels are decoded together with array operations.
+    Attributes that vary from pixel to pixel are arrays whose first axis is the pixel.
+    Access desired parameter directly without get methods.
     """
-    
-    def __init__(self, data_vec, harm=1, bin_fft=None):
+
+    def __init__(self, data_mat, harm=1, bin_fft=None):
         """
-        Initializes the pixel instance by parsing the provided data. 
-        
+        Initializes the block by parsing the provided data.
+
         Parameters
         ----------
-        data_vec : 1D float numpy array
-            Data contained within each pixel
+        data_mat : 2D float numpy array
+            Data contained within each pixel arranged as [pixel, value]
         harm: unsigned int
             Harmonic of the BE waveform. absolute value of the wave type used to normalize the response waveform.
+        bin_fft : 1D complex numpy array, optional
+            FFT of the BE waveform in the bins. Replaces the waveform stored in the pixels if provided
 
         """
-        
         harm = abs(harm)
         if harm > 3 or harm < 1:
             harm = 1
-            warn('Error in BEPSndfPixel: invalid wave type / harmonic provided.')
+            warn('Error in BEPSndfPixelBlock: invalid wave type / harmonic provided.')
         self.harm = harm
+        num_pix = data_mat.shape[0]
+
         # Begin parsing data:
-        self.spatial_index = int(data_vec[1])-1
-        
-        self.spectrogram_length = int(data_vec[0]) 
-        
-        # calculate indices for parsing
-        s1 = int(data_vec[2])  # total rows in pixel
-        s2 = int(data_vec[3])  # total cols in pixel
-        data_vec1 = data_vec[2:self.spectrogram_length]    
-        data_mat1 = data_vec1.reshape(s1, s2)
-        spect_size1 = int(data_mat1[1, 0])  # total rows in spectrogram set
+        self.spatial_index = data_mat[:, 1].astype(np.int64) - 1
+
+        self.spectrogram_length = int(data_mat[0, 0])
+
+        # calculate indices for parsing. These are the same for all pixels of the same length
+        s1 = int(data_mat[0, 2])  # total rows in pixel
+        s2 = int(data_mat[0, 3])  # total cols in pixel
+        data_mats = data_mat[:, 2:self.spectrogram_length].reshape(num_pix, s1, s2)
+        spect_size1 = int(data_mats[0, 1, 0])  # total rows in spectrogram set
         self.num_bins = int(spect_size1/2)   # or, len(BE_bin_w)
-        self.num_steps = int(data_mat1[1, 1])  # total cols in spectrogram set 
+        self.num_steps = int(data_mats[0, 1, 1])  # total cols in spectrogram set
         s3 = int(s1-spect_size1)  # row index of beginning of spectrogram set
         s4 = int(s2-self.num_steps)  # col index of beginning of spectrogram set
-            
-        self.wave_label = data_mat1[2, 0]  # This is useless
-        self.wave_modulation_type = data_mat1[2, 1]  # this is the one with useful information
-        # print 'Pixel #',self.spatial_index,' Wave label: ',self.wave_label, ', Wave Type: ', self.wave_modulation_type
-        
-        # First get the information from the columns:   
-        fft_be_wave_real = data_mat1[s3:s3-0+self.num_bins, 1]  # real part of excitation waveform  
-        fft_be_wave_imag = data_mat1[s3+self.num_bins:s3-0+spect_size1, 1]  # imaginary part of excitation waveform  
-        
-        """ Though typecasting the combination of the real and imaginary data looks fine in HDFviewer and Spyder, 
-        Labview sees such data as an array of clusters having 'r' and 'i' elements """
-        # self.FFT_BE_wave = np.complex64(fft_be_wave_real + 1j*fft_be_wave_imag) 
-        
+
+        self.wave_label = data_mats[:, 2, 0]  # This is useless
+        self.wave_modulation_type = data_mats[:, 2, 1]  # this is the one with useful information
+
         # complex excitation waveform! due to a problem in the acquisition software, this may not be normalized properly
-        self.FFT_BE_wave = np.zeros(self.num_bins, dtype=np.complex64)
-        self.FFT_BE_wave.real = fft_be_wave_real
-        self.FFT_BE_wave.imag = fft_be_wave_imag
-        
-        del fft_be_wave_real, fft_be_wave_imag            
-        
-        self.BE_bin_w = data_mat1[s3:s3-0+self.num_bins, 2]  # vector of band frequencies
+        self.FFT_BE_wave = np.zeros((num_pix, self.num_bins), dtype=np.complex64)
+        self.FFT_BE_wave.real = data_mats[:, s3:s3+self.num_bins, 1]
+        self.FFT_BE_wave.imag = data_mats[:, s3+self.num_bins:s3+spect_size1, 1]
+
+        self.BE_bin_w = data_mats[:, s3:s3+self.num_bins, 2]  # vector of band frequencies
         # vector of band indices (out of all accessible frequencies below Nyquist frequency)
-        self.BE_bin_ind = data_mat1[s3+self.num_bins:s3-0+spect_size1, 2] 
-     
-        # Now look at the top few rows to get more information: 
-        self.daq_channel = data_mat1[2, 2]
-        # self.num_x_steps = int(data_mat1[3, 0])
-        # self.num_y_steps = int(data_mat1[4, 0])
-        self.num_z_steps = int(data_mat1[5, 0])
-        self.z_index = int(data_mat1[5, 1] - 1)
-        # self.y_index = int(data_mat1[4, 1] - 1)
-        # self.x_index = int(data_mat1[3, 1] - 1)
-        self.z_value = data_mat1[5, 2]
-        # self.y_value = data_mat1[4, 2]
-        # self.x_value = data_mat1[3, 2]
-        self.num_x_steps = int(data_mat1[4, 0])
-        self.num_y_steps = int(data_mat1[3, 0])
-        self.x_index = int(data_mat1[4, 1] - 1)
-        self.y_index = int(data_mat1[3, 1] - 1)
-        self.x_value = data_mat1[4, 2]
-        self.y_value = data_mat1[3, 2]
-
-        self.step_ind_vec = data_mat1[0, s4:]  # vector of step indices   
-        self.DC_off_vec = data_mat1[1, s4:]  # vector of dc offsets  voltages
-        self.AC_amp_vec = data_mat1[2, s4:]  # vector of ac amplitude voltages 
+        self.BE_bin_ind = data_mats[:, s3+self.num_bins:s3+spect_size1, 2]
+
+        # Now look at the top few rows to get more information:
+        self.daq_channel = data_mats[:, 2, 2]
+        self.num_z_steps = int(data_mats[0, 5, 0])
+        self.z_index = data_mats[:, 5, 1].astype(np.int64) - 1
+        self.z_value = data_mats[:, 5, 2]
+        self.num_x_steps = int(data_mats[0, 4, 0])
+        self.num_y_steps = int(data_mats[0, 3, 0])
+        self.x_index = data_mats[:, 4, 1].astype(np.int64) - 1
+        self.y_index = data_mats[:, 3, 1].astype(np.int64) - 1
+        self.x_value = data_mats[:, 4, 2]
+        self.y_value = data_mats[:, 3, 2]
+
+        self.step_ind_vec = data_mats[:, 0, s4:]  # vector of step indices
+        self.DC_off_vec = data_mats[:, 1, s4:]  # vector of dc offsets  voltages
+        self.AC_amp_vec = data_mats[:, 2, s4:]  # vector of ac amplitude voltages
 
         # matrix of noise floor data. Use this information to exclude bins during fitting
-        self.noise_floor_mat = data_mat1[3:6, s4:]
-        
-        # self.plot_group_list_mat = data_mat1[6:s3-2, s4:]  # matrix of plot groups
-        
+        self.noise_floor_mat = data_mats[:, 3:6, s4:]
+
         # Here come the optional parameter rows:
-        self.deflVolt_vec = data_mat1[s3-2, s4:]  # vector of dc cantilever deflection
-        # I think this is how the defl setpoint vec should be fixed:
+        # vector of dc cantilever deflection. I think this is how the defl setpoint vec should be fixed:
+        self.deflVolt_vec = data_mats[:, s3-2, s4:]
         self.deflVolt_vec[np.isnan(self.deflVolt_vec)] = 0
-        # so far, this vector seemed to match the DC offset vector....
-        
-        self.laser_spot_pos_vec = data_mat1[s3-1, s4:]  # NEVER used
-        
-        # Actual data for this pixel:
-        spectrogram_real_mat = data_mat1[s3:s3+self.num_bins, s4:]  # real part of response spectrogram
-        spectrogram_imag_mat = data_mat1[s3+self.num_bins:s3+spect_size1, s4:]  # imaginary part of response spectrogram
-        # Be consistent and ensure that the data is also stored as 64 bit complex as in the array creation
-        # complex part of response spectrogram
-        self.spectrogram_mat = np.complex64(spectrogram_real_mat + 1j*spectrogram_imag_mat)  
-        del spectrogram_real_mat, spectrogram_imag_mat 
+        self.laser_spot_pos_vec = data_mats[:, s3-1, s4:]  # NEVER used
+
+        # Actual data for these pixels arranged as [pixel, bin, step]:
+        self.spectrogram_mat = np.zeros((num_pix, self.num_bins, self.num_steps), dtype=np.complex64)
+        self.spectrogram_mat.real = data_mats[:, s3:s3+self.num_bins, s4:]
+        self.spectrogram_mat.imag = data_mats[:, s3+self.num_bins:s3+spect_size1, s4:]
 
         if bin_fft is not None:
-            self.FFT_BE_wave = bin_fft
+            self.FFT_BE_wave = np.tile(bin_fft, (num_pix, 1))
 
         self.spectrogram_mat = normalizeBEresponse(self.spectrogram_mat, self.FFT_BE_wave, harm)
 
+    def __len__(self):
+        return len(self.spatial_index)
+
+    def __getitem__(self, item):
+        """
+        Returns a block with a slice of the pixels of this block
+
+        Parameters
+        ----------
+        item : slice
+            Pixels to keep
+
+        Returns
+        -------
+        block : BEPSndfPixelBlock
+            Block that shares its data with this block
+        """
+        block = copy(self)
+        for name, value in vars(self).items():
+            if isinstance(value, np.ndarray):
+                setattr(block, name, value[item])
+        return block
+
+    def find_changes(self, prev_block=None):
+        """
+        Finds the pixels whose parameters differ from those of the preceding pixel.
+        See BEPSndfPixel.is_different_from for the parameters that are compared
+
+        Parameters
+        ----------
+        prev_block : BEPSndfPixelBlock, optional
+            Block holding the pixel just before this block. Only its last pixel is used
+
+        Returns
+        -------
+        changes : 1D numpy array of unsigned ints
+            Indices of the pixels in this block that differ from the pixel before them
+        """
+        changed = np.zeros(len(self), dtype=bool)
+        reasons = [''] * len(self)
+        prev = self[:1] if prev_block is None else prev_block[len(prev_block) - 1:]
+
+        # Go from the least to the most important criterion so that the first failing check provides the reason
+        checks = [('Bin Frequencies', 'BE_bin_w'), ('BE FFT', 'FFT_BE_wave'),
+                  ('AC amplitude (UDVS)', 'AC_amp_vec'), ('DC offset (UDVS)', 'DC_off_vec'),
+                  ('deflVolt_vec', 'deflVolt_vec')]
+        for reason, name in reversed(checks):
+            prev_vals = getattr(prev, name)
+            vals = getattr(self, name)
+            if prev_vals.shape[1:] == vals.shape[1:]:
+                vals = np.concatenate((prev_vals, vals), axis=0)
+                differs = np.any(vals[1:] != vals[:-1], axis=1)
+            else:
+                differs = np.hstack(([True], np.any(vals[1:] != vals[:-1], axis=1)))
+            for pix_ind in np.flatnonzero(differs):
+                changed[pix_ind], reasons[pix_ind] = True, reason
+
+        for reason, name in [('Number of bins', 'num_bins'), ('Spectrogram Length', 'spectrogram_length')]:
+            if getattr(self, name) != getattr(prev, name):
+                changed[0], reasons[0] = True, reason
+
+        changes = np.flatnonzero(changed)
+        for pix_ind in changes:
+            print('{} changed on pixel {}'.format(reasons[pix_ind], self.spatial_index[pix_ind]))
+
+        return changes
+
+
+class BEPSndfPixel(object):
+    """
+    Stands for BEPS (new data format) Pixel. 
+    This class parses (and keeps) the stream of data contained in a single cell of a BEPS data set of the new data 
+    format. Access desired parameter directly without get methods.
+    """
+    
+    def __init__(self, data_vec, harm=1, bin_fft=None):
+        """
+        Initializes the pixel instance by parsing the provided data. 
+        
+        Parameters
+        ----------
+        data_vec : 1D float numpy array
+            Data contained within each pixel
+        harm: unsigned int
+            Harmonic of the BE waveform. absolute value of the wave type used to normalize the response waveform.
+
+        """
+        # The pixel is parsed as a block of one pixel
+        block = BEPSndfPixelBlock(np.atleast_2d(data_vec), harm, bin_fft)
+        for name, value in vars(block).items():
+            setattr(self, name, value[0] if isinstance(value, np.ndarray) else value)
+
         #  Reshape as one column (its free in Python anyway):
         temp_mat = self.spectrogram_mat.transpose() 
         self.spectrogram_vec = temp_mat.reshape(self.spectrogram_mat.size)
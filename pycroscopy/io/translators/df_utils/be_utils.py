@@ -7,6 +7,7 @@ Created on Tue Jan 05 07:55:56 2016
 
 from __future__ import division, print_function, absolute_import, unicode_literals
 
+import multiprocessing as mp
 from os import path
 from warnings import warn
 
@@ -21,7 +22,6 @@ from ...io_hdf5 import ioHDF5
 from ...io_utils import getAvailableMem, recommendCores
 from ...microdata import MicroDataset, MicroDataGroup
 from ....analysis.optimize import Optimize
-from ....processing.proc_utils import buildHistogram
 from ....viz.plot_utils import plot_1d_spectrum, plot_2d_spectrogram, plot_histgrams
 
 nf32 = np.dtype({'names': ['super_band', 'inter_bin_band', 'sub_band'],
@@ -274,9 +274,11 @@ def normalizeBEresponse(spectrogram_mat, FFT_BE_wave, harmonic):
     Parameters
     ------------
     spectrogram_mat : 2D complex numpy array
-        BE response arranged as [bins, steps]
+        BE response arranged as [bins, steps].
+        A stack of spectrograms arranged as [pixel, bins, steps] is also accepted
     FFT_BE_wave : 1D complex numpy array
-        FFT of the BE waveform at the appropriate bins. Number of bins must match with spectrogram_mat
+        FFT of the BE waveform at the appropriate bins. Number of bins must match with spectrogram_mat.
+        Must be arranged as [pixel, bins] if spectrogram_mat is a stack of spectrograms
     harmonic : unsigned int
         nth harmonic of the excitation waveform
         
@@ -286,18 +288,18 @@ def normalizeBEresponse(spectrogram_mat, FFT_BE_wave, harmonic):
         Normalized BE response spectrogram
 
     """  
-    BE_wave = np.fft.ifftshift(np.fft.ifft(FFT_BE_wave))
+    BE_wave = np.fft.ifftshift(np.fft.ifft(FFT_BE_wave, axis=-1), axes=-1)
     scaling_factor = 1
       
     if harmonic == 2:
-        scaling_factor = np.fft.fftshift(np.fft.fft(BE_wave**2))/(2*np.exp(1j*3*np.pi*0.5))
+        scaling_factor = np.fft.fftshift(np.fft.fft(BE_wave**2, axis=-1), axes=-1)/(2*np.exp(1j*3*np.pi*0.5))
     elif harmonic == 3:
-        scaling_factor = np.fft.fftshift(np.fft.fft(BE_wave**3))/(4*np.exp(1j*np.pi))
+        scaling_factor = np.fft.fftshift(np.fft.fft(BE_wave**3, axis=-1), axes=-1)/(4*np.exp(1j*np.pi))
     elif harmonic >= 4:
         print("Warning these high harmonics are not supported in translator.")
  
-    # Generate transfer functions
-    F_AO_spectrogram = np.transpose(np.tile(FFT_BE_wave/scaling_factor, [spectrogram_mat.shape[1], 1]))
+    # Generate transfer functions. Broadcast over the steps instead of tiling
+    F_AO_spectrogram = (FFT_BE_wave/scaling_factor)[..., np.newaxis]
     # Divide by transfer function
     spectrogram_mat = spectrogram_mat/(F_AO_spectrogram)
   
@@ -368,7 +370,8 @@ def generatePlotGroups(h5_main, hdf, mean_resp, folder_path, basename, max_resp=
 #     col_names = [col for col in col_names if col not in std_cols + ignore_plot_groups]
     
     freq_inds = spec_inds[spec_inds.attrs['Frequency']].flatten()
-    
+
+    hist_groups = list()
     for col_name in col_names:
         ref = UDVS.attrs[col_name]
 #         Make sure we're actually dealing with a reference of some type
@@ -432,12 +435,45 @@ def generatePlotGroups(h5_main, hdf, mean_resp, folder_path, basename, max_resp=
         
         if do_histogram:
             """
-            Build the histograms for the current plot group
+            The histograms of all the plot groups are built together after this loop
+            so that the data is only read once
             """
-            hist = BEHistogram()
-            hist_mat, hist_labels, hist_indices, hist_indices_labels = \
-                hist.buildPlotGroupHist(h5_main, step_inds, max_response=max_resp,
-                                        min_response=min_resp, max_mem_mb=max_mem_mb, debug=debug)
+            hist_groups.append((h5_mean_spec.parent, step_inds, col_name))
+                
+        else:
+            """
+            Write the min and max response vectors so that histograms can be generated later.
+            """
+            ds_max_resp = MicroDataset('Max_Response', max_resp)
+            ds_min_resp = MicroDataset('Min_Response', min_resp)
+            plot_grp.addChildren([ds_max_resp, ds_min_resp])
+        
+        if save_plots or show_plots:
+            fig_title = '_'.join(grp.name[1:].split('/')+[col_name])
+            path_1d = None
+            path_2d = None
+            if save_plots:
+                path_1d = path.join(folder_path, basename + '_Step_Avg_' + fig_title + '.png')
+                path_2d = path.join(folder_path, basename + '_Mean_Spec_' + fig_title + '.png')
+            plot_1d_spectrum(step_averaged_vec, freq_vec, fig_title, figure_path=path_1d)
+            plot_2d_spectrogram(mean_spec, freq_vec, fig_title, figure_path=path_2d)
+            
+            if show_plots:
+                plt.show()
+            plt.close('all')
+        # print('Generated spatially average data for group: %s' %(col_name))
+
+    if len(hist_groups) > 0:
+        """
+        Build the histograms for all the plot groups
+        """
+        hist = BEHistogram()
+        p_group_hists = hist.buildPlotGroupHists(h5_main, [step_inds for _, step_inds, _ in hist_groups],
+                                                 max_response=max_resp, min_response=min_resp,
+                                                 max_mem_mb=max_mem_mb, debug=debug)
+
+        for (h5_plt_grp, _, col_name), group_hist in zip(hist_groups, p_group_hists):
+            hist_mat, hist_labels, hist_indices, hist_indices_labels = group_hist
             ds_hist = MicroDataset('Histograms', hist_mat, dtype=np.int32,
                                    chunking=(1, hist_mat.shape[1]),compression='gzip')
             hist_slice_dict = dict()
@@ -453,7 +489,7 @@ def generatePlotGroups(h5_main, hdf, mean_resp, folder_path, basename, max_resp=
             ds_hist_indices.attrs['labels'] = hist_ind_dict
             ds_hist_values.attrs['labels'] = hist_ind_dict
 
-            hist_grp = MicroDataGroup('Histogram', h5_mean_spec.parent.name[1:])
+            hist_grp = MicroDataGroup('Histogram', h5_plt_grp.name[1:])
 
             hist_grp.addChildren([ds_hist, ds_hist_indices, ds_hist_values])
             
@@ -467,33 +503,17 @@ def generatePlotGroups(h5_main, hdf, mean_resp, folder_path, basename, max_resp=
             
             h5_hist.attrs['Spectroscopic_Indices'] = h5_hist_inds.ref
             h5_hist.attrs['Spectroscopic_Values'] = h5_hist_vals.ref
-                
-        else:
-            """
-            Write the min and max response vectors so that histograms can be generated later.
-            """
-            ds_max_resp = MicroDataset('Max_Response', max_resp)
-            ds_min_resp = MicroDataset('Min_Response', min_resp)
-            plot_grp.addChildren([ds_max_resp, ds_min_resp])
-        
-        if save_plots or show_plots:
-            fig_title = '_'.join(grp.name[1:].split('/')+[col_name])
-            path_1d = None
-            path_2d = None
-            path_hist = None
-            if save_plots:
-                path_1d = path.join(folder_path, basename + '_Step_Avg_' + fig_title + '.png')
-                path_2d = path.join(folder_path, basename + '_Mean_Spec_' + fig_title + '.png')
-                path_hist = path.join(folder_path, basename + '_Histograms_' + fig_title + '.png')
-            plot_1d_spectrum(step_averaged_vec, freq_vec, fig_title, figure_path=path_1d)
-            plot_2d_spectrogram(mean_spec, freq_vec, fig_title, figure_path=path_2d)
-            if do_histogram:
+
+            if save_plots or show_plots:
+                fig_title = '_'.join(grp.name[1:].split('/')+[col_name])
+                path_hist = None
+                if save_plots:
+                    path_hist = path.join(folder_path, basename + '_Histograms_' + fig_title + '.png')
                 plot_histgrams(hist_mat, hist_indices, grp.name, figure_path=path_hist)
-            
-            if show_plots:
-                plt.show()
-            plt.close('all')
-        # print('Generated spatially average data for group: %s' %(col_name))
+                if show_plots:
+                    plt.show()
+                plt.close('all')
+
     print('Completed generating spatially averaged plot groups')
 
 ###############################################################################
@@ -1170,12 +1190,110 @@ def createSpecVals(udvs_mat, spec_inds, bin_freqs, bin_wfm_type, parm_dict,
     return ds_spec_val_mat, ds_spec_inds_mat, ds_spec_val_labs, ds_spec_val_units, spec_vals_labs_names
 
 
+# Binning parameters shared by the histogram workers. Set once per worker by _init_hist_worker
+_worker_hist_parms = None
+
+
+def bin_be_chunk(data_mat, group_cols, group_x_offsets, num_x_bins, num_y_bins, min_resp, max_resp):
+    """
+    Bins the amplitude, phase, real and imaginary parts of a chunk of pixels for all plot groups at once.
+    All four quantities of a plot group are counted in a single call to bincount and the scaled values
+    are discretized in place in one reused buffer.
+
+    Parameters
+    ----------
+    data_mat : 2D numpy complex array
+        Chunk of the Raw_Data arranged as [pixel, spectral step]
+    group_cols : list of 1D numpy arrays
+        Spectral steps (columns) of each plot group
+    group_x_offsets : list of 1D numpy arrays
+        Frequency bin of each column of each plot group
+    num_x_bins : unsigned int
+        Number of frequency bins
+    num_y_bins : unsigned int
+        Number of response bins
+    min_resp : float
+        Minimum amplitude, real and imaginary response to bin
+    max_resp : float
+        Maximum amplitude, real and imaginary response to bin
+
+    Returns
+    -------
+    hists : list of 3D numpy arrays
+        Amplitude, phase, real and imaginary histograms of each plot group
+        arranged as [quantity, frequency bin, response bin]
+    """
+    bounds = [(min_resp, max_resp), (-np.pi, np.pi), (min_resp, max_resp), (min_resp, max_resp)]
+    hist_size = len(bounds) * num_x_bins * num_y_bins
+
+    hists = list()
+    for cols, x_offsets in zip(group_cols, group_x_offsets):
+        group_data = data_mat[:, cols]
+        vals = np.empty(group_data.shape, dtype=group_data.real.dtype)
+        bin_inds = np.empty((len(bounds),) + group_data.shape, dtype=np.intp)
+
+        for ifunc, (min_val, max_val) in enumerate(bounds):
+            if ifunc == 0:
+                np.abs(group_data, out=vals)
+            elif ifunc == 1:
+                np.arctan2(group_data.imag, group_data.real, out=vals)
+            elif ifunc == 2:
+                vals[:] = group_data.real
+            else:
+                vals[:] = group_data.imag
+            '''
+            Scale to [0, num_y_bins - 1] and discretize without making any temporary copies
+            '''
+            np.clip(vals, min_val, max_val, out=vals)
+            vals -= min_val
+            vals *= 1.0 / (max_val - min_val)
+            vals *= num_y_bins - 1
+            np.rint(vals, out=vals)
+
+            bin_inds[ifunc] = vals
+            bin_inds[ifunc] += (ifunc * num_x_bins + x_offsets) * num_y_bins
+
+        hists.append(np.bincount(bin_inds.ravel(), minlength=hist_size).reshape(len(bounds), num_x_bins,
+                                                                                num_y_bins))
+
+    return hists
+
+
+def _init_hist_worker(hist_parms):
+    """
+    Makes the binning parameters available to the histogram tasks of this worker
+
+    Parameters
+    ----------
+    hist_parms : dict
+        Keyword arguments for bin_be_chunk other than data_mat
+    """
+    global _worker_hist_parms
+    _worker_hist_parms = hist_parms
+
+
+def _bin_chunk_task(data_mat):
+    """
+    Bins a chunk of pixels using the parameters given to this worker
+
+    Parameters
+    ----------
+    data_mat : 2D numpy complex array
+        Chunk of the Raw_Data arranged as [pixel, spectral step]
+
+    Returns
+    -------
+    hists : list of 3D numpy arrays
+        Partial histograms of each plot group
+    """
+    return bin_be_chunk(data_mat, **_worker_hist_parms)
+
+
 """
 BEHistogram Class and Functions
 """
 class BEHistogram():
     # TODO: Turn into proper class
-    # TODO: Parallelize Histogram generation
     """
     Class just functions as a container so we can have shared objects
     Chris Smith -- csmith55@utk.edu
@@ -1207,8 +1325,6 @@ class BEHistogram():
         print('Adding Histograms to file {}'.format(h5_file.name))
         print('Path to HDF5 file is {}'.format(hdf.path))
 
-        max_mem = min(max_mem_mb*1024**2,0.75*getAvailableMem())
-
         h5_main = getDataSet(h5_file, 'Raw_Data')
         h5_udvs = getDataSet(h5_file,'UDVS')
 
@@ -1225,27 +1341,36 @@ class BEHistogram():
 
             print('{} Plot groups in {}'.format(len(p_groups),group.name))
 
-            for ip, p_group in enumerate(p_groups):
-                try:
-                    max_resp = getDataSet(group,'Max_Response')
-                    min_resp = getDataSet(group,'Min_Response')
-                except:
-                    warn('Maximum and Minimum Response vectors not found for {}.'.format(p_group.name))
-                    max_resp = []
-                    min_resp = []
+            try:
+                max_resp = getDataSet(group,'Max_Response')
+                min_resp = getDataSet(group,'Min_Response')
+            except:
+                warn('Maximum and Minimum Response vectors not found for {}.'.format(group.name))
+                max_resp = []
+                min_resp = []
 
-                print('Creating BEHistogram for Plot Group {}'.format(p_group.name))
+            """
+            Find the active UDVS steps of every plot group so that all the
+            histograms can be binned from a single pass over the data
+            """
+            p_group_steps = list()
+            for p_group in p_groups:
                 udvs_lab = p_group.attrs['Name']
                 udvs_col = h5_udvs[im][h5_udvs[im].attrs[udvs_lab]]
-                actual_udvs_steps = np.where(np.isnan(udvs_col)==False)[0]
+                p_group_steps.append(np.where(np.isnan(udvs_col)==False)[0])
 
+            print('Creating BEHistograms for {} Plot Groups in {}'.format(len(p_groups), group.name))
+            hist = BEHistogram()
+            p_group_hists = hist.buildPlotGroupHists(h5_main[im], p_group_steps, max_response=max_resp,
+                                                     min_response=min_resp, max_mem_mb=max_mem_mb)
+
+            for ip, p_group in enumerate(p_groups):
                 """
                 Add the BEHistogram for the current plot group
                 """
                 plot_grp = MicroDataGroup(p_group.name.split('/')[-1], group.name[1:])
-                plot_grp.attrs['Name'] = udvs_lab
-                hist = BEHistogram()
-                hist_mat, hist_labels, hist_indices, hist_indices_labels = hist.buildPlotGroupHist(h5_main[im], actual_udvs_steps, max_response=max_resp, min_response=min_resp, max_mem_mb=max_mem)
+                plot_grp.attrs['Name'] = p_group.attrs['Name']
+                hist_mat, hist_labels, hist_indices, hist_indices_labels = p_group_hists[ip]
                 ds_hist = MicroDataset('Histograms',hist_mat, dtype=np.int32, chunking=(1,hist_mat.shape[1]),compression='gzip')
                 hist_slice_dict = dict()
                 for hist_ind, hist_dim in enumerate(hist_labels):
@@ -1372,10 +1497,52 @@ class BEHistogram():
         hist_index_labels : list of strings
             labels for the hist_indices array
 
+        """
+        return self.buildPlotGroupHists(h5_main, [active_spec_steps], max_response=max_response,
+                                        min_response=min_response, max_mem_mb=max_mem_mb, max_bins=max_bins,
+                                        std_mult=std_mult, debug=debug)[0]
+
+    def buildPlotGroupHists(self, h5_main, plot_group_steps, max_response=[],
+                            min_response=[], max_mem_mb=1024, max_bins=256,
+                            std_mult=3, cores=None, debug=False):
+        """
+        Creates Histograms for several plot groups while reading the dataset only once
+
+        Parameters
+        ----------
+        h5_main : HDF5 Dataset object
+            Dataset to be historammed
+        plot_group_steps : list of numpy arrays
+            active spectral steps in each plot group
+        max_response : numpy array
+            maximum amplitude at each pixel
+        min_response : numpy array
+            minimum amplitude at each pixel
+        max_mem_mb : Unsigned integer
+            maximum number of Mb allowed for use.  Used to calculate the
+            number of pixels to load in a chunk
+        max_bins : integer
+            maximum number of spectroscopic bins
+        std_mult : integer
+            number of standard deviations from the mean of
+            max_response and min_response to include in
+            binning
+        cores : unsigned integer, optional
+            number of processes used to bin the pixels.
+            Default - None - set by recommendCores
+        debug : boolean
+            Turns on debug printing statements if true.  Default False.
+
+        Returns
+        -------
+        plot_group_hists : list of tuples
+            hist_mat, hist_labels, hist_indices, hist_index_labels for each plot group
+            as returned by buildPlotGroupHist
+
         """
         free_mem = getAvailableMem()
         if debug: print('We have {} bytes of memory available'.format(free_mem))
-        self.max_mem = min(max_mem_mb,0.75*free_mem)
+        self.max_mem = min(max_mem_mb*1024**2,0.75*free_mem)
 
         """
         Check that max_response and min_response have been defined.
@@ -1396,8 +1563,7 @@ class BEHistogram():
         spec_ind_mat = getAuxData(h5_main,auxDataName=['Spectroscopic_Indices'])[0].value
         self.N_spectral_steps = np.size(step_ind_mat)
 
-        active_udvs_steps = np.unique(step_ind_mat[active_spec_steps])
-        self.num_udvs_steps = len(active_udvs_steps)
+        group_udvs_steps = [np.unique(step_ind_mat[active_spec_steps]) for active_spec_steps in plot_group_steps]
 
         """
         Set up frequency axis of histogram, same for all histograms in a single dataset
@@ -1415,15 +1581,16 @@ class BEHistogram():
 #         self.N_y_bins = np.int(np.min( (max_bins, np.rint(np.sqrt(self.N_pixels*self.N_spectral_steps)))))
         self.N_y_bins = np.int(np.min( (max_bins, np.rint(2*(self.N_pixels*self.N_spectral_steps)**(1.0/3.0)))))
 
+        ds_hists = self.__datasetHists(h5_main, group_udvs_steps, x_hist, cores=cores, debug=debug)
 
-        ds_hist = self.__datasetHist(h5_main, active_udvs_steps, x_hist, debug)
-        if debug: print(np.shape(ds_hist))
-        if debug: print('ds_hist max',np.max(ds_hist),
-                        'ds_hist min',np.min(ds_hist))
-
-        hist_mat, hist_labels, hist_indices, hist_index_labels = self.__reshapeHist(ds_hist)
+        plot_group_hists = list()
+        for ds_hist in ds_hists:
+            if debug: print(np.shape(ds_hist))
+            if debug: print('ds_hist max',np.max(ds_hist),
+                            'ds_hist min',np.min(ds_hist))
+            plot_group_hists.append(self.__reshapeHist(ds_hist))
 
-        return hist_mat, hist_labels, hist_indices, hist_index_labels
+        return plot_group_hists
 
     def __reshapeHist(self,ds_hist):
         """
@@ -1483,101 +1650,93 @@ class BEHistogram():
             the 4 histogram matrices
 
         """
+        return self.__datasetHists(h5_main, [active_udvs_steps], x_hist, debug=debug)[0]
 
-
+    def __datasetHists(self, h5_main, group_udvs_steps, x_hist, cores=None, debug=False):
         """
-        Estimate maximum number of pixels to read at once
-        """
-        max_pixels = maxReadPixels(self.max_mem,self.N_pixels, self.num_udvs_steps, bytes_per_bin=h5_main.dtype.itemsize*self.N_y_bins*self.N_freqs)
+        Create the histograms for several plot groups while reading the dataset only once
 
-        """
-        Divide the pixels into chunks that will fit in memory
-        """
-        pix_chunks = np.append(np.arange(0,self.N_pixels,max_pixels,dtype=np.int),self.N_pixels)
+        Parameters
+        ----------
+        h5_main : HDF5 Dataset
+            Main_Dataset to be histogramed
+        group_udvs_steps : list of numpy arrays
+            the active udvs steps in each plot group
+        x_hist : 2d numpy array
+            the spectroscopic indices matrix, used to find the
+            spectroscopic indices of each udvs step
+        cores : unsigned int, optional
+            number of processes used to bin the chunks of pixels.
+            Default - None - set by recommendCores
+        debug : boolean
+            Turns on debug printing statements if true.  Default False.
 
-        """
-        Initialize the histograms
-        """
-        ds_hist = np.zeros((4,self.N_freqs,self.N_y_bins),dtype=np.int32)
+        Returns
+        -------
+        ds_hists : list of numpy arrays
+            the 4 histogram matrices of each plot group
 
         """
-        loop over pixels
         """
-        for ichunk in range(len(pix_chunks)-1):
-            if debug: print('pixel chunk', ichunk)
-
-            chunk = range(pix_chunks[ichunk], pix_chunks[ichunk+1])
+        The frequency bin of each column is its offset from the first column of its UDVS step
+        """
+        _, first_cols, step_inverse = np.unique(x_hist[1], return_index=True, return_inverse=True)
+        x_offsets = np.asarray(x_hist[0] - x_hist[0][first_cols[step_inverse]], dtype=np.intp)
 
-            """
-        Loop over active UDVS steps
-            """
-            for iudvs in range(self.num_udvs_steps):
-                selected = (iudvs+chunk[0]*self.num_udvs_steps) % np.rint(self.num_udvs_steps*self.N_pixels/10) == 0
-                if selected:
-                    per_done = np.rint(100*(iudvs+chunk[0]*self.num_udvs_steps)/(self.num_udvs_steps*self.N_pixels))
-                    print('Binning BEHistogram...{}% --pixels {}-{}, step # {}'.format(per_done,chunk[0],chunk[-1],iudvs))
-                udvs_step = active_udvs_steps[iudvs]
-                if debug: print('udvs step', udvs_step)
+        group_cols = [np.where(np.in1d(x_hist[1], udvs_steps))[0] for udvs_steps in group_udvs_steps]
+        hist_parms = {'group_cols': group_cols,
+                      'group_x_offsets': [x_offsets[cols] for cols in group_cols],
+                      'num_x_bins': self.N_freqs,
+                      'num_y_bins': self.N_y_bins,
+                      'min_resp': self.min_response,
+                      'max_resp': self.max_response}
 
-                """
-        Get the correct Spectroscopic bins for the current UDVS step
-        Read desired pixel chunk from these bins for Main_Data into data_mat
-                """
-                udvs_bins = np.where(x_hist[1] == udvs_step)[0]
-                if debug:
-                    print(np.shape(x_hist))
-                data_mat = h5_main[pix_chunks[ichunk]:pix_chunks[ichunk+1], (udvs_bins)]
+        """
+        Estimate maximum number of pixels to read at once.
+        Each worker holds a chunk, the copy for a plot group, the scaled values and the bin indices
+        """
+        cores = max(1, recommendCores(self.N_pixels, requested_cores=cores, lengthy_computation=False))
+        bytes_per_bin = 2 * h5_main.dtype.itemsize + 4 * np.dtype(np.intp).itemsize
+        max_pixels = maxReadPixels(self.max_mem / cores, self.N_pixels, h5_main.shape[1],
+                                   bytes_per_bin=bytes_per_bin)
+        pix_chunks = np.append(np.arange(0, self.N_pixels, max_pixels, dtype=np.int), self.N_pixels)
+        if debug: print('Binning in {} chunks using {} cores'.format(len(pix_chunks) - 1, cores))
 
-                """
-        Get the frequecies that correspond to the current UDVS bins from the total x_hist
-                """
-                this_x_hist = np.take(x_hist[0], udvs_bins)
-                this_x_hist = this_x_hist-this_x_hist[0]
-                this_x_hist = np.transpose(np.tile(this_x_hist, (1, pix_chunks[ichunk+1]-pix_chunks[ichunk])))
-                this_x_hist = np.squeeze(this_x_hist)
-
-                N_x_bins = np.shape(this_x_hist)[0]
-                if debug:
-                    print('N_x_bins',N_x_bins)
-                    print(this_x_hist)
-                    print(np.shape(this_x_hist))
-                """
-        Create weighting vector.  If setting all to one value, can be a scalar.
-                """
-                weighting_vec = 1
+        ds_hists = [np.zeros((4, self.N_freqs, self.N_y_bins), dtype=np.int64) for _ in group_cols]
 
-                if debug: print(np.shape(data_mat))
+        def merge(chunk_hists):
+            for ds_hist, chunk_hist in zip(ds_hists, chunk_hists):
+                ds_hist += chunk_hist
 
+        pool = None
+        if cores > 1:
+            pool = mp.Pool(processes=cores, initializer=_init_hist_worker, initargs=(hist_parms,))
+        pending = list()
+        try:
+            for ichunk in range(len(pix_chunks) - 1):
+                per_done = np.rint(100 * pix_chunks[ichunk] / self.N_pixels)
+                print('Binning BEHistogram...{}% --pixels {}-{}'.format(per_done, pix_chunks[ichunk],
+                                                                       pix_chunks[ichunk + 1] - 1))
                 """
-        Set up the list of functions to call and their corresponding maxima and minima
+                Every plot group is binned from the same read of the chunk
                 """
-                func_list = [np.abs, np.angle, np.real, np.imag]
-                max_list = [self.max_response, np.pi, self.max_response, self.max_response]
-                min_list = [self.min_response, -np.pi, self.min_response, self.min_response]
+                data_mat = h5_main[pix_chunks[ichunk]:pix_chunks[ichunk + 1], :]
+                if pool is None:
+                    merge(bin_be_chunk(data_mat, **hist_parms))
+                    continue
                 """
-        Get the Histograms and store in correct place in ds_hist
+                Keep at most two chunks per worker in flight so that the whole dataset is never in memory
                 """
-                for ifunc, func in enumerate(func_list):
-                    chunk_hist = buildHistogram(this_x_hist,
-                                                data_mat,
-                                                N_x_bins,
-                                                self.N_y_bins,
-                                                weighting_vec,
-                                                min_list[ifunc],
-                                                max_list[ifunc],
-                                                func,
-                                                debug)
-                    if debug:
-                        print('chunkhist-{}'.format(func.__name__), np.shape(chunk_hist))
-                        print(chunk_hist.dtype)
-
-                    for (i, ifreq) in enumerate(udvs_bins):
-                        ids_freq = this_x_hist[i]
-                        if debug:
-                            print(i, ifreq)
-                            print(ids_freq)
-                        ds_hist[ifunc, ids_freq, :] = np.add(ds_hist[ifunc, ids_freq, :], chunk_hist[i, :])
-
-        return ds_hist
-
-    
\ No newline at end of file
+                pending.append(pool.apply_async(_bin_chunk_task, (data_mat,)))
+                if len(pending) >= 2 * cores:
+                    merge(pending.pop(0).get())
+
+            for job in pending:
+                merge(job.get())
+        finally:
+            # The workers are shut down even if binning a chunk fails
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        return [np.int32(ds_hist) for ds_hist in ds_hists]
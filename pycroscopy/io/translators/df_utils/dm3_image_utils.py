@@ -52,14 +52,28 @@ dm_image_dtypes = {
 }
 
 
-def imagedatadict_to_ndarray(imdict):
+def imagedatadict_to_ndarray(imdict, memmap=False):
     """
     Converts the ImageData dictionary, imdict, to an nd image.
+    Data that was left in the file is read with a single call to
+    np.fromfile or memory mapped if memmap is True.
     """
     arr = imdict['Data']
     im = None
     if isinstance(arr, array.array):
         im = np.asarray(arr, dtype=arr.typecode)
+    elif isinstance(arr, filearray):
+        t = tuple(arr.typecodes)
+        if t in structarray_to_np_map:
+            dtype = np.dtype(structarray_to_np_map[t])
+        else:
+            dtype = np.dtype(t[0])
+        if memmap:
+            im = np.memmap(arr.file_name, dtype=dtype, mode='r', offset=arr.offset, shape=(arr.length,))
+        else:
+            with open(arr.file_name, 'rb') as f:
+                f.seek(arr.offset)
+                im = np.fromfile(f, dtype=dtype, count=arr.length)
     elif isinstance(arr, structarray):
         t = tuple(arr.typecodes)
         im = np.frombuffer(
@@ -91,19 +105,19 @@ def ndarray_to_imagedatadict(nparr):
     return ret
 
 
-def load_image(file):
+def load_image(file, memmap=False):
     """
     Loads the image from the file-like object or string file.
     If file is a string, the file is opened and then read.
     Returns a numpy ndarray of our best guess for the most important image
-    in the file.
+    in the file. The image is a read-only np.memmap if memmap is True.
     """
     if isinstance(file, str):
         with open(file, "rb") as f:
-            return load_image(f)
+            return load_image(f, memmap=memmap)
     dmtag = parse_dm_header(file)
     img_index = -1
-    return imagedatadict_to_ndarray(dmtag['ImageList'][img_index]['ImageData'])
+    return imagedatadict_to_ndarray(dmtag['ImageList'][img_index]['ImageData'], memmap=memmap)
 
 
 def save_image(image, file):
@@ -10,6 +10,7 @@ from __future__ import division, print_function, absolute_import, unicode_litera
 import collections
 import struct
 import array 
+import numpy as np
 
 DM4Header = collections.namedtuple('DM4Header', ('version', 'root_length', 'little_endian')) 
 DM4TagHeader = collections.namedtuple('DM4TagHeader', ('type', 'name', 'byte_length', 'array_length', 'data_type_code', 'header_offset', 'data_offset'))
@@ -241,6 +242,22 @@ def read_tag_data_array(dmfile, tag, endian):
     data = array.array(data_type.type_format)
     data.fromfile(dmfile, array_length)
     return data
+
+def read_tag_array_location(dmfile, tag):
+    '''Finds where the values of an array tag start in the file without reading them.
+       :return: offset of the first value, numpy dtype of the values and number of values'''
+    dmfile.seek(tag.data_offset)
+    
+    _read_tag_garbage_str(dmfile)
+    
+    (tag_array_length,  tag_array_types) = _read_tag_data_info(dmfile)
+    
+    assert(tag_array_types[0] == 20)
+    assert(len(tag_array_types) == 3)
+    
+    data_type = DM4DataTypeDict[tag_array_types[1]]
+    # Same (native) byte order as array.fromfile in read_tag_data_array
+    return dmfile.tell(), np.dtype(data_type.type_format), tag_array_types[2]
         
       
 class DM4File:
@@ -280,6 +297,18 @@ class DM4File:
     def read_tag_data(self, tag):
         '''Read the data associated with the passed tag'''
         return _read_tag_data(self.hfile, tag, self.endian_str)
+    
+    def read_tag_array(self, tag, memmap=False):
+        '''Read the values of the passed array tag with a single np.fromfile call.
+           :param bool memmap: Memory map the values instead of reading them
+           :rtype: numpy.ndarray or numpy.memmap'''
+        try:
+            (offset, dtype, array_length) = read_tag_array_location(self.hfile, tag)
+            if memmap:
+                return np.memmap(self.hfile.name, dtype=dtype, mode='r', offset=offset, shape=(array_length,))
+            return np.fromfile(self.hfile, dtype=dtype, count=array_length)
+        finally:
+            self.hfile.seek(tag.data_offset + tag.byte_length)
      
     
     DM4TagDir = collections.namedtuple('DM4Dir', ('name', 'dm4_tag', 'named_subdirs', 'unnamed_subdirs','named_tags', 'unnamed_tags'))
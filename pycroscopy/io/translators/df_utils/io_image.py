@@ -7,13 +7,18 @@ Created on Nov 8, 2016
 from __future__ import division, print_function, absolute_import, unicode_literals
 
 import array
+import multiprocessing as mp
 import os
+from itertools import islice
 
 import numpy as np
 from skimage.io import imread
+from sklearn.utils import gen_batches
 
 from . import dm4reader
 from .dm3_image_utils import parse_dm_header, imagedatadict_to_ndarray
+from ..utils import read_text_rows
+from ...io_utils import recommendCores
 
 
 def read_image(image_path, *args, **kwargs):
@@ -49,7 +54,7 @@ def read_image(image_path, *args, **kwargs):
         return imread(image_path, *args, **kwargs), dict()
 
 
-def read_dm3(image_path, get_parms=True):
+def read_dm3(image_path, get_parms=True, memmap=False):
     """
     Read an image from a dm3 file into a numpy array
 
@@ -58,6 +63,10 @@ def read_dm3(image_path, get_parms=True):
     get_parms : Boolean, optional
         Should the parameters from the dm3 file be returned
         Default True
+    memmap : Boolean, optional
+        Should the image be memory mapped instead of being read into memory.
+        Useful for large stacks that are written to HDF5 a block at a time.
+        Default False
 
     Returns
     -------
@@ -65,10 +74,10 @@ def read_dm3(image_path, get_parms=True):
         Array containing the image from the file `image_path`
 
     """
-    image_file = open(image_path, 'rb')
-    dmtag = parse_dm_header(image_file)
+    with open(image_path, 'rb') as image_file:
+        dmtag = parse_dm_header(image_file)
     img_index = -1
-    image = imagedatadict_to_ndarray(dmtag['ImageList'][img_index]['ImageData'])
+    image = imagedatadict_to_ndarray(dmtag['ImageList'][img_index]['ImageData'], memmap=memmap)
     image_parms = dmtag['ImageList'][img_index]['ImageTags']
 
     if get_parms:
@@ -115,6 +124,8 @@ def read_dm4(file_path, *args, **kwargs):
     ----------
     file_path : str
         Path to the file to be read
+    memmap : Boolean, optional
+        Should the image be memory mapped instead of being read into memory. Default False
 
     Returns
     -------
@@ -126,6 +137,7 @@ def read_dm4(file_path, *args, **kwargs):
     """
     get_parms = kwargs.pop('get_parms', True)
     header = kwargs.pop('header', None)
+    memmap = kwargs.pop('memmap', False)
 
     file_parms = dict()
     dm4_file = dm4reader.DM4File.open(file_path)
@@ -137,15 +149,19 @@ def read_dm4(file_path, *args, **kwargs):
         dm4_file.hfile.seek(header.offset)
         image_list = dm4_file.read_directory(header)
 
-    for image_dir in image_list:
-        image_data_tag = image_dir.named_subdirs['ImageData']
-        image_tag = image_data_tag.named_tags['Data']
+    # Only the last image is returned. The others (eg. - thumbnails) are not read
+    image_dir = image_list[-1]
+    image_data_tag = image_dir.named_subdirs['ImageData']
+    image_tag = image_data_tag.named_tags['Data']
 
-        x_dim = dm4_file.read_tag_data(image_data_tag.named_subdirs['Dimensions'].unnamed_tags[0])
-        y_dim = dm4_file.read_tag_data(image_data_tag.named_subdirs['Dimensions'].unnamed_tags[1])
+    x_dim = dm4_file.read_tag_data(image_data_tag.named_subdirs['Dimensions'].unnamed_tags[0])
+    y_dim = dm4_file.read_tag_data(image_data_tag.named_subdirs['Dimensions'].unnamed_tags[1])
 
-        image_array = np.array(dm4_file.read_tag_data(image_tag), dtype=np.float32)
-        image_array = np.reshape(image_array, (y_dim, x_dim))
+    # Read with a single call (or memory mapped). Float32 images are not copied again
+    image_array = dm4_file.read_tag_array(image_tag, memmap=memmap)
+    if image_array.dtype != np.float32:
+        image_array = np.float32(image_array)
+    image_array = np.reshape(image_array, (y_dim, x_dim))
 
     if get_parms:
         file_parms = parse_dm4_parms(dm4_file, tags, '')
@@ -276,6 +292,8 @@ def try_tag_to_string(tag_data):
 
 def read_txt(image_path, header_lines=0, delimiter=None, *args, **kwargs):
     """
+    Reads an image from a plaintext file. Plain numeric files are parsed in a single pass with
+    read_text_rows. Files that it cannot parse and any additional arguments are handled by numpy.loadtxt instead.
 
     Parameters
     ----------
@@ -294,11 +312,25 @@ def read_txt(image_path, header_lines=0, delimiter=None, *args, **kwargs):
         Image array read from the plaintext file
 
     """
-    image = np.loadtxt(image_path, *args,
-                       skiprows=header_lines,
-                       delimiter=delimiter, **kwargs)
+    if len(args) > 0 or len(kwargs) > 0:
+        return np.loadtxt(image_path, *args,
+                          skiprows=header_lines,
+                          delimiter=delimiter, **kwargs)
 
-    return image
+    with open(image_path, 'r') as file_handle:
+        for _ in islice(file_handle, header_lines):
+            pass
+        try:
+            image = read_text_rows(file_handle, delimiter=delimiter, dtype=np.float64)
+        except ValueError:
+            image = None
+
+    if image is None:
+        # numpy.loadtxt reports exactly where the text could not be parsed
+        return np.loadtxt(image_path, skiprows=header_lines, delimiter=delimiter)
+
+    # Same shape as numpy.loadtxt, which drops dimensions of length 1
+    return np.squeeze(image)
 
 
 def no_bin(image, *args, **kwargs):
@@ -321,3 +353,239 @@ def no_bin(image, *args, **kwargs):
         The input image
     """
     return image
+
+
+def bin_images(images, bin_factor, bin_func=np.mean):
+    """
+    Bins an image or a stack of images by reshaping the binned dimensions into blocks
+    and reducing all blocks at once. Trailing pixels that do not fill a whole block are dropped.
+
+    Parameters
+    ----------
+    images : numpy.ndarray
+        Image or stack of images. The last dimensions are binned, eg. [frame, row, column]
+    bin_factor : uint or array_like of uint
+        Downsampling factor for each of the last len(bin_factor) dimensions.
+        An integer bins the last two dimensions by the same factor
+    bin_func : callable, optional
+        Function which will be called to calculate the return value of each block.
+        Function must implement an axis parameter, i.e. numpy.mean.  Default is numpy.mean.
+        numpy.mean and numpy.sum accumulate integer images as integers
+
+    Returns
+    -------
+    binned : numpy.ndarray
+        Binned image or stack of images
+    """
+    images = np.asarray(images)
+    if isinstance(bin_factor, int):
+        bin_factor = (bin_factor, bin_factor)
+    bin_factor = tuple([int(factor) for factor in bin_factor])
+    num_lead = images.ndim - len(bin_factor)
+
+    trim_slice = [Ellipsis]
+    block_shape = list(images.shape[:num_lead])
+    block_axes = list()
+    for dim_size, factor in zip(images.shape[num_lead:], bin_factor):
+        trim_slice.append(slice(0, dim_size // factor * factor))
+        block_shape += [dim_size // factor, factor]
+        block_axes.append(len(block_shape) - 1)
+    blocks = images[tuple(trim_slice)].reshape(block_shape)
+    block_axes = tuple(block_axes)
+
+    if np.issubdtype(images.dtype, np.integer) and (bin_func is np.mean or bin_func is np.sum):
+        acc_type = np.uint64 if np.issubdtype(images.dtype, np.unsignedinteger) else np.int64
+        binned = np.sum(blocks, axis=block_axes, dtype=acc_type)
+        if bin_func is np.mean:
+            binned = binned / np.prod(bin_factor)
+        return binned
+
+    return bin_func(blocks, axis=block_axes)
+
+
+def load_frame(source, image_path='', read_kwargs=None, crop_func=None, crop_args=()):
+    """
+    Reads and crops a single frame of an image stack
+
+    Parameters
+    ----------
+    source : str or numpy.ndarray
+        Name of the image file within `image_path` or the frame itself if already in memory
+    image_path : str, optional
+        Absolute path of the folder holding the image files
+    read_kwargs : dict, optional
+        Keyword arguments passed on to read_image
+    crop_func : callable, optional
+        Function called as crop_func(image, *crop_args) to crop the image.
+        Default None - no cropping
+    crop_args : tuple, optional
+        Additional arguments for `crop_func`
+
+    Returns
+    -------
+    frame : 2D numpy.ndarray
+        Frame
+    """
+    if isinstance(source, np.ndarray):
+        image = source
+    else:
+        if read_kwargs is None:
+            read_kwargs = dict()
+        image, _ = read_image(os.path.join(image_path, source), **read_kwargs)
+
+    if crop_func is not None:
+        image = crop_func(image, *crop_args)
+
+    return image
+
+
+def load_frames(sources, binning_func=no_bin, bin_factor=1, bin_func=None, **frame_kwargs):
+    """
+    Reads and crops a block of frames and bins the whole block at once
+
+    Parameters
+    ----------
+    sources : list of str or numpy.ndarray
+        Names of the image files or the frames themselves
+    binning_func : callable, optional
+        Function called as binning_func(frames, bin_factor, bin_func) to bin the stack of frames.
+        Default no_bin
+    bin_factor : array_like of uint, optional
+        Downsampling factor for each dimension of the frames
+    bin_func : callable, optional
+        Function that reduces each block of pixels
+    frame_kwargs : dict
+        Keyword arguments passed on to load_frame
+
+    Returns
+    -------
+    frames : 2D numpy.ndarray of float32
+        Flattened frames arranged as [frame, pixel]
+    """
+    if isinstance(sources, np.ndarray) and frame_kwargs.get('crop_func') is None:
+        frames = sources
+    else:
+        frames = np.array([load_frame(source, **frame_kwargs) for source in sources])
+
+    frames = binning_func(frames, bin_factor, bin_func)
+
+    return np.float32(frames.reshape(len(sources), -1))
+
+
+_worker_frame_kwargs = dict()
+
+
+def _init_frame_worker(frame_kwargs):
+    """
+    Stores the arguments for load_frames in each worker so that they are not sent with every task
+    """
+    _worker_frame_kwargs.clear()
+    _worker_frame_kwargs.update(frame_kwargs)
+
+
+def _load_frames_task(sources):
+    """
+    Loads a block of frames using the arguments given to this worker
+
+    Parameters
+    ----------
+    sources : list of str or numpy.ndarray
+        Sources of the frames in this block
+
+    Returns
+    -------
+    frames : 2D numpy.ndarray of float32
+        Flattened frames arranged as [frame, pixel]
+    """
+    return load_frames(sources, **_worker_frame_kwargs)
+
+
+def write_image_stack(sources, h5_main, h5_mean_spec, h5_ronch, frame_kwargs=None, frame_axis=0,
+                      max_mem_mb=1024, cores=None):
+    """
+    Reads, crops and bins the frames of an image stack in a pool of workers and writes them to `h5_main`
+    in blocks of whole chunks. Each block of frames is binned at once. The Mean_Ronchigram and the
+    Spectroscopic_Mean datasets are computed as the blocks are written.
+
+    Parameters
+    ----------
+    sources : list of str or numpy.ndarray
+        Names of the image files or the frames themselves in the order they should be written
+    h5_main : h5py.Dataset
+        Dataset which will hold the flattened frames
+    h5_mean_spec : h5py.Dataset
+        Dataset which will hold the mean of each frame
+    h5_ronch : h5py.Dataset
+        Dataset which will hold the mean over all frames
+    frame_kwargs : dict, optional
+        Keyword arguments passed on to load_frames for each block of frames
+    frame_axis : unsigned int, optional
+        Axis of `h5_main` along which the frames are arranged. Default 0 - each row holds a frame
+    max_mem_mb : unsigned int, optional
+        Maximum memory in megabytes that the frames in flight may occupy. Default 1024
+    cores : unsigned int, optional
+        Number of processes to read the frames with. Default - None - set by recommendCores
+
+    Returns
+    -------
+    None
+    """
+    if frame_kwargs is None:
+        frame_kwargs = dict()
+
+    num_frames = len(sources)
+    cores = recommendCores(num_frames, requested_cores=cores, lengthy_computation=False)
+    if any([isinstance(source, np.ndarray) for source in sources]):
+        # Frames already in memory are only binned and are not worth sending to other processes
+        cores = 1
+
+    '''
+    Each block is a whole number of chunks along the frame axis.
+    Up to two blocks per process may be in flight.
+    '''
+    bytes_per_frame = 4 * h5_main.shape[1 - frame_axis]
+    frames_per_block = max(1, int(max_mem_mb * 1024 ** 2 / (bytes_per_frame * (2 * cores + 1))))
+    if h5_main.chunks is not None:
+        chunk_frames = h5_main.chunks[frame_axis]
+        frames_per_block = max(chunk_frames, frames_per_block // chunk_frames * chunk_frames)
+    batches = list(gen_batches(num_frames, frames_per_block))
+
+    ronch_sum = np.zeros(h5_ronch.shape, dtype=np.float64)
+
+    def write_block(frame_slice, frames):
+        if frame_axis == 0:
+            h5_main[frame_slice, :] = frames
+        else:
+            h5_main[:, frame_slice] = frames.T
+        h5_mean_spec[frame_slice] = np.mean(frames, axis=1)
+        ronch_sum[:] += np.sum(frames, axis=0)
+
+        # Report progress every 10 % of the frames rather than after every block
+        if int(10 * frame_slice.stop / num_frames) > int(10 * frame_slice.start / num_frames):
+            print('Processing file...{}% - read {} of {} frames'.format(10 * int(10 * frame_slice.stop / num_frames),
+                                                                       frame_slice.stop, num_frames))
+
+    if cores <= 1:
+        for frame_slice in batches:
+            frames = load_frames(sources[frame_slice], **frame_kwargs)
+            write_block(frame_slice, frames)
+    else:
+        pool = mp.Pool(processes=cores, initializer=_init_frame_worker, initargs=(frame_kwargs,))
+        """
+        Keep at most two blocks per worker in flight and write the blocks in order
+        """
+        pending = list()
+        try:
+            for frame_slice in batches:
+                pending.append((frame_slice, pool.apply_async(_load_frames_task, (sources[frame_slice],))))
+                if len(pending) >= 2 * cores:
+                    frame_slice, job = pending.pop(0)
+                    write_block(frame_slice, job.get())
+            for frame_slice, job in pending:
+                write_block(frame_slice, job.get())
+        finally:
+            pool.terminate()
+            pool.join()
+
+    h5_ronch[:] = np.float32(ronch_sum / num_frames)
+    h5_main.file.flush()
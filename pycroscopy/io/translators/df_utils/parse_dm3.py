@@ -29,6 +29,9 @@ verbose = False
 # if we find data which matches this regex we return a
 # string instead of an array
 treat_as_string_names = ['.*Name']
+# arrays in tags with these names are not read. Only their position in the
+# file is recorded so that they can be memory mapped or read in one go later
+lazy_array_names = ['Data$']
 
 def get_from_file(f, stype):
     # print("reading", stype, "size", struct.calcsize(stype))
@@ -83,6 +86,29 @@ class structarray(object):
         f.write(self.raw_data)
 
 
+class filearray(object):
+    """
+    A class to represent arrays that were left in the file. We store the
+    name of the file, where the array starts, the struct chars of the
+    elements (more than one for arrays of structs) and the number of elements
+    """
+    def __init__(self, typecodes, file_name, offset, num_elements):
+        self.typecodes = typecodes
+        self.file_name = file_name
+        self.offset = offset
+        self.length = num_elements
+
+    def __repr__(self):
+        return "filearray({}, {}, offset={}, length={})".format(self.typecodes, self.file_name, self.offset,
+                                                              self.length)
+
+    def __len__(self):
+        return self.length
+
+    def bytelen(self):
+        return self.length * struct.calcsize("<" + "".join(self.typecodes))
+
+
 def parse_dm_header(f, outdata=None):
     """
     This is the start of the DM file. We check for some
@@ -186,7 +212,8 @@ def parse_dm_tag_entry(f, outdata=None, outname=None):
         else:
             name = None
         if dtype == 21:
-            arr = parse_dm_tag_data(f)
+            lazy = name is not None and any([re.match(regex, name) for regex in lazy_array_names])
+            arr = parse_dm_tag_data(f, lazy=lazy)
             if name and hasattr(arr, "__len__") and len(arr) > 0:
                 for regex in treat_as_string_names:
                     if re.match(regex, name):
@@ -202,7 +229,7 @@ def parse_dm_tag_entry(f, outdata=None, outname=None):
             raise Exception("Unknown data type=" + str(dtype))
 
 
-def parse_dm_tag_data(f, outdata=None):
+def parse_dm_tag_data(f, outdata=None, lazy=False):
     # todo what is id??
     # it is normally one of 1,3,7,11,19
     # we can parse lists of numbers with them all 1
@@ -230,7 +257,10 @@ def parse_dm_tag_data(f, outdata=None):
     else:
         _delim, header_len, data_type = get_from_file(f, "> 4s l l")
         assert(_delim == "%%%%")
-        ret, header = dm_types[data_type](f)
+        if lazy and data_type == get_dmtype_for_name('array'):
+            ret, header = dm_read_array(f, lazy=True)
+        else:
+            ret, header = dm_types[data_type](f)
         assert(header + 1 == header_len)
         return ret
 
@@ -423,7 +453,11 @@ dm_types[get_dmtype_for_name('struct')] = dm_read_struct
 
 
 # array is 20
-def dm_read_array(f, outdata=None):
+def dm_read_array(f, outdata=None, lazy=False):
+    """
+    Reads (or writes if outdata is given) an array. If lazy, large arrays in
+    real files are skipped over and returned as a filearray instead
+    """
     array_header = 2  # type, length
     if outdata is not None:
         if isinstance(outdata, structarray):
@@ -459,6 +493,8 @@ def dm_read_array(f, outdata=None):
         # taglists, dicts for taggroups and arrays for array data.
         # But array.array only supports simple types. We need a new type, then.
         # let's make a structarray
+        # Only arrays in files that can be opened again by name can be left in the file
+        lazy = lazy and not isinstance(f, StringIO) and isinstance(getattr(f, 'name', None), (str, unicode))
         dtype = get_from_file(f, "> l")
         if dtype == get_dmtype_for_name('struct'):
             types, struct_header = dm_read_struct_types(f)
@@ -466,6 +502,10 @@ def dm_read_array(f, outdata=None):
             if verbose:
                 print(types)
                 print("Array of structs! types %s, len %d" % (",".join(map(str, types)), alen), "at", f.tell())
+            if lazy:
+                ret = filearray([get_structchar_for_dmtype(d) for d in types], f.name, f.tell(), alen)
+                f.seek(ret.bytelen(), 1)
+                return ret, array_header + struct_header
             ret = structarray([get_structchar_for_dmtype(d) for d in types])
             ret.from_file(f, alen)
             return ret, array_header + struct_header
@@ -480,6 +520,10 @@ def dm_read_array(f, outdata=None):
             if verbose:
                 print("Array type %d len %d struct %c size %d" % (
                     dtype, alen, struct_char, struct.calcsize(struct_char)), "at", f.tell())
+            if lazy:
+                ret = filearray([struct_char], f.name, f.tell(), alen)
+                f.seek(ret.bytelen(), 1)
+                return ret, array_header
             if alen:
                 # faster to read <1024f than <f 1024 times. probly
                 # stype = "<" + str(alen) + dm_simple_names[dtype][1]
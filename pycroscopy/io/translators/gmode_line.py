@@ -11,6 +11,7 @@ from warnings import warn
 
 import numpy as np
 from scipy.io.matlab import loadmat  # To load parameters stored in Matlab .mat file
+from sklearn.utils import gen_batches
 
 from .df_utils.be_utils import parmsToDict
 from .translator import Translator
@@ -24,6 +25,19 @@ class GLineTranslator(Translator):
     """
     Translated G-mode line (bigtimedata.dat) files from actual BE line experiments to HDF5
     """
+
+    def __init__(self, *args, **kwargs):
+        """
+        Parameters
+        -----------
+        max_mem_mb : unsigned integer (Optional. Default = 1024)
+            Maximum system memory (in megabytes) that the translator can use
+        flush_rows : unsigned integer (Optional. Default = None)
+            Number of rows after which the written data is flushed to the file.
+            By default, the file is only flushed once the data file has been read
+        """
+        self.flush_rows = kwargs.pop('flush_rows', None)
+        super(GLineTranslator, self).__init__(*args, **kwargs)
     
     def translate(self, file_path):
         """
@@ -210,7 +224,7 @@ class GLineTranslator(Translator):
 
     def _read_data(self, filepath, h5_dset):
         """
-        Reads the .dat file and populates the .h5 dataset
+        Reads the .dat file in blocks of rows and populates the .h5 dataset
 
         Parameters
         ---------
@@ -223,18 +237,27 @@ class GLineTranslator(Translator):
         ---------
         None
         """
-        # Create data matrix - Only need 16 bit floats (time) 
-                
-        # Read line by line and write to h5                 
-        with open(filepath, 'rb') as file_handl:
-            for row_indx in range(self.num_rows):
-                
-                if row_indx % 10 == 0:
-                    print('Reading line {} of {}'.format(row_indx, self.num_rows))
-                
-                file_handl.seek(row_indx*self.__bytes_per_row__, 0)
-                data_vec = np.fromstring(file_handl.read(self.__bytes_per_row__), dtype='f')
-                h5_dset[row_indx] = np.float16(data_vec)
+        # Create data matrix - Only need 16 bit floats (time)
+        data_mat = np.memmap(filepath, dtype=np.float32, mode='r',
+                             shape=(self.num_rows, self.__bytes_per_row__ // 4))
+
+        # Read blocks of whole rows (which are whole chunks) leaving room for the float16 copy of each block
+        rows_per_block = max(1, int(self.max_ram / (1.5 * self.__bytes_per_row__)))
+        if self.flush_rows is not None:
+            rows_per_block = max(1, min(rows_per_block, self.flush_rows))
+
+        rows_since_flush = 0
+        for row_slice in gen_batches(self.num_rows, rows_per_block):
+            print('Reading lines {} to {} of {}'.format(row_slice.start, row_slice.stop - 1, self.num_rows))
+
+            h5_dset[row_slice] = data_mat[row_slice].astype(np.float16)
+
+            rows_since_flush += row_slice.stop - row_slice.start
+            if self.flush_rows is not None and rows_since_flush >= self.flush_rows:
                 h5_dset.file.flush()
-        
+                rows_since_flush = 0
+
+        del data_mat
+        h5_dset.file.flush()
+
         print('Finished reading file: {}!'.format(filepath))
@@ -7,13 +7,15 @@ Created on Wed Dec 07 16:04:34 2016
 
 from __future__ import division, print_function, absolute_import, unicode_literals
 from os import path, remove  # File Path formatting
+from struct import unpack_from
 import numpy as np  # For array operations
+from sklearn.utils import gen_batches
 
 from igor import binarywave as bw
 
 from .translator import Translator  # Because this class extends the abstract Translator class
 from .utils import generate_dummy_main_parms, build_ind_val_dsets
-from ..hdf_utils import getH5DsetRefs, linkRefs
+from ..hdf_utils import getH5DsetRefs, linkRefs, calc_chunks
 from ..io_hdf5 import ioHDF5  # Now the translator is responsible for writing the data.
 from ..microdata import MicroDataGroup, \
     MicroDataset  # The building blocks for defining hierarchical storage in the H5 file
@@ -44,9 +46,8 @@ class IgorIBWTranslator(Translator):
             Absolute path of the .h5 file
         """
 
-        # Load the ibw file first
-        ibw_obj = bw.load(file_path)
-        ibw_wave = ibw_obj.get('wave')
+        # Read the headers, note and labels. The wave data is only memory mapped
+        ibw_wave = self._load_wave(file_path)
         parm_dict = self._read_parms(ibw_wave, parm_encoding)
         chan_labels, chan_units = self._get_chan_labels(ibw_wave, parm_encoding)
         if verbose:
@@ -65,7 +66,7 @@ class IgorIBWTranslator(Translator):
             num_cols = parm_dict['ScanPoints']
 
             images = images.transpose(2, 0, 1)  # now ordered as [chan, Y, X] image
-            images = np.reshape(images, (images.shape[0], -1, 1))  # 3D [chan, Y*X points,1]
+            raw_shape = (images.shape[1] * images.shape[2], 1)
 
             ds_pos_ind, ds_pos_val = build_ind_val_dsets([num_cols, num_rows], is_spectral=False,
                                                          steps=[1.0 * parm_dict['FastScanSize'] / num_cols,
@@ -80,8 +81,10 @@ class IgorIBWTranslator(Translator):
                 print('Found force curve of size {}'.format(images.shape))
 
             type_suffix = 'ForceCurve'
-            images = np.atleast_3d(images)  # now [Z, chan, 1]
-            images = images.transpose((1, 2, 0))  # [chan ,1, Z] force curve
+            if images.ndim == 1:
+                images = images[:, np.newaxis]  # [Z, chan]
+            images = images.T[:, np.newaxis, :]  # [chan ,1, Z] force curve
+            raw_shape = (1, images.shape[2])
 
             ds_pos_ind, ds_pos_val = build_ind_val_dsets([1], is_spectral=False, steps=[25E-9],
                                                          labels=['X'], units=['m'], verbose=verbose)
@@ -105,8 +108,11 @@ class IgorIBWTranslator(Translator):
 
         # Prepare the list of raw_data datasets
         chan_raw_dsets = list()
-        for chan_data, chan_name, chan_unit in zip(images, chan_labels, chan_units):
-            ds_raw_data = MicroDataset('Raw_Data', data=np.atleast_2d(chan_data), dtype=np.float32, compression='gzip')
+        # Each channel gets its own dataset that is filled from the memory mapped wave after it is created
+        chunking = calc_chunks(raw_shape, np.float32(0).itemsize)
+        for chan_name, chan_unit in zip(chan_labels, chan_units):
+            ds_raw_data = MicroDataset('Raw_Data', data=[], maxshape=raw_shape, dtype=np.float32,
+                                       chunking=chunking, compression='gzip')
             ds_raw_data.attrs['quantity'] = chan_name
             ds_raw_data.attrs['units'] = [chan_unit]
             chan_raw_dsets.append(ds_raw_data)
@@ -153,6 +159,8 @@ class IgorIBWTranslator(Translator):
             h5_refs = hdf.writeData(chan_grp, print_log=verbose)
             h5_raw = getH5DsetRefs(['Raw_Data'], h5_refs)[0]
             linkRefs(h5_raw, getH5DsetRefs(aux_ds_names, h5_refs))
+            self._write_channel(images[chan_index], h5_raw)
+            hdf.flush()
 
         if verbose:
             print('Finished writing all channels')
@@ -160,6 +168,99 @@ class IgorIBWTranslator(Translator):
         hdf.close()
         return h5_path
 
+    @staticmethod
+    def _load_wave(file_path):
+        """
+        Reads the headers, note and dimension labels of the provided ibw file and memory maps the wave data
+        instead of reading it. Only version 5 files are memory mapped. Older files are loaded completely.
+
+        Parameters
+        ----------
+        file_path : String / unicode
+            Absolute path of the .ibw file
+
+        Returns
+        -------
+        ibw_wave : dictionary
+            Wave entry similar to that obtained from loading the ibw file. 'wData' is a read-only numpy.memmap
+        """
+        with open(file_path, 'rb') as file_handle:
+            bin_header = file_handle.read(64)
+
+            # The version number is written in the byte order of the machine that wrote the file
+            byte_order = '<'
+            version = unpack_from(byte_order + 'h', bin_header)[0]
+            if version not in [1, 2, 3, 5]:
+                byte_order = '>'
+                version = unpack_from(byte_order + 'h', bin_header)[0]
+            if version != 5:
+                return bw.load(file_path).get('wave')
+
+            # BinHeader5 (64 bytes including the version):
+            wfm_size, formula_size, note_size, data_e_units_size = unpack_from(byte_order + '4l', bin_header, 4)
+            dim_e_units_size = unpack_from(byte_order + '4l', bin_header, 20)
+            dim_labels_size = unpack_from(byte_order + '4l', bin_header, 36)
+
+            # WaveHeader5 (320 bytes):
+            wave_header_size = 320
+            wave_header = file_handle.read(wave_header_size)
+            creation_date, mod_date, num_points, data_type = unpack_from(byte_order + '2Llh', wave_header, 4)
+            bname = wave_header[28:60].split(b'\x00')[0]
+            dim_sizes = unpack_from(byte_order + '4l', wave_header, 68)
+
+            dtype = bw.TYPE_TABLE.get(data_type, None)
+            if dtype is None:
+                raise ValueError('Text waves cannot be translated')
+            dtype = np.dtype(dtype).newbyteorder(byte_order)
+            data_shape = tuple([size for size in dim_sizes if size > 0])
+            data_offset = 64 + wave_header_size
+
+            # The note, the extended units and the dimension labels follow the wave data and the formula
+            file_handle.seek(data_offset + wfm_size - wave_header_size + formula_size)
+            note = file_handle.read(note_size)
+            file_handle.seek(data_e_units_size + sum(dim_e_units_size), 1)
+
+            # Each label is a null terminated string in a field of 32 bytes.
+            # The first label of each dimension is the label for the whole dimension
+            labels = list()
+            for label_size in dim_labels_size:
+                dim_labels = file_handle.read(label_size)
+                labels.append([dim_labels[start: start + 32].split(b'\x00')[0]
+                               for start in range(0, label_size, 32)])
+
+        if num_points > 0:
+            w_data = np.memmap(file_path, dtype=dtype, mode='r', offset=data_offset, shape=data_shape, order='F')
+        else:
+            w_data = np.zeros(0, dtype=dtype)
+
+        return {'wave_header': {'creationDate': creation_date, 'modDate': mod_date, 'bname': bname,
+                                'npnts': num_points, 'type': data_type, 'nDim': dim_sizes},
+                'note': note,
+                'labels': labels,
+                'wData': w_data}
+
+    def _write_channel(self, chan_data, h5_raw):
+        """
+        Writes the data of one channel into its Raw_Data dataset a few rows at a time so that only
+        a small part of the memory mapped wave is held in memory at once
+
+        Parameters
+        ----------
+        chan_data : numpy.ndarray
+            2D (strided) view of the wave data for this channel - [Y, X] for images and [1, Z] for force curves
+        h5_raw : h5py.Dataset
+            Raw_Data dataset of this channel. Either [Y*X, 1] or [1, Z]
+        """
+        row_size = chan_data.shape[1]
+        rows_per_batch = max(1, int(self.max_ram / (2 * row_size * max(chan_data.itemsize, 4))))
+        for row_slice in gen_batches(chan_data.shape[0], rows_per_batch):
+            flat_data = np.float32(chan_data[row_slice]).reshape(-1)
+            flat_slice = slice(row_slice.start * row_size, row_slice.stop * row_size)
+            if h5_raw.shape[1] == 1:
+                h5_raw[flat_slice, 0] = flat_data
+            else:
+                h5_raw[0, flat_slice] = flat_data
+
     @staticmethod
     def _read_parms(ibw_wave, codec='utf-8'):
         """
@@ -228,20 +329,18 @@ class IgorIBWTranslator(Translator):
         default_units : list of strings
             List of units for the measurement in each channel
         """
-        temp = ibw_wave.get('labels')
         labels = []
-        for item in temp:
-            if len(item) > 0:
-                labels += item
-        for item in labels:
-            if item == '':
-                labels.remove(item)
+        for dim_labels in ibw_wave.get('labels'):
+            for item in dim_labels:
+                if type(item) == bytes:
+                    item = item.decode(codec)
+                item = item.rstrip('\x00')
+                if len(item) > 0:
+                    labels.append(item)
 
         default_units = list()
         for chan_ind, chan in enumerate(labels):
             # clean up channel names
-            if type(chan) == bytes:
-                chan = chan.decode(codec)
             if chan.lower().rfind('trace') > 0:
                 labels[chan_ind] = chan[:chan.lower().rfind('trace') + 5]
             # Figure out (default) units
@@ -9,9 +9,8 @@ from __future__ import division, print_function, absolute_import, unicode_litera
 import os
 
 import numpy as np
-from skimage.measure import block_reduce
 
-from .df_utils.io_image import read_image
+from .df_utils.io_image import read_image, no_bin, bin_images
 from .translator import Translator
 from .utils import generate_dummy_main_parms, build_ind_val_dsets
 from ..hdf_utils import getH5DsetRefs, calc_chunks, link_as_main, findDataset
@@ -30,7 +29,7 @@ class ImageTranslator(Translator):
         self.rebin = False
         self.bin_factor = 1
         self.hdf = None
-        self.binning_func = self.__no_bin
+        self.binning_func = no_bin
         self.bin_func = None
         self.image_path = None
         self.h5_path = None
@@ -88,7 +87,7 @@ class ImageTranslator(Translator):
                                  '{} was given.'.format(bin_factor))
             usize = int(usize / self.bin_factor[0])
             vsize = int(vsize / self.bin_factor[1])
-            self.binning_func = block_reduce
+            self.binning_func = bin_images
             self.bin_func = bin_func
 
         image = self.binning_func(image, self.bin_factor, self.bin_func)
@@ -250,28 +249,6 @@ class ImageTranslator(Translator):
 
         return image_path, h5_path
 
-    @staticmethod
-    def __no_bin(image, *args, **kwargs):
-        """
-        Does absolutely nothing to the image.  Exists so that we can have
-        a bin function to call whether we actually rebin the image or not.
-
-        Parameters
-        ----------
-        image : ndarray
-            Image
-        args:
-            Argument list
-        kwargs:
-            Keyword argument list
-
-        Returns
-        -------
-        image : ndarray
-            The input image
-        """
-        return image
-
     @staticmethod
     def _read_data(image, h5_main):
         """
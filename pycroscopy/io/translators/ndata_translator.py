@@ -12,10 +12,9 @@ import zipfile
 from warnings import warn
 
 import numpy as np
-from skimage.measure import block_reduce
-from skimage.util import crop
+from sklearn.utils import gen_batches
 
-from .df_utils.io_image import unnest_parm_dicts, read_dm3
+from .df_utils.io_image import unnest_parm_dicts, read_dm3, no_bin, bin_images
 from .translator import Translator
 from .utils import generate_dummy_main_parms, make_position_mat, get_spectral_slicing, \
     get_position_slicing, build_ind_val_dsets
@@ -35,7 +34,7 @@ class NDataTranslator(Translator):
         self.rebin = False
         self.bin_factor = (1,1,1,1)
         self.hdf = None
-        self.binning_func = self.__no_bin
+        self.binning_func = no_bin
         self.bin_func = None
         self.h5_main = None
         self.root_image_list = list()
@@ -105,11 +104,6 @@ class NDataTranslator(Translator):
         '''
         file_list = self._parse_file_path(image_path)
 
-        '''
-        Get zipfile handles for all the ndata1 files that were found in the image_path
-        '''
-        ziplist = [zipfile.ZipFile(zip_path, 'r') for zip_path in file_list]
-
         image_parm_list = self._getimageparms(file_list)
 
         '''
@@ -125,12 +119,12 @@ class NDataTranslator(Translator):
                 raise ValueError('Input parameter `bin_factor` must be a length 2 array_like or an integer.\n' +
                                  '{} was given.'.format(bin_factor))
 
-            self.binning_func = block_reduce
+            self.binning_func = bin_images
             self.bin_func = bin_func
 
         h5_channels = self._setupH5(image_parm_list)
 
-        self._read_data(ziplist, h5_channels)
+        self._read_data(file_list, h5_channels)
 
         self.hdf.close()
 
@@ -218,24 +212,19 @@ class NDataTranslator(Translator):
 
         self.root_image_list.append(h5_image)
 
-    def _read_data(self, zip_list, h5_channels):
+    def _read_data(self, file_list, h5_channels):
         """
-        Iterates over the images in `file_list`, reading each image and downsampling if
-        reqeusted, and writes the flattened image to file.  Also builds the Mean_Ronchigram
-        and the Spectroscopic_Mean datasets at the same time.
+        Iterates over the ndata files in `file_list`, streaming the data of each file out of the
+        zip archive in blocks of images.  Each block is cropped and downsampling if reqeusted, and
+        written to file.  Also builds the Mean_Ronchigram and the Spectroscopic_Mean datasets at
+        the same time.
 
         Parameters
         ----------
-        zip_list : list of str
-            List of all files in `image_path` that will be read
-        h5_main : h5py.Dataset
-            Dataset which will hold the Ronchigrams
-        h5_mean_spec : h5py.Dataset
-            Dataset which will hold the Spectroscopic Mean
-        h5_ronch : h5py.Dataset
-            Dataset which will hold the Mean Ronchigram
-        image_path : str
-            Absolute file path to the directory which hold the images
+        file_list : list of str
+            List of the paths of all the ndata files that will be read
+        h5_channels : list of h5py.Group
+            Channel groups which will hold the datasets of each file
 
         Returns
         -------
@@ -246,91 +235,222 @@ class NDataTranslator(Translator):
         For each file, we must read the data then create the neccessary datasets, add them to the channel, and
         write it all to file
         '''
-        for ifile, (this_file, this_channel) in enumerate(zip(zip_list, h5_channels)):
-            '''
-            Extract the data file from the zip archive and read it into an array
-            '''
-            tmp_path = this_file.extract('data.npy')
-            this_data = np.load(tmp_path)
-            os.remove(tmp_path)
-
+        for ifile, (this_path, this_channel) in enumerate(zip(file_list, h5_channels)):
             '''
-            Find the shape of the data, then calculate the final dimensions based on the crop and
-            downsampling parameters
+            Only the header of the data file within the zip archive is read at first.
+            The archive is closed as soon as the data has been copied
             '''
-            while this_data.ndim < 4:
-                this_data = np.expand_dims(this_data, 0)
-
-            this_data = self.crop_ronc(this_data)
-            scan_size_x, scan_size_y, usize, vsize = this_data.shape
+            with zipfile.ZipFile(this_path, 'r') as this_file:
+                with this_file.open('data.npy', 'r') as npy_file:
+                    data_shape, fortran_order, data_type = self.__read_npy_header(npy_file)
+
+                    '''
+                    Find the shape of the data, then calculate the final dimensions based on the crop and
+                    downsampling parameters
+                    '''
+                    file_shape = tuple(data_shape)
+                    data_shape = (1,) * (4 - len(file_shape)) + file_shape
+                    u_slice, v_slice = self._get_crop_slices(data_shape)
+                    scan_size_x, scan_size_y = data_shape[:2]
+                    usize = len(range(*u_slice.indices(data_shape[2]))) // self.bin_factor[-2]
+                    vsize = len(range(*v_slice.indices(data_shape[3]))) // self.bin_factor[-1]
+
+                    num_images = scan_size_x*scan_size_y
+                    num_pixels = usize*vsize
+
+                    '''
+                    Write these attributes to the Measurement group
+                    '''
+                    new_attrs = {'image_size_u': usize,
+                                 'image_size_v': vsize,
+                                 'scan_size_x': scan_size_x,
+                                 'scan_size_y': scan_size_y}
+                    this_channel.parent.attrs.update(new_attrs)
+
+                    # Get the Position and Spectroscopic Datasets
+                    ds_spec_ind, ds_spec_vals = build_ind_val_dsets((usize, vsize), is_spectral=True,
+                                                                    labels=['U', 'V'], units=['pixel', 'pixel'])
+                    ds_pos_ind, ds_pos_val = build_ind_val_dsets([scan_size_x, scan_size_y], is_spectral=False,
+                                                                 labels=['X', 'Y'], units=['pixel', 'pixel'])
+
+                    ds_chunking = calc_chunks([num_images, num_pixels],
+                                              np.float32(0).itemsize,
+                                              unit_chunks=(1, num_pixels))
+
+                    # Allocate space for Main_Data and Pixel averaged Data
+                    ds_main_data = MicroDataset('Raw_Data', data=[], maxshape=(num_images, num_pixels),
+                                                chunking=ds_chunking, dtype=np.float32, compression='gzip')
+                    ds_mean_ronch_data = MicroDataset('Mean_Ronchigram',
+                                                      data=np.zeros(num_pixels, dtype=np.float32),
+                                                      dtype=np.float32)
+                    ds_mean_spec_data = MicroDataset('Spectroscopic_Mean',
+                                                     data=np.zeros(num_images, dtype=np.float32),
+                                                     dtype=np.float32)
+
+                    # Add datasets as children of Measurement_000 data group
+                    ds_channel = MicroDataGroup(this_channel.name)
+                    ds_channel.addChildren([ds_main_data, ds_spec_ind, ds_spec_vals, ds_pos_ind,
+                                            ds_pos_val, ds_mean_ronch_data, ds_mean_spec_data])
+
+                    h5_refs = self.hdf.writeData(ds_channel)
+                    h5_main = getH5DsetRefs(['Raw_Data'], h5_refs)[0]
+                    h5_ronch = getH5DsetRefs(['Mean_Ronchigram'], h5_refs)[0]
+                    h5_mean_spec = getH5DsetRefs(['Spectroscopic_Mean'], h5_refs)[0]
+
+                    aux_ds_names = ['Position_Indices',
+                                    'Position_Values',
+                                    'Spectroscopic_Indices',
+                                    'Spectroscopic_Values']
+
+                    link_as_main(h5_main, *getH5DsetRefs(aux_ds_names, h5_refs))
+
+                    '''
+                    Read the images in blocks of whole chunks of the main dataset
+                    '''
+                    image_shape = data_shape[2:]
+                    bytes_per_image = int(np.prod(image_shape)) * data_type.itemsize
+                    images_per_block = max(1, int(self.max_ram / (3 * bytes_per_image)))
+                    chunk_images = h5_main.chunks[0] if h5_main.chunks is not None else 1
+                    images_per_block = max(chunk_images, images_per_block // chunk_images * chunk_images)
+
+                    if fortran_order:
+                        # Images are not contiguous in the file and cannot be streamed
+                        all_data = np.frombuffer(self.__read_exactly(npy_file, num_images * bytes_per_image),
+                                                 dtype=data_type).reshape(file_shape, order='F')
+                        all_data = all_data.reshape((num_images,) + image_shape)
+
+                    ronch_sum = np.zeros(h5_ronch.shape, dtype=np.float64)
+
+                    for image_slice in gen_batches(num_images, images_per_block):
+                        num_block = image_slice.stop - image_slice.start
+                        if fortran_order:
+                            this_data = all_data[image_slice]
+                        else:
+                            block_bytes = self.__read_exactly(npy_file, num_block * bytes_per_image)
+                            this_data = np.frombuffer(block_bytes, dtype=data_type)
+                            this_data = this_data.reshape((num_block,) + image_shape)
+
+                        this_data = this_data[:, u_slice, v_slice]
+                        this_data = self.binning_func(this_data, self.bin_factor[-2:], self.bin_func)
+                        this_data = np.float32(this_data.reshape(num_block, num_pixels))
+
+                        h5_main[image_slice, :] = this_data
+
+                        h5_mean_spec[image_slice] = np.mean(this_data, axis=1)
+
+                        ronch_sum += np.sum(this_data, axis=0)
+
+                    h5_ronch[:] = ronch_sum / num_images
 
-            usize = int(round(1.0*usize / self.bin_factor[-2]))
-            vsize = int(round(1.0*vsize / self.bin_factor[-1]))
+            self.hdf.flush()
 
-            num_images = scan_size_x*scan_size_y
-            num_pixels = usize*vsize
+            h5_main_list.append(h5_main)
 
-            '''
-            Write these attributes to the Measurement group
-            '''
-            new_attrs = {'image_size_u': usize,
-                         'image_size_v': vsize,
-                         'scan_size_x': scan_size_x,
-                         'scan_size_y': scan_size_y}
-            this_channel.parent.attrs.update(new_attrs)
+        self.hdf.flush()
 
-            # Get the Position and Spectroscopic Datasets
-            ds_spec_ind, ds_spec_vals = build_ind_val_dsets((usize, vsize), is_spectral=True,
-                                                            labels=['U', 'V'], units=['pixel', 'pixel'])
-            ds_pos_ind, ds_pos_val = build_ind_val_dsets([scan_size_x, scan_size_y], is_spectral=False,
-                                                         labels=['X', 'Y'], units=['pixel', 'pixel'])
+    @staticmethod
+    def __read_npy_header(npy_file):
+        """
+        Reads the header of a .npy file and leaves the file positioned at the start of the data
 
-            ds_chunking = calc_chunks([num_images, num_pixels],
-                                      np.float32(0).itemsize,
-                                      unit_chunks=(1, num_pixels))
+        Parameters
+        ----------
+        npy_file : file-like object
+            Open .npy file
 
-            # Allocate space for Main_Data and Pixel averaged Data
-            ds_main_data = MicroDataset('Raw_Data', data=[], maxshape=(num_images, num_pixels),
-                                        chunking=ds_chunking, dtype=np.float32, compression='gzip')
-            ds_mean_ronch_data = MicroDataset('Mean_Ronchigram',
-                                              data=np.zeros(num_pixels, dtype=np.float32),
-                                              dtype=np.float32)
-            ds_mean_spec_data = MicroDataset('Spectroscopic_Mean',
-                                             data=np.zeros(num_images, dtype=np.float32),
-                                             dtype=np.float32)
+        Returns
+        -------
+        shape : tuple of int
+            Shape of the array
+        fortran_order : bool
+            Whether the data is stored in Fortran order
+        dtype : numpy.dtype
+            Data type of the array
+        """
+        version = np.lib.format.read_magic(npy_file)
+        if version == (1, 0):
+            return np.lib.format.read_array_header_1_0(npy_file)
+        return np.lib.format.read_array_header_2_0(npy_file)
 
-            # Add datasets as children of Measurement_000 data group
-            ds_channel = MicroDataGroup(this_channel.name)
-            ds_channel.addChildren([ds_main_data, ds_spec_ind, ds_spec_vals, ds_pos_ind,
-                                    ds_pos_val, ds_mean_ronch_data, ds_mean_spec_data])
+    @staticmethod
+    def __read_exactly(file_handle, num_bytes):
+        """
+        Reads exactly `num_bytes` from a file.  Compressed streams may return fewer bytes per read
 
-            h5_refs = self.hdf.writeData(ds_channel)
-            h5_main = getH5DsetRefs(['Raw_Data'], h5_refs)[0]
-            h5_ronch = getH5DsetRefs(['Mean_Ronchigram'], h5_refs)[0]
-            h5_mean_spec = getH5DsetRefs(['Spectroscopic_Mean'], h5_refs)[0]
+        Parameters
+        ----------
+        file_handle : file-like object
+            Open file
+        num_bytes : int
+            Number of bytes to read
 
-            aux_ds_names = ['Position_Indices',
-                            'Position_Values',
-                            'Spectroscopic_Indices',
-                            'Spectroscopic_Values']
+        Returns
+        -------
+        data : bytes
+            Data read from the file
+        """
+        data = file_handle.read(num_bytes)
+        if len(data) == num_bytes:
+            return data
+        chunks = [data]
+        num_read = len(data)
+        while num_read < num_bytes:
+            chunk = file_handle.read(num_bytes - num_read)
+            if not chunk:
+                raise IOError('Data file ended {} bytes early'.format(num_bytes - num_read))
+            chunks.append(chunk)
+            num_read += len(chunk)
+        return b''.join(chunks)
+
+    def _get_crop_slices(self, data_shape):
+        """
+        Find the slices of the image dimensions that remain after cropping by the specified ammount
+        using the specified method.
 
-            link_as_main(h5_main, *getH5DsetRefs(aux_ds_names, h5_refs))
+        Parameters
+        ----------
+        data_shape : tuple of int
+            Shape of the data.  The last two dimensions are the image dimensions
 
-            mean_ronch = np.zeros(h5_ronch.shape, dtype=np.float32)
+        Returns
+        -------
+        u_slice : slice
+            Slice of the first image dimension
+        v_slice : slice
+            Slice of the second image dimension
+        """
+        image_shape = data_shape[-2:]
+        full_slices = (slice(None), slice(None))
 
-            this_data = self.binning_func(this_data, self.bin_factor, self.bin_func).reshape(h5_main.shape)
+        if self.crop_ammount is None:
+            return full_slices
 
-            h5_main[:, :] = this_data
+        crop_ammount = self.crop_ammount
+        crop_method = self.crop_method
 
-            h5_mean_spec[:] = np.mean(this_data, axis=1)
+        if isinstance(crop_ammount, int):
+            crop_ammount = ((crop_ammount, crop_ammount), (crop_ammount, crop_ammount))
+        elif len(crop_ammount) == 2:
+            crop_ammount = ((crop_ammount[0], crop_ammount[0]), (crop_ammount[1], crop_ammount[1]))
+        elif len(crop_ammount) == 4:
+            crop_ammount = ((crop_ammount[0], crop_ammount[1]), (crop_ammount[2], crop_ammount[3]))
+        else:
+            raise ValueError('The crop_ammount should be an integer or list of 2 or 4 integers.')
 
-            h5_ronch[:] = np.mean(this_data, axis=0)
+        if crop_method == 'percent':
+            crop_ammount = [[int(np.round(ammount / 100.0 * dim_size)) for ammount in dim_crop]
+                            for dim_crop, dim_size in zip(crop_ammount, image_shape)]
+        elif crop_method != 'absolute':
+            raise ValueError('Allowed values of crop_method are percent and absolute.')
 
-            self.hdf.flush()
+        slices = tuple([slice(before, dim_size - after)
+                        for (before, after), dim_size in zip(crop_ammount, image_shape)])
 
-            h5_main_list.append(h5_main)
+        if any([before + after >= dim_size for (before, after), dim_size in zip(crop_ammount, image_shape)]):
+            warn("Requested crop ammount is greater than the image size.  No cropping will be done.")
+            return full_slices
 
-        self.hdf.flush()
+        return slices
 
     def crop_ronc(self, ronc):
         """
@@ -346,36 +466,9 @@ class NDataTranslator(Translator):
         cropped_ronc : numpy.array
             Cropped image
         """
+        u_slice, v_slice = self._get_crop_slices(ronc.shape)
 
-        if self.crop_ammount is None:
-            return ronc
-
-        crop_ammount = self.crop_ammount
-        crop_method = self.crop_method
-
-        if crop_method == 'percent':
-            crop_ammount = np.round(np.atleast_2d(crop_ammount)/100.0*ronc.shape)
-            crop_ammount = tuple([tuple(row) for row in crop_ammount.astype(np.uint32)])
-        elif crop_method == 'absolute':
-            if isinstance(crop_ammount, int):
-                crop_ammount = ((crop_ammount,), (crop_ammount,))
-            elif len(crop_ammount) == 2:
-                crop_ammount = ((crop_ammount[0],), (crop_ammount[1],))
-            elif len(crop_ammount) == 4:
-                crop_ammount = ((crop_ammount[0], crop_ammount[1]), (crop_ammount[2], crop_ammount[3]))
-            else:
-                raise ValueError('The crop_ammount should be an integer or list of 2 or 4 integers.')
-        else:
-            raise ValueError('Allowed values of crop_method are percent and absolute.')
-
-        crop_ammount = ((0,), (0,))+crop_ammount
-
-        cropped_ronc = crop(ronc, crop_ammount)
-
-        if any([dim == 0 for dim in cropped_ronc.shape]):
-            warn("Requested crop ammount is greater than the image size.  No cropping will be done.")
-            return ronc
-        return cropped_ronc
+        return ronc[..., u_slice, v_slice]
 
     def downSampRoncVec(self, ronch_vec, binning_factor):
         """
@@ -435,8 +528,8 @@ class NDataTranslator(Translator):
 
         Parameters
         ------------
-        file_list : list of zipfile.ZipFile
-            List of zipfile objects
+        file_list : list of str
+            List of the paths of the ndata files
 
         Returns
         -----------
@@ -446,14 +539,10 @@ class NDataTranslator(Translator):
         parm_list = list()
 
         for zpath in file_list:
-            zfile = zipfile.ZipFile(zpath, 'r')
-            tmp_path = zfile.extract('metadata.json')
-            metafile = open(tmp_path, 'r')
-            metastring = metafile.read()
+            # Read the metadata straight from the archive
+            with zipfile.ZipFile(zpath, 'r') as zfile:
+                metastring = zfile.read('metadata.json').decode('utf-8')
             parm_list.append(unnest_parm_dicts(json.loads(metastring)))
-            metafile.close()
-
-            os.remove(tmp_path)
 
         return parm_list
 
@@ -507,25 +596,3 @@ class NDataTranslator(Translator):
         self.hdf.flush()
 
         return h5_channels
-
-    @staticmethod
-    def __no_bin(image, *args, **kwargs):
-        """
-        Does absolutely nothing to the image.  Exists so that we can have
-        a bin function to call whether we actually rebin the image or not.
-
-        Parameters
-        ----------
-        image : ndarray
-            Image
-        args:
-            Argument list
-        kwargs:
-            Keyword argument list
-
-        Returns
-        -------
-        image : ndarray
-            The input image
-        """
-        return image
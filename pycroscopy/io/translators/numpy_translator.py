@@ -19,8 +19,17 @@ class NumpyTranslator(Translator):
     Writes a numpy array to .h5
     """
 
-    def _read_data(self):
-        pass
+    def _read_data(self, h5_raw):
+        """
+        Fills the empty main dataset created when translate is given the shape of the main data instead of the data.
+        Extensions of this class that stream their data into the file implement this.
+
+        Parameters
+        ----------
+        h5_raw : h5py.Dataset
+            Empty main dataset arranged as [positions x spectra]
+        """
+        raise NotImplementedError('The main data must be provided as a numpy array')
 
     def _parse_file_path(self, input_path):
         pass
@@ -34,7 +43,9 @@ class NumpyTranslator(Translator):
         Parameters
         ----------
         h5_path
-        main_data
+        main_data : 2D numpy array or tuple of two unsigned ints
+            Data arranged as [positions x spectra] or only its shape. If the shape is provided, an empty main dataset
+            is created and filled by _read_data before the file is closed
         num_rows
         num_cols
         qty_name
@@ -54,14 +65,25 @@ class NumpyTranslator(Translator):
         h5_path : string / unicode
             Absolute path of the translated h5 file
         """
-        if main_data.ndim != 2:
+        main_writer = None
+        if isinstance(main_data, (tuple, list)):
+            main_shape = tuple(main_data)
+            main_data = []
+            main_writer = self._read_data
+        else:
+            main_shape = main_data.shape
+        if len(main_shape) != 2:
             raise ValueError('Main dataset must be a 2-dimensional array arranged as [positions x spectra]')
 
-        spectra_length = main_data.shape[1]
+        spectra_length = main_shape[1]
 
-        ds_main = MicroDataset('Raw_Data', data=main_data, dtype=np.float32, compression='gzip',
-                               chunking=calc_chunks(main_data.shape, np.float32(0).itemsize,
-                                                    unit_chunks=(1, spectra_length)))
+        main_chunks = calc_chunks(main_shape, np.float32(0).itemsize, unit_chunks=(1, spectra_length))
+        if main_writer is None:
+            ds_main = MicroDataset('Raw_Data', data=main_data, dtype=np.float32, compression='gzip',
+                                   chunking=main_chunks)
+        else:
+            ds_main = MicroDataset('Raw_Data', data=main_data, maxshape=main_shape, dtype=np.float32,
+                                   compression='gzip', chunking=main_chunks)
         ds_main.attrs = {'quantity': qty_name, 'units': data_unit}
 
         pos_steps = None
@@ -81,4 +103,4 @@ class NumpyTranslator(Translator):
 
         return super(NumpyTranslator, self).simple_write(h5_path, data_type, translator_name, ds_main,
                                                          [ds_pos_ind, ds_pos_val, ds_spec_inds, ds_spec_vals],
-                                                         parm_dict=parms_dict)
+                                                         parm_dict=parms_dict, main_writer=main_writer)
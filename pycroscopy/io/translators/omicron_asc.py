@@ -6,9 +6,13 @@ Created on Wed Sep 28 12:50:47 2016
 """
 
 from __future__ import division, print_function, absolute_import, unicode_literals
-import numpy as np  # For array operations
+from itertools import islice
 from os import path
+
+import numpy as np  # For array operations
+
 from .numpy_translator import NumpyTranslator
+from .utils import write_text_rows
 
 
 class AscTranslator(NumpyTranslator):
@@ -38,66 +42,52 @@ class AscTranslator(NumpyTranslator):
         folder_path, file_name = path.split(file_path)
         file_name = file_name[:-4]
 
-        # Extracting the raw data into memory
-        file_handle = open(file_path, 'r')
-        string_lines = file_handle.readlines()
-        file_handle.close()
+        num_headers = 403
+
+        # Only the header lines are read here. The data is streamed into the h5 file later
+        with open(file_path, 'r') as file_handle:
+            header_lines = list(islice(file_handle, num_headers))
 
         # Extract parameters from the first few header lines
-        parm_dict = self.__read_parms(string_lines)
+        parm_dict = self.__read_parms(header_lines)
 
         num_rows = int(parm_dict['y-pixels'])
         num_cols = int(parm_dict['x-pixels'])
         num_pos = num_rows * num_cols
         spectra_length = int(parm_dict['z-points'])
 
-        # num_headers = len(string_lines) - num_pos
-        num_headers = 403
-
-        # Extract the STS data from subsequent lines
-        raw_data_2d = self._read_data(string_lines, num_pos, spectra_length, num_headers)
-
         # Generate the x / voltage / spectroscopic axis:
         volt_vec = np.linspace(-1 * max_v, 1 * max_v, spectra_length)
 
         h5_path = path.join(folder_path, file_name + '.h5')
 
-        # pass on the the necessary pieces of information onto the numpy translate that will handle the creation and
-        # writing to the h5 file.
-        h5_path = super(AscTranslator, self).translate(h5_path, raw_data_2d, num_rows, num_cols, qty_name='Current',
-                                                       data_unit='nA', spec_name='Bias', spec_unit='V',
-                                                       spec_val=volt_vec, scan_height=100, scan_width=200,
-                                                       spatial_unit='nm', data_type='STS', translator_name='ASC',
-                                                       parms_dict=parm_dict)
+        # The NumpyTranslator creates an empty main dataset and calls _read_data to stream the STS data into it
+        self.__file_path = file_path
+        self.__num_headers = num_headers
+        h5_path = super(AscTranslator, self).translate(h5_path, (num_pos, spectra_length), num_rows, num_cols,
+                                                       qty_name='Current', data_unit='nA', spec_name='Bias',
+                                                       spec_unit='V', spec_val=volt_vec, scan_height=100,
+                                                       scan_width=200, spatial_unit='nm', data_type='STS',
+                                                       translator_name='ASC', parms_dict=parm_dict)
 
         return h5_path
 
-    def _read_data(self, string_lines, num_pos, spectra_length, num_headers):
+    def _read_data(self, h5_raw):
         """
-        Reads the data from lines of the data file
+        Streams the data from the lines of the data file into the main dataset, a block of lines at a time
 
         Parameters
         ----------
-        string_lines : list of strings
-            Lines containing the data in string format, separated by tabs
-        num_pos : unsigned int
-            Number of pixels
-        spectra_length : unsigned int
-            Number of points in the spectral / voltage axis
-        num_headers : unsigned int
-            Number of header lines to ignore
-
-        Returns
-        -------
-        raw_data_2d : 2D numpy array
-            Data arranged as [position x voltage points]
+        h5_raw : h5py.Dataset
+            Main dataset arranged as [position x voltage points]
         """
-        raw_data_2d = np.zeros(shape=(num_pos, spectra_length), dtype=np.float32)
-        for line_ind in range(num_pos):
-            this_line = string_lines[num_headers + line_ind]
-            string_spectrum = this_line.split('\t')[:-1]  # omitting the new line
-            raw_data_2d[line_ind] = np.array(string_spectrum, dtype=np.float32)
-        return raw_data_2d
+        with open(self.__file_path, 'r') as file_handle:
+            for _ in islice(file_handle, self.__num_headers):
+                pass
+            num_lines = write_text_rows(file_handle, h5_raw, delimiter='\t', max_mem_mb=self.max_ram / 1024 ** 2)
+
+        if num_lines != h5_raw.shape[0]:
+            raise ValueError('Expected {} spectra but found only {}'.format(h5_raw.shape[0], num_lines))
 
     def _parse_file_path(self, input_path):
         pass
@@ -110,7 +100,7 @@ class AscTranslator(NumpyTranslator):
         Parameters
         ----------
         string_lines : list of strings
-            Lines from the data file in string representation
+            Header lines from the data file in string representation
 
         Returns
         -------
@@ -10,11 +10,10 @@ import os
 from warnings import warn
 
 import numpy as np
-from skimage.measure import block_reduce
 from skimage.util import crop
 
 from .df_utils import dm4reader
-from .df_utils.io_image import read_image, read_dm3, parse_dm4_parms
+from .df_utils.io_image import read_image, read_dm3, parse_dm4_parms, no_bin, write_image_stack, bin_images
 from .translator import Translator
 from .utils import generate_dummy_main_parms, make_position_mat, get_spectral_slicing, \
     get_position_slicing, build_ind_val_dsets
@@ -34,7 +33,7 @@ class OneViewTranslator(Translator):
         self.rebin = False
         self.bin_factor = 1
         self.hdf = None
-        self.binning_func = self.__no_bin
+        self.binning_func = no_bin
         self.bin_func = None
         self.h5_main = None
         self.root_image_list = list()
@@ -137,7 +136,7 @@ class OneViewTranslator(Translator):
                                  '{} was given.'.format(bin_factor))
             usize = int(usize / self.bin_factor[0])
             vsize = int(vsize / self.bin_factor[1])
-            self.binning_func = block_reduce
+            self.binning_func = bin_images
             self.bin_func = bin_func
 
         num_files = scan_size_x * scan_size_y
@@ -241,8 +240,8 @@ class OneViewTranslator(Translator):
 
     def _read_data(self, file_list, h5_main, h5_mean_spec, h5_ronch, image_path):
         """
-        Iterates over the images in `file_list`, reading each image and downsampling if
-        reqeusted, and writes the flattened image to file.  Also builds the Mean_Ronchigram
+        Reads the images in `file_list` in parallel, cropping and downsampling if reqeusted, and writes
+        the flattened images to file in blocks.  Also builds the Mean_Ronchigram
         and the Spectroscopic_Mean datasets at the same time.
 
         Parameters
@@ -263,31 +262,16 @@ class OneViewTranslator(Translator):
         None
         """
 
-        mean_ronch = np.zeros(h5_ronch.shape, dtype=np.float32)
+        frame_kwargs = {'image_path': image_path,
+                        'read_kwargs': {'get_parms': False, 'header': self.image_list_tag},
+                        'crop_func': crop_ronchigram,
+                        'crop_args': (self.crop_method, self.crop_ammount),
+                        'binning_func': self.binning_func,
+                        'bin_factor': self.bin_factor,
+                        'bin_func': self.bin_func}
 
-        num_files = len(file_list)
-
-        for ifile, thisfile in enumerate(file_list):
-
-            selected = (ifile + 1) % int(round(num_files / 16)) == 0
-            if selected:
-                print('Processing file...{}% - reading: {}'.format(round(100 * ifile / num_files), thisfile))
-
-            image, _ = read_image(os.path.join(image_path, thisfile), get_parms=False, header=self.image_list_tag)
-            # image, _ = read_image(os.path.join(image_path, thisfile), get_parms=False)
-            image = self.crop_ronc(image)
-            image = self.binning_func(image, self.bin_factor, self.bin_func)
-            image = image.flatten()
-            h5_main[ifile, :] = image
-
-            h5_mean_spec[ifile] = np.mean(image)
-
-            mean_ronch += image
-
-            self.hdf.flush()
-
-        h5_ronch[:] = mean_ronch / num_files
-        self.hdf.flush()
+        write_image_stack(file_list, h5_main, h5_mean_spec, h5_ronch, frame_kwargs=frame_kwargs,
+                          max_mem_mb=self.max_ram / 1024 ** 2)
 
     def crop_ronc(self, ronc):
         """
@@ -303,35 +287,7 @@ class OneViewTranslator(Translator):
         cropped_ronc : numpy.array
             Cropped image
         """
-
-        if self.crop_ammount is None:
-            return ronc
-
-        crop_ammount = self.crop_ammount
-        crop_method = self.crop_method
-
-        if crop_method == 'percent':
-            crop_ammount = np.round(np.atleast_2d(crop_ammount)/100.0*ronc.shape)
-            crop_ammount = tuple([tuple(row) for row in crop_ammount.astype(np.uint32)])
-        elif crop_method == 'absolute':
-            if isinstance(crop_ammount, int):
-                pass
-            elif len(crop_ammount) == 2:
-                crop_ammount = ((crop_ammount[0],), (crop_ammount[1],))
-            elif len(crop_ammount) == 4:
-                crop_ammount = ((crop_ammount[0], crop_ammount[1]), (crop_ammount[2], crop_ammount[3]))
-            else:
-                raise ValueError('The crop_ammount should be an integer or list of 2 or 4 integers.')
-        else:
-            raise ValueError('Allowed values of crop_method are percent and absolute.')
-
-        cropped_ronc = crop(ronc, crop_ammount)
-
-        if any([dim == 0 for dim in cropped_ronc.shape]):
-            warn("Requested crop ammount is greater than the image size.  No cropping will be done.")
-            return ronc
-
-        return cropped_ronc
+        return crop_ronchigram(ronc, self.crop_method, self.crop_ammount)
 
     def downSampRoncVec(self, ronch_vec, binning_factor):
         """
@@ -510,24 +466,48 @@ class OneViewTranslator(Translator):
 
         return h5_main, h5_mean_spec, h5_ronch
 
-    @staticmethod
-    def __no_bin(image, *args, **kwargs):
-        """
-        Does absolutely nothing to the image.  Exists so that we can have
-        a bin function to call whether we actually rebin the image or not.
 
-        Parameters
-        ----------
-        image : ndarray
-            Image
-        args:
-            Argument list
-        kwargs:
-            Keyword argument list
+def crop_ronchigram(ronc, crop_method, crop_ammount):
+    """
+    Crop the input Ronchigram by the specified ammount using the specified method.
+
+    Parameters
+    ----------
+    ronc : numpy.array
+        Input image to be cropped.
+    crop_method : str
+        Method used to crop the image. Either 'percent' or 'absolute'
+    crop_ammount : int or list of int
+        Ammount to crop from the image. No cropping is done if None
+
+    Returns
+    -------
+    cropped_ronc : numpy.array
+        Cropped image
+    """
 
-        Returns
-        -------
-        image : ndarray
-            The input image
-        """
-        return image
+    if crop_ammount is None:
+        return ronc
+
+    if crop_method == 'percent':
+        crop_ammount = np.round(np.atleast_2d(crop_ammount)/100.0*ronc.shape)
+        crop_ammount = tuple([tuple(row) for row in crop_ammount.astype(np.uint32)])
+    elif crop_method == 'absolute':
+        if isinstance(crop_ammount, int):
+            pass
+        elif len(crop_ammount) == 2:
+            crop_ammount = ((crop_ammount[0],), (crop_ammount[1],))
+        elif len(crop_ammount) == 4:
+            crop_ammount = ((crop_ammount[0], crop_ammount[1]), (crop_ammount[2], crop_ammount[3]))
+        else:
+            raise ValueError('The crop_ammount should be an integer or list of 2 or 4 integers.')
+    else:
+        raise ValueError('Allowed values of crop_method are percent and absolute.')
+
+    cropped_ronc = crop(ronc, crop_ammount)
+
+    if any([dim == 0 for dim in cropped_ronc.shape]):
+        warn("Requested crop ammount is greater than the image size.  No cropping will be done.")
+        return ronc
+
+    return cropped_ronc
@@ -10,9 +10,8 @@ import os
 
 import numpy as np
 from skimage.data import imread
-from skimage.measure import block_reduce
 
-from .df_utils.io_image import read_image, read_dm3, no_bin
+from .df_utils.io_image import read_dm3, no_bin, write_image_stack, bin_images
 from .translator import Translator
 from .utils import generate_dummy_main_parms, build_ind_val_dsets
 from ..hdf_utils import getH5DsetRefs, calc_chunks, link_as_main
@@ -86,7 +85,7 @@ class PtychographyTranslator(Translator):
         if image_type == '.dm3':
             file_list = [image_path]
             # image_path, _ = os.path.split(image_path)
-            images, image_parms = read_dm3(image_path)
+            images, image_parms = read_dm3(image_path, memmap=True)
             usize = image_parms['SuperScan_Height']
             vsize = image_parms['SuperScan_Width']
             data_type = images.dtype
@@ -110,7 +109,7 @@ class PtychographyTranslator(Translator):
                                  '{} was given.'.format(bin_factor))
             usize = int(usize / self.bin_factor[0])
             vsize = int(vsize / self.bin_factor[1])
-            self.binning_func = block_reduce
+            self.binning_func = bin_images
             self.bin_func = bin_func
 
         if scan_size_x is None:
@@ -130,8 +129,8 @@ class PtychographyTranslator(Translator):
 
     def _read_data(self, file_list, h5_main, h5_mean_spec, h5_ronch, image_path):
         """
-        Iterates over the images in `file_list`, reading each image and downsampling if
-        reqeusted, and writes the flattened image to file.  Also builds the Mean_Ronchigram
+        Reads the images in `file_list` in parallel, downsampling if reqeusted, and writes
+        the flattened images to file in blocks.  Also builds the Mean_Ronchigram
         and the Spectroscopic_Mean datasets at the same time.
 
         Parameters
@@ -152,29 +151,14 @@ class PtychographyTranslator(Translator):
         None
         """
 
-        mean_ronch = np.zeros(h5_ronch.shape, dtype=np.float32)
+        frame_kwargs = {'image_path': image_path,
+                        'read_kwargs': {'as_grey': True},
+                        'binning_func': self.binning_func,
+                        'bin_factor': self.bin_factor,
+                        'bin_func': self.bin_func}
 
-        num_files = len(file_list)
-
-        for ifile, thisfile in enumerate(file_list):
-
-            selected = (ifile + 1) % round(num_files / 16) == 0
-            if selected:
-                print('Processing file...{}% - reading: {}'.format(round(100 * ifile / num_files), thisfile))
-
-            image, _ = read_image(os.path.join(image_path, thisfile), as_grey=True)
-            image = self.binning_func(image, self.bin_factor, self.bin_func)
-            image = image.flatten()
-            h5_main[ifile, :] = image
-
-            h5_mean_spec[ifile] = np.mean(image)
-
-            mean_ronch += image
-
-            self.hdf.flush()
-
-        h5_ronch[:] = mean_ronch / num_files
-        self.hdf.flush()
+        write_image_stack(file_list, h5_main, h5_mean_spec, h5_ronch, frame_kwargs=frame_kwargs,
+                          max_mem_mb=self.max_ram / 1024 ** 2)
 
     # def downSampRoncVec(self, ronch_vec, binning_factor):
     #     """
@@ -9,9 +9,8 @@ from __future__ import division, print_function, absolute_import, unicode_litera
 import os
 
 import numpy as np
-from skimage.measure import block_reduce
 
-from .df_utils.io_image import read_image, read_dm3
+from .df_utils.io_image import read_image, read_dm3, no_bin, write_image_stack, bin_images
 from .translator import Translator
 from .utils import generate_dummy_main_parms, build_ind_val_dsets
 from ..hdf_utils import getH5DsetRefs, calc_chunks, link_as_main
@@ -29,7 +28,7 @@ class MovieTranslator(Translator):
         self.rebin = False
         self.bin_factor = 1
         self.hdf = None
-        self.binning_func = self.__no_bin
+        self.binning_func = no_bin
         self.bin_func = None
         self.image_ext = None
 
@@ -74,7 +73,7 @@ class MovieTranslator(Translator):
         Get the list of all files with the provided extension and the number of files in the list
         '''
         if os.path.isfile(image_path):
-            file_list, image_parms = read_dm3(image_path)
+            file_list, image_parms = read_dm3(image_path, memmap=True)
             usize = image_parms['SuperScan-Height']
             vsize = image_parms['SuperScan-Width']
             data_type = file_list.dtype.type
@@ -102,7 +101,7 @@ class MovieTranslator(Translator):
                                  '{} was given.'.format(bin_factor))
             usize = int(usize / self.bin_factor[0])
             vsize = int(vsize / self.bin_factor[1])
-            self.binning_func = block_reduce
+            self.binning_func = bin_images
             self.bin_func = bin_func
             data_type = np.float32
 
@@ -116,14 +115,14 @@ class MovieTranslator(Translator):
 
     def _read_data(self, image_stack, h5_main, h5_mean_spec, h5_ronch, image_path):
         """
-        Iterates over the images in `file_list`, reading each image and downsampling if
-        reqeusted, and writes the flattened image to file.  Also builds the Mean_Ronchigram
+        Reads the images in `image_stack` in parallel, downsampling if reqeusted, and writes
+        the flattened images to file in blocks.  Also builds the Mean_Ronchigram
         and the Spectroscopic_Mean datasets at the same time.
 
         Parameters
         ----------
-        image_stack : list of str
-            List of all files in `image_path` that will be read
+        image_stack : list of str or numpy.ndarray
+            List of all files in `image_path` that will be read or the frames of a dm3 stack
         h5_main : h5py.Dataset
             Dataset which will hold the Ronchigrams
         h5_mean_spec : h5py.Dataset
@@ -138,75 +137,15 @@ class MovieTranslator(Translator):
         None
         """
 
-        mean_ronch = np.zeros(h5_ronch.shape, dtype=np.float32)
+        frame_kwargs = {'image_path': image_path,
+                        'read_kwargs': {'as_grey': True},
+                        'binning_func': self.binning_func,
+                        'bin_factor': self.bin_factor,
+                        'bin_func': self.bin_func}
 
-        num_files = len(image_stack)
-
-        if os.path.isfile(image_path):
-            self.__save_dm3_frames(image_stack, h5_main, h5_mean_spec, h5_ronch, mean_ronch, num_files)
-        else:
-            self.__read_image_files(image_stack, h5_main, h5_mean_spec, h5_ronch, image_path, mean_ronch, num_files)
-
-    def __save_dm3_frames(self, image_stack, h5_main, h5_mean_spec, h5_ronch, mean_ronch, num_frames):
-        """
-
-        :param image_stack:
-        :param h5_main:
-        :param h5_mean_spec:
-        :param h5_ronch:
-        :param mean_ronch:
-        :param num_frames:
-        :return:
-        """
-        for iframe, thisframe in enumerate(image_stack):
-            selected = (iframe + 1) % round(num_frames / 16) == 0
-            if selected:
-                print('Processing file...{}% - reading: {}'.format(round(100 * iframe / num_frames), iframe))
-            image = self.binning_func(thisframe, self.bin_factor, self.bin_func).flatten()
-            h5_main[:, iframe] = image
-
-            h5_mean_spec[iframe] = np.mean(image)
-
-            mean_ronch += image
-
-            self.hdf.flush()
-
-        h5_ronch[:] = mean_ronch / num_frames
-        self.hdf.flush()
-
-    def __read_image_files(self, image_stack, h5_main, h5_mean_spec, h5_ronch, image_path, mean_ronch, num_files):
-        """
-        Read each image from `file_list` and save it in `h5_main`.
-
-        Parameters
-        ----------
-        image_stack:
-        :param h5_main:
-        :param h5_mean_spec:
-        :param h5_ronch:
-        :param image_path:
-        :param mean_ronch:
-        :param num_files:
-        :return:
-        """
-        for ifile, thisfile in enumerate(image_stack):
-
-            selected = (ifile + 1) % round(num_files / 16) == 0
-            if selected:
-                print('Processing file...{}% - reading: {}'.format(round(100 * ifile / num_files), thisfile))
-
-            image = read_image(os.path.join(image_path, thisfile), greyscale=True)
-            image = self.binning_func(image, self.bin_factor, self.bin_func)
-            image = image.flatten()
-            h5_main[:, ifile] = image
-
-            h5_mean_spec[ifile] = np.mean(image)
-
-            mean_ronch += image
-
-            self.hdf.flush()
-        h5_ronch[:] = mean_ronch / num_files
-        self.hdf.flush()
+        # Frames of a dm3 stack are memory mapped and read a block at a time. Image files are read by a pool of workers
+        write_image_stack(image_stack, h5_main, h5_mean_spec, h5_ronch, frame_kwargs=frame_kwargs, frame_axis=1,
+                          max_mem_mb=self.max_ram / 1024 ** 2)
 
     def downSampRoncVec(self, ronch_vec, binning_factor):
         """
@@ -389,25 +328,3 @@ class MovieTranslator(Translator):
         self.hdf.flush()
         
         return h5_main, h5_mean_spec, h5_ronch
-
-    @staticmethod
-    def __no_bin(image, *args, **kwargs):
-        """
-        Does absolutely nothing to the image.  Exists so that we can have
-        a bin function to call whether we actually rebin the image or not.
-
-        Parameters
-        ----------
-        image : ndarray
-            Image
-        args:
-            Argument list
-        kwargs:
-            Keyword argument list
-
-        Returns
-        -------
-        image : ndarray
-            The input image
-        """
-        return image
@@ -222,32 +222,34 @@ class TRKPFMTranslator(Translator):
             h5_main.file.flush()
 
     def read_file(self, data_length, f):
-        start_point = 0
-        count=0
-        count_vals=[]
-        f.seek(start_point * 4, 0)
-        cont_cond=True
-        results_p=[]
-        while cont_cond:
-            count_vals.append(count)
-            count += 1
-
-            data_vec = np.fromfile(f, dtype=np.float32, count=int(data_length))
-            data_vec1 = data_vec[5:int(data_length)]
+        """
+        Reads all the spectrograms in the provided .dat file at once
 
-            if len(data_vec) > 1:
+        Parameters
+        ----------
+        data_length : unsigned int
+            Number of 32 bit values in each record, including the 5 values in the header of the record
+        f : file object
+            Handle to the .dat file opened in binary mode. Closed after reading
 
-                s1 = data_vec[3]
-                s2 = data_vec[4]
-                #print('Data_mat and s1,s2:', data_vec1.shape, s1, s2)
-                data_mat1 = data_vec1.reshape(int(s2), int(s1)).T
-                results_p.append(data_mat1)
+        Returns
+        -------
+        results_p : 3D numpy array
+            Spectrograms arranged as [pixel, s1, s2]
+        """
+        data_vec = np.fromfile(f, dtype=np.float32)
+        f.close()
 
-            else:
-                cont_cond = False
+        # Every record starts with its length. The data ends at the first record without a length
+        num_records = data_vec.size // int(data_length)
+        records = data_vec[:num_records * int(data_length)].reshape(num_records, int(data_length))
+        bad_records = np.where(records[:, 0] <= 0)[0]
+        if len(bad_records) > 0:
+            records = records[:bad_records[0]]
 
-        f.close()
-        return results_p
+        s1 = int(records[0, 3])
+        s2 = int(records[0, 4])
+        return records[:, 5:].reshape(-1, s2, s1).transpose(0, 2, 1)
 
     @staticmethod
     def _read_parms(parm_path):
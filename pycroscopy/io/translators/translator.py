@@ -63,7 +63,7 @@ class Translator(object):
         """
 
     @staticmethod
-    def simple_write(h5_path, data_name, translator_name, ds_main, aux_dset_list, parm_dict=None):
+    def simple_write(h5_path, data_name, translator_name, ds_main, aux_dset_list, parm_dict=None, main_writer=None):
         """
         Writes the provided datasets and parameters to an h5 file
         
@@ -81,6 +81,9 @@ class Translator(object):
             auxillary datasets to be written to the file
         parm_dict : dictionary (Optional)
             Dictionary of parameters
+        main_writer : callable (Optional)
+            Called with the main h5py.Dataset before the file is closed. Use this to stream the data into an
+            empty main dataset
 
         Returns
         -------
@@ -115,5 +118,9 @@ class Translator(object):
         h5_refs = hdf.writeData(spm_data, print_log=False)
         h5_raw = getH5DsetRefs([ds_main.name], h5_refs)[0]
         linkRefs(h5_raw, getH5DsetRefs(aux_dset_names, h5_refs))
-        hdf.close()
+        try:
+            if main_writer is not None:
+                main_writer(h5_raw)
+        finally:
+            hdf.close()
         return h5_path
@@ -9,6 +9,7 @@ Basic functions that can be used by any SPM translator class
 from __future__ import division, print_function, absolute_import, unicode_literals
 import numpy as np  # For array operations
 import time as tm  # for getting time stamps
+import warnings
 from ..microdata import MicroDataset
 
 
@@ -265,3 +266,110 @@ def build_ind_val_dsets(dimensions, is_spectral=True, steps=None, initial_values
         ds_values.attrs['units'] = units
 
     return ds_indices, ds_values
+
+
+def read_text_rows(file_handle, num_rows=None, delimiter=None, dtype=np.float32, comments='#'):
+    """
+    Parses the next few lines of numbers from an open text file into a 2D array.
+    All the lines are joined and parsed in a single call to numpy instead of one line at a time.
+    As in numpy.loadtxt, blank lines and comments are skipped.
+
+    Parameters
+    ----------
+    file_handle : file object
+        Text file opened for reading and positioned after any header lines
+    num_rows : unsigned int, optional
+        Number of lines of data to read. Default - None - all remaining lines
+    delimiter : str, optional
+        Separator between the columns of data. Default - None - any whitespace
+    dtype : numpy dtype, optional
+        Data type of the returned array. Default - numpy.float32
+    comments : str, optional
+        Characters that start a comment. Default - '#'
+
+    Returns
+    -------
+    data_mat : 2D numpy array
+        Data arranged as [lines x values per line]. Has no rows if the end of the file was reached
+
+    Raises
+    ------
+    ValueError
+        If a line has a different number of values than the first line or contains text that is not a number
+    """
+    lines = list()
+    for line in file_handle:
+        if comments is not None:
+            line = line.split(comments, 1)[0]
+        if len(line.strip()) == 0:
+            continue
+        lines.append(line)
+        if num_rows is not None and len(lines) == num_rows:
+            break
+    if len(lines) == 0:
+        return np.zeros(shape=(0, 0), dtype=dtype)
+
+    if delimiter is not None and len(delimiter.strip()) > 0:
+        lines = [line.replace(delimiter, ' ') for line in lines]
+    # Every line must have as many values as the first line
+    num_cols = len(lines[0].split())
+    for line_ind, line in enumerate(lines):
+        if len(line.split()) != num_cols:
+            raise ValueError('Line {} of this block has {} values instead of {}. Check the delimiter and the number '
+                             'of header lines'.format(line_ind, len(line.split()), num_cols))
+    text = ' '.join(lines)
+
+    # numpy stops at the first value it cannot parse, which is caught by the size check below
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        try:
+            data_vec = np.fromstring(text, dtype=dtype, sep=' ')
+        except ValueError:
+            data_vec = np.zeros(shape=0, dtype=dtype)
+    if data_vec.size != len(lines) * num_cols:
+        raise ValueError('Could not parse {} rows of {} numbers each from the text. Check the delimiter and '
+                         'the number of header lines'.format(len(lines), num_cols))
+
+    return data_vec.reshape(len(lines), num_cols)
+
+
+def write_text_rows(file_handle, h5_dset, num_rows=None, delimiter=None, max_mem_mb=1024):
+    """
+    Streams lines of numbers from an open text file into an existing 2D HDF5 dataset a block of lines at a time
+
+    Parameters
+    ----------
+    file_handle : file object
+        Text file opened for reading and positioned after any header lines
+    h5_dset : h5py.Dataset
+        2D dataset that will hold the data arranged as [lines x values per line]
+    num_rows : unsigned int, optional
+        Number of lines to read. Default - None - as many as the rows in the dataset
+    delimiter : str, optional
+        Separator between the columns of data. Default - None - any whitespace
+    max_mem_mb : unsigned int, optional
+        Maximum memory in megabytes to use for each block of lines. Default 1024
+
+    Returns
+    -------
+    num_written : unsigned int
+        Number of lines written to the dataset
+    """
+    if num_rows is None:
+        num_rows = h5_dset.shape[0]
+
+    # Allow roughly 32 bytes per value for the text, the joined text and the parsed values
+    rows_per_block = max(1, int(max_mem_mb * 1024 ** 2 / (32 * h5_dset.shape[1])))
+
+    num_written = 0
+    while num_written < num_rows:
+        data_mat = read_text_rows(file_handle, num_rows=min(rows_per_block, num_rows - num_written),
+                                  delimiter=delimiter, dtype=h5_dset.dtype)
+        if data_mat.shape[0] == 0:
+            break
+        h5_dset[num_written: num_written + data_mat.shape[0]] = data_mat
+        num_written += data_mat.shape[0]
+
+    h5_dset.file.flush()
+
+    return num_written
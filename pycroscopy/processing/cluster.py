@@ -10,9 +10,10 @@ import sklearn.cluster as cls
 from scipy.cluster.hierarchy import linkage
 from scipy.spatial.distance import pdist
 from multiprocessing import cpu_count
-from ..io.hdf_utils import getH5DsetRefs, checkAndLinkAncillary, copy_main_attributes, checkIfMain
+from sklearn.utils import gen_batches
+from ..io.hdf_utils import getH5DsetRefs, checkAndLinkAncillary, copy_main_attributes, checkIfMain, get_real_view
 from ..io.io_hdf5 import ioHDF5
-from ..io.io_utils import check_dtype, transformToTargetType
+from ..io.io_utils import check_dtype, transformToTargetType, getAvailableMem
 from ..io.microdata import MicroDataGroup, MicroDataset
 
 
@@ -67,7 +68,10 @@ class Cluster(object):
         self.data_transform_func, self.data_is_complex, self.data_is_compound, \
         self.data_n_features, self.data_n_samples, self.data_type_mult = retval
 
-    def do_cluster(self, rearrange_clusters=True):
+        self.h5_real = None
+        self.real_cols = None
+
+    def do_cluster(self, rearrange_clusters=True, streaming=False, max_mem_mb=1024, use_real_view=False):
         """
         Clusters the hdf5 dataset, calculates mean response for each cluster, and writes the labels and mean response
         back to the h5 file
@@ -76,17 +80,36 @@ class Cluster(object):
         ----------
         rearrange_clusters : (Optional) Boolean. Default = True
             Whether or not the clusters should be re-ordered by relative distances between the mean response
+        streaming : (Optional) Boolean. Default = False
+            Whether or not the dataset should be streamed from the file in batches instead of being read into memory
+            in one go. Only estimators that implement partial_fit(), such as MiniBatchKMeans and Birch, can stream.
+        max_mem_mb : (Optional) unsigned int. Default = 1024
+            Maximum memory (in megabytes) that a single batch is allowed to occupy when streaming
+        use_real_view : (Optional) Boolean. Default = False
+            Whether or not to read the data from the cached float32 real view of the dataset
+            (see hdf_utils.get_real_view) instead of converting the complex / compound values again
 
         Returns
         --------
         h5_group : HDF5 Group reference
             Reference to the group that contains the clustering results
         """
-        self._fit()
-        new_mean_response = self._get_mean_response(self.results.labels_)
-        new_labels = self.results.labels_
+        if use_real_view:
+            self.h5_real = get_real_view(self.h5_main, max_mem_mb=max_mem_mb)
+            self.real_cols = self._get_real_view_columns()
+        if streaming:
+            if not hasattr(self.estimator, 'partial_fit'):
+                raise TypeError('{} does not support streaming since it does not implement '
+                                'partial_fit'.format(self.method_name))
+            batches = self._get_batches(max_mem_mb)
+            self._fit_streaming(batches)
+            new_labels, new_mean_response = self._predict_streaming(batches)
+        else:
+            self._fit()
+            new_labels = self.results.labels_
+            new_mean_response = self._get_mean_response(new_labels)
         if rearrange_clusters:
-            new_labels, new_mean_response = reorder_clusters(self.results.labels_, new_mean_response)
+            new_labels, new_mean_response = reorder_clusters(new_labels, new_mean_response)
         return self._write_to_hdf5(new_labels, new_mean_response)
 
     def _fit(self):
@@ -99,7 +122,117 @@ class Cluster(object):
         """
         print('Performing clustering on {}.'.format(self.h5_main.name))
         # perform fit on the real dataset
-        self.results = self.estimator.fit(self.data_transform_func(self.h5_main[self.data_slice]))
+        self.results = self.estimator.fit(self._read_real_data())
+
+    def _read_real_data(self, batch=slice(None)):
+        """
+        Reads the features of interest for the requested positions as real values
+
+        Parameters
+        ----------
+        batch : (Optional) slice object
+            Positions to read. Default = all positions
+
+        Returns
+        -------
+        data : 2D real numpy array
+            Data arranged as [position, features]
+        """
+        if self.h5_real is None:
+            return self.data_transform_func(self.h5_main[batch, self.data_slice[1]])
+        return self.h5_real[batch, self.real_cols]
+
+    def _get_real_view_columns(self):
+        """
+        Maps the features of interest to the columns of the real view where the real and imaginary parts of complex
+        data or the fields of compound data are stacked side by side
+
+        Returns
+        -------
+        real_cols : slice object or list of unsigned ints
+            Columns of the real view to be used
+        """
+        if self.num_comps == self.h5_main.shape[1]:
+            return slice(None)
+        num_fields = self.data_n_features // self.h5_main.shape[1]
+        comp_inds = np.arange(self.h5_main.shape[1])[self.data_slice[1]]
+        return np.hstack([comp_inds + field * self.h5_main.shape[1] for field in range(num_fields)]).tolist()
+
+    def _get_batches(self, max_mem_mb):
+        """
+        Splits the positions into batches that fit within the available memory when streaming
+
+        Parameters
+        ----------
+        max_mem_mb : unsigned int
+            Maximum memory (in megabytes) that a single batch is allowed to occupy
+
+        Returns
+        -------
+        batches : list of slice objects
+            Slices along the positions axis of the dataset
+        """
+        max_memory = min(max_mem_mb * 1024 ** 2, 0.75 * getAvailableMem())
+        # The raw batch and its real-valued copy are both held in memory
+        mem_per_pos = self.num_comps * (self.h5_main.dtype.itemsize + self.data_type_mult)
+        batch_size = max(1, int(max_memory // mem_per_pos))
+        return list(gen_batches(self.h5_main.shape[0], batch_size))
+
+    def _fit_streaming(self, batches):
+        """
+        Fits the estimator by streaming batches of the dataset through partial_fit()
+
+        Parameters
+        ----------
+        batches : list of slice objects
+            Slices along the positions axis of the dataset
+
+        Returns
+        ------
+        None
+        """
+        print('Performing streaming clustering on {} in {} batches.'.format(self.h5_main.name, len(batches)))
+        for batch in batches:
+            self.estimator.partial_fit(self._read_real_data(batch))
+        self.results = self.estimator
+
+    def _predict_streaming(self, batches):
+        """
+        Labels every position and accumulates the mean response of each cluster in a single streaming pass
+
+        Parameters
+        ----------
+        batches : list of slice objects
+            Slices along the positions axis of the dataset
+
+        Returns
+        -------
+        labels : 1D unsigned int array
+            Array of cluster labels for each position
+        mean_resp : 2D numpy array
+            Array of the mean response for each cluster arranged as [cluster number, response]
+        """
+        labels = np.zeros(shape=self.h5_main.shape[0], dtype=np.uint32)
+        clust_sums = dict()
+        clust_counts = dict()
+        for batch in batches:
+            data_chunk = self._read_real_data(batch)
+            chunk_labels = self.estimator.predict(data_chunk)
+            labels[batch] = chunk_labels
+            for clust_ind in np.unique(chunk_labels):
+                targ_pos = chunk_labels == clust_ind
+                clust_sums[clust_ind] = clust_sums.get(clust_ind, 0) + np.sum(data_chunk[targ_pos], axis=0,
+                                                                              dtype=np.float64)
+                clust_counts[clust_ind] = clust_counts.get(clust_ind, 0) + np.count_nonzero(targ_pos)
+
+        print('Calculated the Mean Response of each cluster.')
+        num_clusts = int(max(clust_sums.keys())) + 1
+        mean_resp = np.zeros(shape=(num_clusts, self.num_comps), dtype=self.h5_main.dtype)
+        for clust_ind in clust_sums.keys():
+            avg_data = np.atleast_2d(clust_sums[clust_ind] / clust_counts[clust_ind])
+            # transform back to the source data type and insert into the mean response
+            mean_resp[clust_ind] = transformToTargetType(avg_data, self.h5_main.dtype)
+        return labels, mean_resp
 
     def _get_mean_response(self, labels):
         """
@@ -118,13 +251,11 @@ class Cluster(object):
         print('Calculated the Mean Response of each cluster.')
         num_clusts = len(np.unique(labels))
         mean_resp = np.zeros(shape=(num_clusts, self.num_comps), dtype=self.h5_main.dtype)
+        # read the real data once instead of once per cluster
+        real_data = self._read_real_data()
         for clust_ind in range(num_clusts):
-            # get all pixels with this label
-            targ_pos = np.argwhere(labels == clust_ind)
-            # slice to get the responses for all these pixels, ensure that it's 2d
-            data_chunk = np.atleast_2d(self.h5_main[:, self.data_slice[1]][targ_pos, :])
-            # transform to real from whatever type it was
-            avg_data = np.mean(self.data_transform_func(data_chunk), axis=0, keepdims=True)
+            # average the responses of all pixels with this label
+            avg_data = np.mean(real_data[labels == clust_ind], axis=0, keepdims=True)
             # transform back to the source data type and insert into the mean response
             mean_resp[clust_ind] = transformToTargetType(avg_data, self.h5_main.dtype)
         return mean_resp
@@ -6,14 +6,16 @@ Created on Tue Jan 05 07:55:56 2016
 """
 
 from __future__ import division, print_function, absolute_import
+from warnings import warn
 import h5py
 import numpy as np
 import sklearn.decomposition as dec
+from sklearn.utils import gen_batches
 
 from ..io.hdf_utils import checkIfMain
-from ..io.hdf_utils import getH5DsetRefs, checkAndLinkAncillary
+from ..io.hdf_utils import getH5DsetRefs, checkAndLinkAncillary, calc_chunks, get_real_view
 from ..io.io_hdf5 import ioHDF5
-from ..io.io_utils import check_dtype, transformToTargetType
+from ..io.io_utils import check_dtype, transformToTargetType, getAvailableMem
 from ..io.microdata import MicroDataGroup, MicroDataset
 
 
@@ -62,20 +64,89 @@ class Decomposition(object):
         self.data_transform_func, self.data_is_complex, self.data_is_compound, \
         self.data_n_features, self.data_n_samples, self.data_type_mult = retval
 
-    def doDecomposition(self):
+        self.h5_real = None
+
+    def doDecomposition(self, streaming=False, max_mem_mb=1024, use_real_view=False):
         """
         Decomposes the hdf5 dataset, and writes the ? back to the hdf5 file
 
+        Parameters
+        ----------
+        streaming : (Optional) Boolean. Default = False
+            Whether or not the dataset should be streamed from the file in batches instead of being read into memory
+            in one go. The fit is streamed through partial_fit() for estimators that support it, such as
+            IncrementalPCA. The projection is always computed batch by batch into a preallocated dataset.
+        max_mem_mb : (Optional) unsigned int. Default = 1024
+            Maximum memory (in megabytes) that a single batch is allowed to occupy when streaming
+        use_real_view : (Optional) Boolean. Default = False
+            Whether or not to read the data from the cached float32 real view of the dataset
+            (see hdf_utils.get_real_view) instead of converting the complex / compound values again
+
         Returns
         --------
         h5_group : HDF5 Group reference
             Reference to the group that contains the decomposition results
         """
+        # NMF on complex data uses the magnitude, which cannot be recovered from the real view
+        if use_real_view and not (self.method_name == 'NMF' and self.data_is_complex):
+            self.h5_real = get_real_view(self.h5_main, max_mem_mb=max_mem_mb)
+        if streaming:
+            batches = self._get_batches(max_mem_mb)
+            self._fit_streaming(batches)
+            h5_decomp_grp = self._writeToHDF5(transformToTargetType(self.estimator.components_, self.h5_main.dtype),
+                                              None)
+            self._transform_streaming(batches, h5_decomp_grp['Projection'])
+            return h5_decomp_grp
+
         self._fit()
         self._transform()
         return self._writeToHDF5(transformToTargetType(self.estimator.components_, self.h5_main.dtype),
                                  self.projection)
 
+    def _get_real_data(self, batch=slice(None)):
+        """
+        Reads the requested positions from the dataset and converts them to the real values used by the estimator
+
+        Parameters
+        ----------
+        batch : (optional) slice object
+            Positions to read. Default = all positions
+
+        Returns
+        -------
+        data : 2D real numpy array
+            Data arranged as [position, features]
+        """
+        if self.h5_real is not None:
+            data = self.h5_real[batch]
+            if self.method_name == 'NMF':
+                data = np.abs(data)
+            return data
+        data = self.h5_main[batch]
+        if self.method_name == 'NMF':
+            data = np.abs(data)
+        return self.data_transform_func(data)
+
+    def _get_batches(self, max_mem_mb):
+        """
+        Splits the positions into batches that fit within the available memory when streaming
+
+        Parameters
+        ----------
+        max_mem_mb : unsigned int
+            Maximum memory (in megabytes) that a single batch is allowed to occupy
+
+        Returns
+        -------
+        batches : list of slice objects
+            Slices along the positions axis of the dataset
+        """
+        max_memory = min(max_mem_mb * 1024 ** 2, 0.75 * getAvailableMem())
+        # The raw batch and its real-valued copy are both held in memory
+        mem_per_pos = self.h5_main.shape[1] * (self.h5_main.dtype.itemsize + self.data_type_mult)
+        batch_size = max(1, int(max_memory // mem_per_pos))
+        return list(gen_batches(self.h5_main.shape[0], batch_size))
+
     def _fit(self):
         """
         Fits the provided dataset
@@ -85,11 +156,32 @@ class Decomposition(object):
         None
         """
         # perform fit on the real dataset
-        if self.method_name=='NMF':
-            self.estimator.fit(self.data_transform_func(np.abs(self.h5_main)))
-        else:
-            self.estimator.fit(self.data_transform_func(self.h5_main))
-        
+        self.estimator.fit(self._get_real_data())
+
+    def _fit_streaming(self, batches):
+        """
+        Fits the estimator by streaming batches of the dataset through partial_fit().
+        Estimators that do not implement partial_fit() are fit on the full dataset instead.
+
+        Parameters
+        ----------
+        batches : list of slice objects
+            Slices along the positions axis of the dataset
+
+        Returns
+        ------
+        None
+        """
+        if not hasattr(self.estimator, 'partial_fit'):
+            warn('{} does not implement partial_fit. The entire dataset will be read into memory for the '
+                 'fit'.format(self.method_name))
+            self._fit()
+            return
+
+        print('Performing streaming decomposition on {} in {} batches.'.format(self.h5_main.name, len(batches)))
+        for batch in batches:
+            self.estimator.partial_fit(self._get_real_data(batch))
+
     def _transform(self, data=None):
         """
         Transforms the original OR provided dataset with previously computed fit
@@ -105,33 +197,55 @@ class Decomposition(object):
         None
         """
         if data is None:
-            if self.method_name=='NMF':
-                self.projection = self.estimator.transform(self.data_transform_func(np.abs(self.h5_main)))
-            else:
-                self.projection = self.estimator.transform(self.data_transform_func(self.h5_main))
+            self.projection = self.estimator.transform(self._get_real_data())
         else:
             if isinstance(data, h5py.Dataset):
                 if data.shape[0] == self.h5_main.shape[0]:
                     self.projection = self.estimator.transform(data)
 
+    def _transform_streaming(self, batches, h5_projection):
+        """
+        Projects the dataset onto the fitted components one batch at a time
+
+        Parameters
+        ----------
+        batches : list of slice objects
+            Slices along the positions axis of the dataset
+        h5_projection : HDF5 dataset
+            Preallocated dataset of shape [position, component] that the projection will be written into
+
+        Returns
+        ------
+        None
+        """
+        for batch in batches:
+            h5_projection[batch] = np.float32(self.estimator.transform(self._get_real_data(batch)))
+        self.h5_main.file.flush()
+
     def _writeToHDF5(self, components, projection):
         """
         Writes the labels and mean response to the h5 file
 
         Parameters
         ------------
-        labels : 1D unsigned int array
-            Array of cluster labels as obtained from the fit
-        mean_response : 2D numpy array
-            Array of the mean response for each cluster arranged as [cluster number, response]
+        components : 2D numpy array
+            Components of the decomposition arranged as [component, features]
+        projection : 2D numpy array or None
+            Projection of the data onto the components arranged as [position, component].
+            If None, an empty Projection dataset is allocated so that it can be populated batch by batch
 
         Returns
         ---------
-        h5_labels : HDF5 Group reference
-            Reference to the group that contains the clustering results
+        h5_decomp_grp : HDF5 Group reference
+            Reference to the group that contains the decomposition results
         """
         ds_components = MicroDataset('Components', components)# equivalent to V         
-        ds_projections = MicroDataset('Projection', np.float32(projection)) # equivalent of U compound        
+        if projection is None:
+            proj_shape = (self.h5_main.shape[0], components.shape[0])
+            ds_projections = MicroDataset('Projection', data=[], maxshape=proj_shape, dtype=np.float32,
+                                          chunking=calc_chunks(proj_shape, np.float32(0).itemsize))
+        else:
+            ds_projections = MicroDataset('Projection', np.float32(projection)) # equivalent of U compound
         
         decomp_ind_mat = np.transpose(np.atleast_2d(np.arange(components.shape[0])))
 
@@ -163,7 +277,7 @@ class Decomposition(object):
         h5_decomp_refs = hdf.writeData(decomp_grp)
 
         h5_components = getH5DsetRefs(['Components'], h5_decomp_refs)[0]
-        h5_projections = getH5DsetRefs(['Mean_Response'], h5_decomp_refs)[0]
+        h5_projections = getH5DsetRefs(['Projection'], h5_decomp_refs)[0]
         h5_decomp_inds = getH5DsetRefs(['Decomposition_Indices'], h5_decomp_refs)[0]
         h5_decomp_vals = getH5DsetRefs(['Decomposition_Values'], h5_decomp_refs)[0]
 
@@ -12,10 +12,22 @@ import multiprocessing as mp
 import h5py
 import numpy as np
 import skimage.feature
+from sklearn.utils import gen_batches
 
 
 # TODO: Docstrings following numpy standard.
 
+# Typecodes of the numpy types that can be placed in shared memory as they are. Others are shared as float64
+_shared_typecodes = {np.dtype(np.float32): 'f', np.dtype(np.float64): 'd',
+                     np.dtype(np.uint8): 'B', np.dtype(np.int8): 'b',
+                     np.dtype(np.uint16): 'H', np.dtype(np.int16): 'h',
+                     np.dtype(np.uint32): 'I', np.dtype(np.int32): 'i'}
+
+# Stack of frames and extra inputs shared by the worker processes. Set once per worker by _init_stack_worker
+_worker_stack = None
+_worker_args = None
+
+
 #### Functions
 def pickle_keypoints(keypoints):
     """
@@ -37,6 +49,255 @@ def pickle_keypoints(keypoints):
     return kpArray
 
 
+def share_stack(dataset, max_mem_mb=256):
+    """
+    Copies a stack of images into shared memory so that worker processes can read the frames without
+    having them pickled and sent with every task.
+
+    Parameters
+    ----------
+    dataset : h5py.Dataset or numpy.ndarray
+        Stack of images arranged as [frame, pixel] with square frames or as [frame, row, column]
+    max_mem_mb : unsigned int, optional
+        Maximum memory in MB to use when reading an HDF5 dataset into shared memory. Default 256
+
+    Returns
+    -------
+    stack : numpy.ndarray
+        Stack of images arranged as [frame, row, column] that lives in shared memory
+    shared_data : multiprocessing.RawArray
+        Shared memory buffer holding the stack. Pass this to the pool initializer
+    """
+    if dataset.ndim == 3:
+        frame_shape = dataset.shape[1:]
+    else:
+        dim = int(np.sqrt(dataset.shape[-1]))
+        frame_shape = (dim, dim)
+    num_frames = int(dataset.size / np.prod(frame_shape))
+
+    dtype = np.dtype(dataset.dtype)
+    if dtype not in _shared_typecodes:
+        dtype = np.dtype(np.float64)
+    shared_data = mp.RawArray(_shared_typecodes[dtype], int(num_frames * np.prod(frame_shape)))
+    stack = np.frombuffer(shared_data, dtype=dtype).reshape((num_frames,) + tuple(frame_shape))
+
+    # Copy the data in batches so that the whole dataset is never held in memory twice
+    flat_stack = stack.reshape(dataset.shape[0], -1)
+    batch_size = max(1, int(max_mem_mb * 1024 ** 2 / (flat_stack.shape[1] * dtype.itemsize)))
+    for batch in gen_batches(dataset.shape[0], batch_size):
+        flat_stack[batch] = np.reshape(dataset[batch], (batch.stop - batch.start, -1))
+
+    return stack, shared_data
+
+
+def _init_stack_worker(shared_data, stack_shape, dtype, worker_args):
+    """
+    Makes the stack in shared memory and any other inputs available to the tasks of this worker
+
+    Parameters
+    ----------
+    shared_data : multiprocessing.RawArray
+        Shared memory buffer returned by share_stack
+    stack_shape : tuple of unsigned ints
+        Shape of the stack
+    dtype : str
+        Data type of the stack
+    worker_args : dict
+        Other inputs needed by the tasks
+    """
+    global _worker_stack, _worker_args
+    if shared_data is not None:
+        _worker_stack = np.frombuffer(shared_data, dtype=np.dtype(dtype)).reshape(stack_shape)
+    _worker_args = worker_args
+
+
+def get_worker_inputs():
+    """
+    Returns the stack and other inputs set by _init_stack_worker in this worker process
+
+    Returns
+    -------
+    stack : numpy.ndarray
+        Stack of images arranged as [frame, row, column]
+    worker_args : dict
+        Other inputs needed by the tasks
+    """
+    return _worker_stack, _worker_args
+
+
+def _same_inputs(old_args, new_args):
+    """
+    Checks whether the workers of a running pool were given the very same inputs
+
+    Parameters
+    ----------
+    old_args : dict or None
+        Inputs given to the running pool
+    new_args : dict or None
+        Inputs needed now
+
+    Returns
+    -------
+    same : Boolean
+        True if both are None or hold the same objects under the same keys
+    """
+    if old_args is None or new_args is None:
+        return old_args is new_args
+    if set(old_args.keys()) != set(new_args.keys()):
+        return False
+    return all(old_args[key] is new_args[key] for key in old_args)
+
+
+def detect_features(image, detector, lib):
+    """
+    Detects and computes the keypoints and descriptors of a single image
+
+    Parameters
+    ----------
+    image : 2D numpy.ndarray
+        Image to extract features from
+    detector : object
+        Detector from the computer vision library. skimage detector classes are instantiated with default parameters
+    lib : (string)
+        computer vision library to use (opencv or skimage)
+
+    Returns
+    -------
+    keypts :
+        keypoints
+    descs :
+        descriptors
+    """
+    if lib == 'opencv':
+        image = (image - image.mean()) / image.std()
+        image = image.astype('uint8')
+        k_obj, d_obj = detector.detectAndCompute(image, None)
+        keypts, descs = pickle_keypoints(k_obj), pickle_keypoints(d_obj)
+
+    elif lib == 'skimage':
+        if isinstance(detector, type):
+            detector = detector()
+        imp = (image - image.mean()) / np.std(image)
+        imp[imp < 0] = 0
+        imp.astype('float32')
+        detector.detect_and_extract(imp)
+        keypts, descs = detector.keypoints, detector.descriptors
+
+    return keypts, descs
+
+
+def _detect_task(frame_ind):
+    """
+    Detects the features of one frame of the shared stack
+
+    Parameters
+    ----------
+    frame_ind : unsigned int
+        Index of the frame in the stack
+
+    Returns
+    -------
+    keypts :
+        keypoints
+    descs :
+        descriptors
+    """
+    return detect_features(_worker_stack[frame_ind], _worker_args['detector'], _worker_args['lib'])
+
+
+class StackPool(object):
+    """
+    Pool of worker processes that share a stack of images through shared memory.
+    The same pool is reused by all the parallel methods until the stack, the number of processes
+    or the inputs given to the workers change.
+    """
+
+    def __init__(self):
+        self.pool = None
+        self.processes = None
+        # Holding on to the shared buffer keeps it alive so that it cannot be mistaken for a new buffer
+        self.shared_data = None
+        self.worker_args = None
+
+    def get(self, stack, shared_data, processes, worker_args=None):
+        """
+        Returns a pool whose workers can see the provided stack, starting a new one only when necessary
+
+        Parameters
+        ----------
+        stack : numpy.ndarray
+            Stack of images returned by share_stack. None if the tasks do not need the stack
+        shared_data : multiprocessing.RawArray
+            Shared memory buffer holding the stack. None if the tasks do not need the stack
+        processes : unsigned int
+            Number of processes
+        worker_args : dict, optional
+            Other inputs needed by the tasks
+
+        Returns
+        -------
+        pool : multiprocessing.Pool
+            Pool of workers
+        """
+        if self.pool is not None and self.processes == processes and self.shared_data is shared_data \
+                and _same_inputs(self.worker_args, worker_args):
+            return self.pool
+
+        self.close()
+        print('launching %i kernels...' % (processes))
+        if stack is None:
+            stack_shape, dtype = None, None
+        else:
+            stack_shape, dtype = stack.shape, stack.dtype.str
+        self.pool = mp.Pool(processes, initializer=_init_stack_worker,
+                            initargs=(shared_data, stack_shape, dtype, worker_args))
+        self.processes = processes
+        self.shared_data = shared_data
+        self.worker_args = worker_args
+        return self.pool
+
+    def close(self):
+        """
+        Shuts down the workers if a pool is running
+        """
+        if self.pool is not None:
+            print('Closing down the kernels... \n')
+            self.pool.close()
+            self.pool.join()
+        self.pool = None
+        self.processes = None
+        self.shared_data = None
+        self.worker_args = None
+
+
+def _mask_stack(dset, origin, winSize):
+    """
+    Crops a window out of every frame of the stack
+
+    Parameters
+    ----------
+    dset : numpy.ndarray
+        Stack of images arranged as [frame, row, column]
+    origin : list of unsigned ints
+        Center of the window
+    winSize : unsigned int
+        Size of the window
+
+    Returns
+    -------
+    cropped : numpy.ndarray
+        Stack of cropped images
+    """
+    def mask_func(x, winSize):
+        x[origin[0] - winSize // 2: origin[0] + winSize // 2,
+        origin[1] - winSize // 2: origin[1] + winSize // 2] = 2
+        x = x - 1
+        return x
+
+    mask_ind = np.mask_indices(dset.shape[-1], mask_func, winSize)
+    return np.array([imp[mask_ind].reshape(winSize, winSize) for imp in dset])
+
+
 # Class to do feature extraction. This is a wrapper on scikit-image and openCV feature extraction detectors.
 # TODO: Add support for opencV or implement sift.
 # TODO: Add io operations for extracted features.
@@ -48,6 +309,9 @@ class FeatureExtractorParallel(object):
     feature extraction on the data set that are detector based.
     Begin by loading a detector for features and a computer vision library.
 
+    The data set is placed in shared memory and the pool of workers is kept alive between
+    calls. Call closePool() or clearData() when done.
+
     Parameters
     ----------
     detector_name : (string)
@@ -63,6 +327,8 @@ class FeatureExtractorParallel(object):
 
     def __init__(self, detector_name, lib):
         self.data = []
+        self.shared_data = None
+        self.pool = StackPool()
         self.lib = lib
 
         try:
@@ -75,8 +341,16 @@ class FeatureExtractorParallel(object):
             print('Error: The Library does not contain the specified detector')
 
     def clearData(self):
+        self.closePool()
         del self.data
         self.data = []
+        self.shared_data = None
+
+    def closePool(self):
+        """
+        This is a Method that shuts down the pool of workers.
+        """
+        self.pool.close()
 
     def loadData(self, dataset):
         """
@@ -90,9 +364,7 @@ class FeatureExtractorParallel(object):
         if not isinstance(dataset, h5py.Dataset):
             warnings.warn('Error: Data must be an h5 Dataset object')
         else:
-            self.data = dataset
-            dim = int(np.sqrt(self.data.shape[-1]))
-            self.data = self.data.reshape(-1, dim, dim)
+            self.data, self.shared_data = share_stack(dataset)
 
     def getData(self):
         """
@@ -121,47 +393,22 @@ class FeatureExtractorParallel(object):
             descriptors
 
         """
-        detector = self.detector
-        dset = self.data
-        lib = self.lib
         processes = kwargs.get('processors', 1)
         mask = kwargs.get('mask', False)
         origin = kwargs.get('origin', [0, 0])
         winSize = kwargs.get('window_size', 0)
 
         if mask:
-            def mask_func(x, winSize):
-                x[origin[0] - winSize / 2: origin[0] + winSize / 2,
-                origin[1] - winSize / 2: origin[1] + winSize / 2] = 2
-                x = x - 1
-                return x
-
-            mask_ind = np.mask_indices(dset.shape[-1], mask_func, winSize)
-            self.data = np.array([imp[mask_ind].reshape(winSize, winSize) for imp in dset])
+            self.data, self.shared_data = share_stack(_mask_stack(self.data, origin, winSize))
+        elif self.shared_data is None:
+            self.data, self.shared_data = share_stack(np.asarray(self.data))
 
-        # detect and compute keypoints
-        def detect(image):
-            if lib == 'opencv':
-                image = (image - image.mean()) / image.std()
-                image = image.astype('uint8')
-                k_obj, d_obj = detector.detectAndCompute(image, None)
-                keypts, descs = pickle_keypoints(k_obj), pickle_keypoints(d_obj)
-
-            elif lib == 'skimage':
-                imp = (image - image.mean()) / np.std(image)
-                imp[imp < 0] = 0
-                imp.astype('float32')
-                detector.detect_and_extract(imp)
-                keypts, descs = detector.keypoints, detector.descriptors
-
-            return keypts, descs
-
-        # start pool of workers
-        print('launching %i kernels...' % (processes))
-        pool = mp.Pool(processes)
-        tasks = [(imp) for imp in self.data]
-        chunk = int(self.data.shape[0] / processes)
-        jobs = pool.imap(detect, tasks, chunksize=chunk)
+        # get the pool of workers. Only the frame indices are sent to the workers
+        pool = self.pool.get(self.data, self.shared_data, processes,
+                             worker_args={'detector': self.detector, 'lib': self.lib})
+        num_frames = self.data.shape[0]
+        chunk = max(1, int(num_frames / (4 * processes)))
+        jobs = pool.imap(_detect_task, range(num_frames), chunksize=chunk)
 
         # get keypoints and descriptors
         results = []
@@ -175,10 +422,6 @@ class FeatureExtractorParallel(object):
         keypts = [itm[0].astype('int') for itm in results]
         desc = [itm[1] for itm in results]
 
-        # close the pool
-        print('Closing down the kernels... \n')
-        pool.close()
-
         return keypts, desc
 
 
@@ -230,9 +473,8 @@ class FeatureExtractorSerial(object):
         if not isinstance(dataset, h5py.Dataset):
             warnings.warn('Error: Data must be an h5 Dataset object')
         else:
-            self.data = dataset
-            dim = int(np.sqrt(self.data.shape[-1]))
-            self.data = self.data.reshape(-1, dim, dim)
+            dim = int(np.sqrt(dataset.shape[-1]))
+            self.data = np.reshape(dataset[()], (-1, dim, dim))
 
     def getData(self):
         """
@@ -258,42 +500,15 @@ class FeatureExtractorSerial(object):
             keypoints
 
         """
-        detector = self.detector
-        dset = self.data
-        lib = self.lib
         mask = kwargs.get('mask', False)
         origin = kwargs.get('origin', [0, 0])
         winSize = kwargs.get('window_size', 0)
 
         if mask:
-            def mask_func(x, winSize):
-                x[origin[0] - winSize / 2: origin[0] + winSize / 2,
-                origin[1] - winSize / 2: origin[1] + winSize / 2] = 2
-                x = x - 1
-                return x
-
-            mask_ind = np.mask_indices(dset.shape[-1], mask_func, winSize)
-            self.data = np.array([imp[mask_ind].reshape(winSize, winSize) for imp in dset])
+            self.data = _mask_stack(self.data, origin, winSize)
 
         # detect and compute keypoints
-        def detect(image):
-            if lib == 'opencv':
-                image = (image - image.mean()) / image.std()
-                image = image.astype('uint8')
-                k_obj, d_obj = detector.detectAndCompute(image, None)
-                keypts, descs = pickle_keypoints(k_obj), pickle_keypoints(d_obj)
-
-            elif lib == 'skimage':
-                imp = (image - image.mean()) / np.std(image)
-                imp[imp < 0] = 0
-                imp.astype('float32')
-                detector.detect_and_extract(imp)
-                keypts, descs = detector.keypoints, detector.descriptors
-
-            return keypts, descs
-
-        # start pool of workers
-        results = [detect(imp) for imp in self.data]
+        results = [detect_features(imp, self.detector, self.lib) for imp in self.data]
 
         # get keypoints and descriptors
         keypts = [itm[0].astype('int') for itm in results]
@@ -15,7 +15,7 @@ import matplotlib.pyplot as plt
 from scipy.linalg import sqrtm
 
 from ..io.io_hdf5 import ioHDF5
-from ..io.io_utils import recommendCores
+from ..io.io_utils import recommendCores, getAvailableMem
 from ..io.microdata import MicroDataGroup, MicroDataset
 from ..io.hdf_utils import getH5DsetRefs, getAuxData, link_as_main, copyAttributes, linkRefAsAlias
 
@@ -69,63 +69,25 @@ def do_bayesian_inference(V, IV_point, freq, num_x_steps=251, gam=0.03, e=10.0,
 
     """
     num_samples = int(num_samples)
-    num_x_steps = int(num_x_steps)
-    if num_x_steps % 2 == 0:
-        num_x_steps += 1  # Always keep it odd
 
-    # Organize, set up the problem
-    t_max = 1. / freq
-    t = np.linspace(0, t_max, len(V))
-    dt = t[2] - t[1]
-    dv = np.diff(V) / dt
-    dv = np.append(dv, dv[-1])
+    operators = build_bayesian_operators(V, freq, num_x_steps=num_x_steps, gam=gam, e=e, sigma=sigma,
+                                         sigmaC=sigmaC)
+    x = operators['x']
+    A = operators['A']
+    P0 = operators['P0']
+    m0 = operators['m0']
+    Sigma = operators['Sigma']
+    num_x_steps = x.size
     max_volts = max(V)
-    # num_x_steps = int(round(2 * round(max_volts / dx, 1) + 1, 0))
-    x = np.linspace(-max_volts, max_volts, num_x_steps)
-    dx = x[1] - x[0]
-    # M = len(x)
-    num_volt_points = len(V)
-
-    # Build A
-    A = np.zeros(shape=(num_volt_points, num_x_steps + 1))
-    for j in range(num_volt_points):
-        ix = int(round(np.floor((V[j] + max_volts) / dx) + 1))
-        ix = min(ix, len(x)-1)
-        ix = max(ix, 1)
-        A[j, ix] = V[j] * (V[j] - x[ix - 1]) / (x[ix] - x[ix - 1])
-        A[j, ix - 1] = V[j] * (1. - (V[j] - x[ix - 1]) / (x[ix] - x[ix - 1]))
-
-    A[:, num_x_steps] = dv
-
-    # generate simulated observations
-    Lapt = (-1. * np.diag((t[:-1]) ** 0, -1) - np.diag(t[:-1] ** 0, 1) + 2. * np.diag(t ** 0, 0)) / dt / dt
-    Lapt[0, 0] = 1. / dt / dt
-    Lapt[-1, -1] = 1. / dt / dt
-    O = (1. / gam ** 2) * (np.eye(num_volt_points))
-    # noise_term = np.linalg.lstsq(sqrtm(O),np.random.randn(N,1))[0]
-    # y = IV_point
-    #  Itrue + noise_term.ravel()
-
-    Lap = (-1. * np.diag((x[:-1]) ** 0, -1) - np.diag(x[:-1] ** 0, 1) + 2. * np.diag(x ** 0, 0)) / dx / dx
-    Lap[0, 0] = 1. / dx / dx
-    Lap[-1, -1] = 1. / dx / dx
-
-    m0 = 3. * np.ones((num_x_steps, 1))
-    m0 = np.append(m0, 0)
-
-    P0 = np.zeros(shape=(num_x_steps + 1, num_x_steps + 1))
-    P0[:num_x_steps, :num_x_steps] = 1. / sigma ** 2 * (1. * np.eye(num_x_steps) + np.linalg.matrix_power(Lap, 3))
-    P0[num_x_steps, num_x_steps] = 1. / sigmaC ** 2
 
-    Sigma = np.linalg.inv(np.dot(A.T, np.dot(O, A)) + P0)
-    m = np.dot(Sigma, (np.dot(A.T, np.dot(O, IV_point)) + np.dot(P0, m0)))
+    m = np.dot(Sigma, (np.dot(A.T, np.dot(operators['O'], IV_point)) + np.dot(P0, m0)))
 
     # Reconstructed current
     Irec = np.dot(A, m)  # This includes the capacitance
 
     # Draw samples from S
     # SI = (np.matlib.repmat(m[:M], num_samples, 1).T) + np.dot(sqrtm(Sigma[:M, :M]), np.random.randn(M, num_samples))
-    SI = np.tile(m[:num_x_steps], (num_samples, 1)).T + np.dot(sqrtm(Sigma[:num_x_steps, :num_x_steps]),
+    SI = np.tile(m[:num_x_steps], (num_samples, 1)).T + np.dot(operators['sqrt_sigma'],
                                                                np.random.randn(num_x_steps, num_samples))
     # approximate mean and covariance of R
     mR = 1. / num_samples * np.sum(1. / SI, 1)
@@ -179,6 +141,149 @@ def do_bayesian_inference(V, IV_point, freq, num_x_steps=251, gam=0.03, e=10.0,
     return results_dict
 
 
+def build_bayesian_operators(V, freq, num_x_steps=251, gam=0.03, e=10.0, sigma=10., sigmaC=1.):
+    """
+    Builds the matrices used in the Bayesian inference that only depend on the voltage vector and the parameters
+    and not on the measured current. These only need to be computed once for all pixels in a dataset.
+
+    Parameters
+    ----------
+    V : 1D array or list
+        voltage values
+    freq : float
+        frequency of applied waveform
+    num_x_steps : unsigned int (Optional, Default = 251)
+        Number of steps in x vector (interpolating V)
+    gam : float (Optional, Default = 0.03)
+        gamma value for reconstruction
+    e : float (Optional, Default = 10.0)
+        Ask Kody
+    sigma : float (Optional, Default = 10.0)
+        Ask Kody
+    sigmaC : float (Optional, Default = 1.0)
+        Ask Kody
+
+    Returns
+    -------
+    operators : Dictionary
+        Dictionary items are
+        'x' : 1D float array.  Voltage vector interpolated with num_x_steps number of points
+        'A' : 2D float array.  Design matrix arranged as [voltage points, x steps + capacitance]
+        'O' : 2D float array.  Precision matrix of the noise
+        'P0' : 2D float array.  Precision matrix of the prior
+        'm0' : 1D float array.  Mean of the prior
+        'Sigma' : 2D float array.  Posterior covariance
+        'gain' : 2D float array.  Maps the current to the posterior mean, arranged as [x steps + 1, voltage points]
+        'offset' : 1D float array.  Contribution of the prior to the posterior mean
+        'sqrt_sigma' : 2D float array.  Square root of the posterior covariance of R
+    """
+    V = np.asarray(V)
+    num_x_steps = int(num_x_steps)
+    if num_x_steps % 2 == 0:
+        num_x_steps += 1  # Always keep it odd
+
+    # Organize, set up the problem
+    t_max = 1. / freq
+    t = np.linspace(0, t_max, len(V))
+    dt = t[2] - t[1]
+    dv = np.diff(V) / dt
+    dv = np.append(dv, dv[-1])
+    max_volts = max(V)
+    x = np.linspace(-max_volts, max_volts, num_x_steps)
+    dx = x[1] - x[0]
+    num_volt_points = len(V)
+
+    # Build A
+    A = np.zeros(shape=(num_volt_points, num_x_steps + 1))
+    ix = np.int64(np.floor((V + max_volts) / dx) + 1)
+    ix = np.clip(ix, 1, len(x) - 1)
+    frac = (V - x[ix - 1]) / (x[ix] - x[ix - 1])
+    volt_inds = np.arange(num_volt_points)
+    A[volt_inds, ix] = V * frac
+    A[volt_inds, ix - 1] = V * (1. - frac)
+
+    A[:, num_x_steps] = dv
+
+    O = (1. / gam ** 2) * (np.eye(num_volt_points))
+
+    Lap = (-1. * np.diag((x[:-1]) ** 0, -1) - np.diag(x[:-1] ** 0, 1) + 2. * np.diag(x ** 0, 0)) / dx / dx
+    Lap[0, 0] = 1. / dx / dx
+    Lap[-1, -1] = 1. / dx / dx
+
+    m0 = 3. * np.ones((num_x_steps, 1))
+    m0 = np.append(m0, 0)
+
+    P0 = np.zeros(shape=(num_x_steps + 1, num_x_steps + 1))
+    P0[:num_x_steps, :num_x_steps] = 1. / sigma ** 2 * (1. * np.eye(num_x_steps) + np.linalg.matrix_power(Lap, 3))
+    P0[num_x_steps, num_x_steps] = 1. / sigmaC ** 2
+
+    Sigma = np.linalg.inv(np.dot(A.T, np.dot(O, A)) + P0)
+
+    # m = gain * I + offset for any measured current I
+    gain = np.dot(Sigma, np.dot(A.T, O))
+    offset = np.dot(Sigma, np.dot(P0, m0))
+
+    # Computing the square root is expensive, so it is only done once here instead of once per pixel
+    sqrt_sigma = np.real(sqrtm(Sigma[:num_x_steps, :num_x_steps]))
+
+    return {'x': x, 'A': A, 'O': O, 'P0': P0, 'm0': m0, 'Sigma': Sigma, 'gain': gain, 'offset': offset,
+            'sqrt_sigma': sqrt_sigma}
+
+
+def do_bayesian_inference_batch(IV_mat, operators, num_samples=2E3, max_mem_mb=256):
+    """
+    Performs the Bayesian inference on several current vectors that were all measured against the same voltage
+    vector. The posterior means of all pixels are computed via a single matrix product and samples are drawn
+    for blocks of pixels at a time.
+
+    Parameters
+    ----------
+    IV_mat : 2D array
+        current values arranged as [pixels, voltage points], should be in nA
+    operators : Dictionary
+        Matrices shared by all pixels, as returned by build_bayesian_operators
+    num_samples : unsigned int (Optional, Default = 2E3)
+        Number of samples
+    max_mem_mb : unsigned int (Optional, Default = 256)
+        Maximum memory in megabytes used to hold the samples at any given time
+
+    Returns
+    -------
+    results_dict : Dictionary
+        Dictionary items are the same as the econ results of do_bayesian_inference but for all pixels:
+        'x' : 1D float array.  Voltage vector interpolated with num_x_steps number of points
+        'mR' : 2D float array.  Bayesian inference of the resistance arranged as [pixels, x steps]
+        'vR' : 2D float array.  Variance of inferred resistance arranged as [pixels, x steps]
+        'Irec' : 2D float array.  Reconstructed current arranged as [pixels, voltage points]
+        'cValue' : 1D float array.  Capacitance value of each pixel
+    """
+    num_samples = int(num_samples)
+    IV_mat = np.atleast_2d(IV_mat)
+    num_pix = IV_mat.shape[0]
+    num_x_steps = operators['x'].size
+
+    # Posterior means and reconstructed currents for all pixels at once
+    m_mat = np.dot(IV_mat, operators['gain'].T) + operators['offset']
+    Irec = np.dot(m_mat, operators['A'].T)
+
+    mR = np.zeros(shape=(num_pix, num_x_steps))
+    vR = np.zeros(shape=(num_pix, num_x_steps))
+
+    # The noise is drawn once per block of pixels and shared by all pixels in that block
+    pix_per_block = max(1, int(max_mem_mb * 1024 ** 2 // (num_x_steps * num_samples * np.float64(0).itemsize)))
+    for start_pix in range(0, num_pix, pix_per_block):
+        pix_slice = slice(start_pix, min(start_pix + pix_per_block, num_pix))
+        noise = np.dot(operators['sqrt_sigma'], np.random.randn(num_x_steps, num_samples))
+        # approximate mean and variance of R from the samples
+        inv_si = np.add(m_mat[pix_slice, :num_x_steps, np.newaxis], noise[np.newaxis])
+        np.reciprocal(inv_si, out=inv_si)
+        mR[pix_slice] = np.mean(inv_si, axis=2)
+        np.square(inv_si, out=inv_si)
+        vR[pix_slice] = np.mean(inv_si, axis=2) - mR[pix_slice] ** 2
+
+    return {'x': operators['x'], 'mR': mR, 'vR': vR, 'Irec': Irec, 'cValue': m_mat[:, -1]}
+
+
 def plot_bayesian_spot_from_h5(h5_bayesian_grp, h5_resh, pix_ind):
     """
     Plots the basic Bayesian Inference results for a specific pixel
@@ -316,7 +421,7 @@ def plot_bayesian_results(orig_bias, possibly_rolled_bias, i_meas, bias_interp,
 
 def bayesian_inference_unit(single_parm):
     """
-    Wrapper around the original Bayesian inference function for parallel computing purposes
+    Wrapper around the Bayesian inference functions for parallel computing purposes
 
     Parameters
     ----------
@@ -330,14 +435,61 @@ def bayesian_inference_unit(single_parm):
     """
     iv_point = single_parm[0]
     parm_dict = dict(single_parm[1])
-    return do_bayesian_inference(parm_dict['volt_vec'], iv_point, parm_dict['freq'],
-                                 num_x_steps=parm_dict['num_x_steps'], gam=parm_dict['gam'], e=parm_dict['e'],
-                                 sigma=parm_dict['sigma'], sigmaC=parm_dict['sigmaC'],
-                                 num_samples=parm_dict['num_samples'], show_plots=False, econ=True)
+    operators = build_bayesian_operators(parm_dict['volt_vec'], parm_dict['freq'],
+                                         num_x_steps=parm_dict['num_x_steps'], gam=parm_dict['gam'],
+                                         e=parm_dict['e'], sigma=parm_dict['sigma'], sigmaC=parm_dict['sigmaC'])
+    results = do_bayesian_inference_batch(np.atleast_2d(iv_point), operators, num_samples=parm_dict['num_samples'])
+    return {'x': results['x'], 'mR': results['mR'][0], 'vR': results['vR'][0], 'Irec': results['Irec'][0],
+            'cValue': results['cValue'][0]}
+
+
+# Operators shared by all tasks in a worker process of bayesian_inference_dataset
+_worker_operators = None
+
+
+def _init_bayesian_worker(operators_list):
+    """
+    Publishes the operators to a worker process once so that they need not be sent with every task
+
+    Parameters
+    ----------
+    operators_list : list of dictionaries
+        Operators, as returned by build_bayesian_operators, for each branch (eg - forward and reverse) of the bias
+    """
+    global _worker_operators
+    _worker_operators = operators_list
+
+
+def _bayesian_inference_task(single_parm):
+    """
+    Performs the batched Bayesian inference on all branches of the bias for a block of pixels
+
+    Parameters
+    ----------
+    single_parm : tuple
+        The first index of the tuple should contain the IV data to be processed arranged as [pixels, voltage points]
+        The second index of the tuple should contain the number of samples
+        The third index of the tuple should contain the memory in megabytes available to this task for the samples
+
+    Returns
+    -------
+    results : list of dictionaries
+        Results of do_bayesian_inference_batch for each branch of the bias
+    """
+    iv_mat, num_samples, max_mem_mb = single_parm
+    results = []
+    start_col = 0
+    for operators in _worker_operators:
+        end_col = start_col + operators['A'].shape[0]
+        results.append(do_bayesian_inference_batch(iv_mat[:, start_col:end_col], operators,
+                                                   num_samples=num_samples, max_mem_mb=max_mem_mb))
+        start_col = end_col
+    return results
 
 
 def bayesian_inference_dataset(h5_main, ex_freq, gain, split_directions=False, num_cores=None, num_x_steps=251,
-                               gam=0.03, e=10.0, sigma=10., sigmaC=1., num_samples=2E3, verbose=False):
+                               gam=0.03, e=10.0, sigma=10., sigmaC=1., num_samples=2E3, verbose=False,
+                               max_mem_mb=1024, secs_per_chunk=60):
     """
     Parameters
     ----------
@@ -365,6 +517,12 @@ def bayesian_inference_dataset(h5_main, ex_freq, gain, split_directions=False, n
         Number of samples. 1E+4 is more than sufficient
     verbose : Boolean (Optional, Default = False)
         Whether or not to print the status messages for debugging purposes
+    max_mem_mb : unsigned int (Optional, Default = 1024)
+        Maximum memory in megabytes used for the computation. Half of it holds the data and results of a chunk of
+        pixels and the other half is shared by the cores to hold the samples
+    secs_per_chunk : float (Optional, Default = 60)
+        Approximate time in seconds that each chunk should take to compute. The number of pixels per chunk is
+        adjusted using the measured time per pixel. Results are written to the file after every chunk
 
     Returns
     -------
@@ -372,36 +530,6 @@ def bayesian_inference_dataset(h5_main, ex_freq, gain, split_directions=False, n
         Reference to the group containing all the results of the Bayesian Inference
     """
 
-    def __process_chunk(data, parms_chunk, num_cores_chunk, amp_gain):
-        """
-        Processes the provided chunk of data using the parameters in parallel
-
-        Parameters
-        ----------
-        data : 2D numpy array
-            data to be processed arranged as [instances, features]
-        parms_chunk : dictionary
-            Dictionary of parameters to be passed to the processing function
-        num_cores_chunk : unsigned int
-            Number of cores to use for parallel computation
-        amp_gain : unsigned int
-            Amplifier gain such as 8 or 9, not 10^8 or 10^9
-
-        Returns
-        -------
-        results : list
-            List of dictionaries containing results from the bayesian inference
-        """
-        mult_to_nA = 10**(9-amp_gain)
-        sing_parm = itertools.izip(data*mult_to_nA, itertools.repeat(parms_chunk))
-        # Start parallel processing:
-        print('Starting a pool of {} cores'.format(num_cores_chunk))
-        pool = Pool(processes=current_num_cores)
-        jobs = pool.imap(bayesian_inference_unit, sing_parm)  # , chunksize=num_chunks)
-        results = [j for j in jobs]
-        pool.close()
-        return results
-
     num_samples = int(num_samples)
     num_x_steps = int(num_x_steps)
     if num_x_steps % 2 == 0:
@@ -522,98 +650,104 @@ def bayesian_inference_dataset(h5_main, ex_freq, gain, split_directions=False, n
     if verbose:
         print('Finished linking all datasets!')
 
-    # setting up parameters for parallel function:
-    parm_dict = {'volt_vec': single_ao, 'freq': ex_freq, 'num_x_steps': num_x_steps, 'gam': gam, 'e': e, 'sigma': sigma,
-                 'sigmaC': sigmaC, 'num_samples': num_samples}
-    parm_dict_forw = None
-    parm_dict_rev = None
+    # The operators only depend on the bias and the parameters so they are shared by all pixels:
+    operator_kwargs = {'num_x_steps': num_x_steps, 'gam': gam, 'e': e, 'sigma': sigma, 'sigmaC': sigmaC}
     if split_directions:
         half_v_steps = int(0.5 * single_ao.size)
-        parm_dict_forw = parm_dict.copy()
-        parm_dict_forw['volt_vec'] = rolled_bias[:half_v_steps]
-        parm_dict_rev = parm_dict.copy()
-        parm_dict_rev['volt_vec'] = rolled_bias[half_v_steps:]
-
-    max_pos_per_chunk = 1000  # Need a better way of figuring out a more appropriate estimate
+        operators_list = [build_bayesian_operators(rolled_bias[:half_v_steps], ex_freq, **operator_kwargs),
+                          build_bayesian_operators(rolled_bias[half_v_steps:], ex_freq, **operator_kwargs)]
+    else:
+        operators_list = [build_bayesian_operators(single_ao, ex_freq, **operator_kwargs)]
+    x_vec = np.hstack([operators['x'] for operators in operators_list])
+    mult_to_nA = 10 ** (9 - gain)
+
+    # The raw data and the results of every pixel in a chunk are held in memory.
+    # This caps the size of a chunk, which is otherwise set by the measured time per pixel
+    mem_per_pix = h5_main.dtype.itemsize * h5_main.shape[1] + \
+        np.float64(0).itemsize * (2 * h5_main.shape[1] + 2 * num_actual_x_steps + 2)
+    max_memory = min(max_mem_mb * 1024 ** 2, 0.75 * getAvailableMem())
+    max_pos_per_chunk = max(1, int(0.5 * max_memory // mem_per_pix))
+
+    num_cores = recommendCores(num_pos, requested_cores=num_cores, lengthy_computation=True)
+    # The memory left over by the chunk buffers is split among the cores for drawing the samples
+    chunk_memory = min(max_pos_per_chunk, num_pos) * mem_per_pix
+    task_mem_mb = max(1, (max_memory - chunk_memory) / num_cores / 1024 ** 2)
+    # Start with a small chunk to measure the time per pixel
+    pos_per_chunk = min(max_pos_per_chunk, 10 * num_cores)
+
+    # One pool is reused for the entire dataset
+    pool = None
+    if num_cores > 1:
+        print('Starting a pool of {} cores'.format(num_cores))
+        pool = Pool(processes=num_cores, initializer=_init_bayesian_worker, initargs=(operators_list,))
+    else:
+        _init_bayesian_worker(operators_list)
 
     start_pix = 0
-    time_per_pix = 0
-    x_vec = None
+    t_begin = tm.time()
+
+    try:
+        while start_pix < num_pos:
+
+            last_pix = min(start_pix + pos_per_chunk, num_pos)
+            if verbose:
+                print('Working on pixels {} to {} of {}'.format(start_pix, last_pix, num_pos))
 
-    while start_pix < num_pos:
+            t_start = tm.time()
+            raw_data = h5_main[start_pix: last_pix] * mult_to_nA
+            if split_directions:
+                raw_data = np.roll(raw_data, int(single_ao.size * roll_cyc_fract), axis=1)
 
-        last_pix = min(start_pix + max_pos_per_chunk, num_pos)
-        print('Working on pixels {} to {} of {}'.format(start_pix, last_pix, num_pos))
+            # A few blocks per core keep all the cores busy till the end of the chunk
+            blocks = np.array_split(raw_data, min(last_pix - start_pix, 4 * num_cores))
+            sing_parm = zip(blocks, itertools.repeat(num_samples), itertools.repeat(task_mem_mb))
+            if pool is None:
+                block_results = [_bayesian_inference_task(parm) for parm in sing_parm]
+            else:
+                block_results = pool.map(_bayesian_inference_task, sing_parm)
 
-        current_num_cores = recommendCores(last_pix - start_pix, requested_cores=num_cores, lengthy_computation=True)
+            if verbose:
+                print('Done computing in {} sec. Started accumulating all results'.format(
+                    np.round(tm.time() - t_start, 2)))
+
+            # Stitch the blocks together and place the branches (forward and reverse) side by side:
+            branches = [[block[branch_ind] for block in block_results] for branch_ind in range(len(operators_list))]
+            vr_mat = np.hstack([np.vstack([block['vR'] for block in branch]) for branch in branches])
+            mr_mat = np.hstack([np.vstack([block['mR'] for block in branch]) for branch in branches])
+            irec_mat = np.hstack([np.vstack([block['Irec'] for block in branch]) for branch in branches])
+            cap_vec = np.vstack([np.hstack([block['cValue'] for block in branch]) for branch in branches]).T
 
-        t_start = tm.time()
-        if split_directions:
-            # first load the results to memory and then roll them
-            rolled_raw_data = np.roll(h5_main[start_pix: last_pix], int(single_ao.size * roll_cyc_fract), axis=1)
+            t_accum_end = tm.time()
 
-            forward_results = __process_chunk(rolled_raw_data[:, :half_v_steps], parm_dict_forw, current_num_cores,
-                                              gain)
             if verbose:
-                print('Finished processing forward loops')
-            reverse_results = __process_chunk(rolled_raw_data[:, half_v_steps:], parm_dict_rev, current_num_cores, gain)
+                print('Finished accumulating results')
+                print('Writing to h5')
+
+            h5_cap[start_pix: last_pix] = np.float32(cap_vec)
+            h5_vr[start_pix: last_pix] = np.float32(vr_mat)
+            h5_mr[start_pix: last_pix] = np.float32(mr_mat)
+            h5_irec[start_pix: last_pix] = np.float32(irec_mat)
+
             if verbose:
-                print('Finished processing reverse loops')
-        else:
-            bayes_results = __process_chunk(h5_main[start_pix:last_pix], parm_dict, current_num_cores, gain)
-
-        tot_time = np.round(tm.time() - t_start)
-
-        if verbose:
-            print('Done parallel computing in {} sec or {} sec per pixel'.format(tot_time, tot_time/max_pos_per_chunk))
-
-        if start_pix == 0:
-            time_per_pix = tot_time/last_pix  # in seconds
-        else:
-            print('Time remaining: {} hours'.format(np.round((num_pos - last_pix) * time_per_pix / 3600, 2)))
-
-        if verbose:
-            print('Started accumulating all results')
-
-        chunk_pos = last_pix - start_pix
-        cap_vec = np.zeros(shape=(chunk_pos, 2), dtype=np.float32)
-        vr_mat = np.zeros(shape=(chunk_pos, num_actual_x_steps), dtype=np.float32)
-        mr_mat = np.zeros(shape=(chunk_pos, num_actual_x_steps), dtype=np.float32)
-        irec_mat = np.zeros(shape=(chunk_pos, single_ao.size), dtype=np.float32)
-
-        # filling in all the results:
-        if split_directions:
-            x_vec = np.hstack((forward_results[0]['x'], reverse_results[0]['x']))
-            for pix_ind, forw_results, rev_results in zip(range(chunk_pos), forward_results, reverse_results):
-                vr_mat[pix_ind] = np.hstack((forw_results['vR'], rev_results['vR']))
-                mr_mat[pix_ind] = np.hstack((forw_results['mR'], rev_results['mR']))
-                irec_mat[pix_ind] = np.hstack((forw_results['Irec'], rev_results['Irec']))
-                cap_vec[pix_ind] = np.hstack((forw_results['cValue'], rev_results['cValue']))
-        else:
-            x_vec = bayes_results[0]['x']
-            for pix_ind, pix_results in enumerate(bayes_results):
-                cap_vec[pix_ind] = pix_results['cValue']
-                vr_mat[pix_ind] = pix_results['vR']
-                mr_mat[pix_ind] = pix_results['mR']
-                irec_mat[pix_ind] = pix_results['Irec']
-
-        t_accum_end = tm.time()
-
-        if verbose:
-            print('Finished accumulating results')
-            print('Writing to h5')
-
-        h5_cap[start_pix: last_pix] = cap_vec
-        h5_vr[start_pix: last_pix] = vr_mat
-        h5_mr[start_pix: last_pix] = mr_mat
-        h5_irec[start_pix: last_pix] = irec_mat
-
-        if verbose:
-            print('Finished writing to file in {} sec'.format(np.round(tm.time() - t_accum_end)))
-
-        hdf.flush()
-
-        start_pix = last_pix
+                print('Finished writing to file in {} sec'.format(np.round(tm.time() - t_accum_end)))
+
+            hdf.flush()
+
+            # Size the next chunk based on the time per pixel of this chunk
+            time_per_pix = (tm.time() - t_start) / (last_pix - start_pix)
+            pos_per_chunk = int(np.clip(secs_per_chunk / max(time_per_pix, 1E-6), num_cores, max_pos_per_chunk))
+
+            pix_per_sec = last_pix / (tm.time() - t_begin)
+            print('Completed {} of {} pixels at {} pixels/sec. Time remaining: {} mins'.format(
+                last_pix, num_pos, np.round(pix_per_sec, 2), np.round((num_pos - last_pix) / pix_per_sec / 60, 2)))
+
+            start_pix = last_pix
+
+    finally:
+        # The pool is not left running if a chunk fails
+        if pool is not None:
+            pool.terminate()
+            pool.join()
 
     h5_new_spec_vals[0, :] = x_vec  # Technically this needs to only be done once
 
@@ -12,6 +12,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 from scipy.optimize import leastsq
 from scipy.signal import blackman
+from numpy.lib.stride_tricks import as_strided
 from sklearn.utils import gen_batches
 
 from ..io.hdf_utils import getH5DsetRefs, copyAttributes, linkRefs, findH5group, calc_chunks, link_as_main, \
@@ -158,45 +159,38 @@ class ImageWindow(object):
             return h5_wins
 
         n_wins = win_pos_mat.shape[0]
-        win_pix = win_x * win_y
 
         '''
-        Create slice object from the positions
+        Build a zero-copy view of every window in the image
         '''
-        win_slices = [[slice(x, x+win_x), slice(y, y+win_y)] for x, y in win_pos_mat]
+        win_attrs = h5_wins.parent.attrs
+        win_x, win_y = int(win_attrs['win_x']), int(win_attrs['win_y'])
+        win_view = self._get_window_view(image, win_x, win_y, win_attrs['win_step_x'], win_attrs['win_step_y'])
+        ny = win_view.shape[1]
+        win_pix = win_x * win_y
 
         '''
-        Calculate the size of a given batch that will fit in the available memory
+        Calculate the size of a given batch that will fit in the available memory.
+        Each window is gathered as a float copy and win_func may hold two complex temporaries (eg. - fft and
+        fftshift) besides the windows written to the dataset
         '''
-        mem_per_win = win_x*win_y*h5_wins.dtype.itemsize
-        if self.cores is None:
-            free_mem = self.max_memory-image.size*image.itemsize
-        else:
-            free_mem = self.max_memory*2-image.size*image.itemsize
-        batch_size = int(free_mem/mem_per_win)
+        mem_per_win = win_x*win_y*(h5_wins.dtype.itemsize + 2*16 + 8)
+        free_mem = self.max_memory-image.size*image.itemsize
+        batch_size = max(1, int(free_mem/mem_per_win))
         batch_slices = gen_batches(n_wins, batch_size)
 
-        for ibatch, batch in enumerate(batch_slices):
-            batch_wins = np.zeros([batch.stop-batch.start, win_pix], dtype=win_type)
+        for batch in batch_slices:
+            per_done = np.rint(100*batch.start/n_wins)
+            print('Windowing Image...{}% --windows {}-{}'.format(per_done, batch.start, batch.stop))
+
             '''
-            Read each slice and write it to the dataset
+            Gather the windows of this batch from the strided view and
+            write them to the dataset in a single hyperslab
             '''
-            for islice, this_slice in enumerate(win_slices[batch]):
-                iwin = ibatch*batch_size+islice
-                selected = iwin % np.rint(n_wins/10) == 0
-
-                if selected:
-                    per_done = np.rint(100*iwin/n_wins)
-                    print('Windowing Image...{}% --pixels {}-{}, step # {}'.format(per_done,
-                                                                                   (this_slice[0].start,
-                                                                                    this_slice[1].start),
-                                                                                   (this_slice[0].stop,
-                                                                                    this_slice[1].stop),
-                                                                                   islice))
-
-                batch_wins[islice] = win_func(image[this_slice]).flatten()
+            iwins = np.arange(batch.start, batch.stop)
+            batch_wins = win_func(win_view[iwins // ny, iwins % ny])
 
-            h5_wins[batch] = batch_wins
+            h5_wins[batch] = batch_wins.reshape(-1, win_pix)
             self.hdf.flush()
         
         self.h5_wins = h5_wins
@@ -432,6 +426,112 @@ class ImageWindow(object):
 
         return ds_pix_inds, ds_pix_vals, ds_pos_inds, ds_pos_vals, win_pos_mat
 
+    @staticmethod
+    def _get_window_view(image, win_x, win_y, win_step_x, win_step_y):
+        """
+        Create a strided view of all the windows in the image.  No data is copied.
+
+        Parameters
+        ----------
+        image : numpy.ndarray
+            Raw Image
+        win_x : uint
+            Size of the window in the x-direction.
+        win_y : uint
+            Size of the window in the y-direction.
+        win_step_x : uint
+            Step size in the x-direction between windows.
+        win_step_y : uint
+            Step size in the y-direction between windows.
+
+        Returns
+        -------
+        win_view : numpy.ndarray
+            Read-only view of shape [nx, ny, win_x, win_y] where `win_view[i, j]` is the
+            window with origin (i*win_step_x, j*win_step_y).  Windows are ordered the same
+            way as the rows of `win_pos_mat` when the first two axes are flattened.
+
+        """
+        win_x, win_y = int(win_x), int(win_y)
+        win_step_x, win_step_y = int(win_step_x), int(win_step_y)
+        image = np.ascontiguousarray(image)
+        im_x, im_y = image.shape
+        nx = len(range(0, im_x - win_x + 1, win_step_x))
+        ny = len(range(0, im_y - win_y + 1, win_step_y))
+        row_stride, col_stride = image.strides
+
+        win_view = as_strided(image,
+                              shape=(nx, ny, win_x, win_y),
+                              strides=(row_stride*win_step_x, col_stride*win_step_y, row_stride, col_stride))
+        win_view.flags.writeable = False
+
+        return win_view
+
+    @staticmethod
+    def _get_window_counts(win_pos, win_x, win_y, im_x, im_y):
+        """
+        Calculate the number of windows that cover each pixel of the image.  The windows
+        lie on a regular grid so the counts are the outer product of the counts along each axis.
+
+        Parameters
+        ----------
+        win_pos : numpy.ndarray
+            Array containing the positions of the window origins
+        win_x : uint
+            Size of the window in the x-direction.
+        win_y : uint
+            Size of the window in the y-direction.
+        im_x : uint
+            Size of the image in the x-direction.
+        im_y : uint
+            Size of the image in the y-direction.
+
+        Returns
+        -------
+        counts : numpy.ndarray
+            Number of windows covering each pixel
+
+        """
+        x_steps = np.unique(win_pos[:, 0]).astype(np.int64)
+        y_steps = np.unique(win_pos[:, 1]).astype(np.int64)
+
+        counts_x = np.bincount((x_steps[:, None] + np.arange(win_x)).ravel(), minlength=im_x)[:im_x]
+        counts_y = np.bincount((y_steps[:, None] + np.arange(win_y)).ravel(), minlength=im_y)[:im_y]
+
+        return np.outer(counts_x, counts_y).astype(np.uint32)
+
+    @staticmethod
+    def _overlap_add(accum, batch_wins, batch_pos, win_x, win_y):
+        """
+        Add a block of windows to the image at their positions.  The scatter is done in
+        a single call by summing over the flattened image index of every window pixel.
+
+        Parameters
+        ----------
+        accum : numpy.ndarray
+            Image to which the windows will be added.  Modified in place.
+        batch_wins : numpy.ndarray
+            Windows to add.  Shape [n_wins, win_x*win_y] or [n_wins, win_x, win_y]
+        batch_pos : numpy.ndarray
+            Array containing the positions of the origins of the windows
+        win_x : uint
+            Size of the window in the x-direction.
+        win_y : uint
+            Size of the window in the y-direction.
+
+        Returns
+        -------
+        None
+
+        """
+        im_y = accum.shape[1]
+        offsets = (np.arange(win_x)[:, None]*im_y + np.arange(win_y)[None, :]).ravel()
+        origins = batch_pos[:, 0].astype(np.int64)*im_y + batch_pos[:, 1]
+        flat_inds = (origins[:, None] + offsets[None, :]).ravel()
+
+        accum += np.bincount(flat_inds, weights=np.ravel(batch_wins),
+                             minlength=accum.size).reshape(accum.shape).astype(accum.dtype)
+
     @staticmethod
     def win_data_func(image):
         """
@@ -440,7 +540,8 @@ class ImageWindow(object):
         Parameters
         ----------
         image : numpy.ndarray
-            Windowed image to take the FFT of
+            Windowed image to take the FFT of.  A stack of windows with shape
+            [..., win_x, win_y] is transformed in a single batched call.
 
         Returns
         -------
@@ -460,7 +561,8 @@ class ImageWindow(object):
         Parameters
         ----------
         image : numpy.ndarray
-            Windowed image to take the FFT of
+            Windowed image to take the FFT of.  A stack of windows with shape
+            [..., win_x, win_y] is transformed in a single batched call.
 
         Returns
         -------
@@ -470,7 +572,7 @@ class ImageWindow(object):
 
         """
         windows = np.empty_like(image, dtype=absfft32)
-        windows['FFT Magnitude'] = np.abs(np.fft.fftshift(np.fft.fft2(image)))
+        windows['FFT Magnitude'] = np.abs(np.fft.fftshift(np.fft.fft2(image), axes=(-2, -1)))
 
         return windows
 
@@ -482,7 +584,8 @@ class ImageWindow(object):
         Parameters
         ----------
         image : numpy.ndarray
-            Windowed image to take the FFT of
+            Windowed image to take the FFT of.  A stack of windows with shape
+            [..., win_x, win_y] is transformed in a single batched call.
 
         Returns
         -------
@@ -493,7 +596,7 @@ class ImageWindow(object):
         """
         windows = np.empty_like(image, dtype=winabsfft32)
         windows['Image Data'] = image
-        windows['FFT Magnitude'] = np.abs(np.fft.fftshift(np.fft.fft2(image)))
+        windows['FFT Magnitude'] = np.abs(np.fft.fftshift(np.fft.fft2(image), axes=(-2, -1)))
 
         return windows
 
@@ -505,7 +608,8 @@ class ImageWindow(object):
         Parameters
         ----------
         image : numpy.ndarray
-            Windowed image to take the FFT of
+            Windowed image to take the FFT of.  A stack of windows with shape
+            [..., win_x, win_y] is transformed in a single batched call.
 
         Returns
         -------
@@ -515,7 +619,7 @@ class ImageWindow(object):
         """
         windows = np.empty_like(image, dtype=wincompfft32)
         windows['Image Data'] = image
-        win_fft = np.fft.fftshift(np.fft.fft2(image))
+        win_fft = np.fft.fftshift(np.fft.fft2(image), axes=(-2, -1))
         windows['FFT Real'] = win_fft.real
         windows['FFT Imag'] = win_fft.imag
 
@@ -550,44 +654,35 @@ class ImageWindow(object):
         im_y = h5_win.parent.attrs['image_y']
         win_x = h5_win.parent.attrs['win_x']
         win_y = h5_win.parent.attrs['win_y']
-        win_step_x = h5_win.parent.attrs['win_step_x']
-        win_step_y = h5_win.parent.attrs['win_step_x']             
-        
-        '''
-        Calculate the steps taken to create original windows
+
         '''
-        x_steps = np.arange(0, im_x-win_x+1, win_step_x)
-        y_steps = np.arange(0, im_y-win_y+1, win_step_y)
-        
+        Read the window origins and compute the number of windows covering each pixel
         '''
-        Initialize arrays to hold summed windows and counts for each position
-        '''
-        counts = np.zeros([im_x, im_y], np.uint8)
+        ds_win_pos = h5_win.file[h5_win.attrs['Position_Indices']][()]
+        n_wins = ds_win_pos.shape[0]
+        counts = self._get_window_counts(ds_win_pos, win_x, win_y, im_x, im_y)
         accum = np.zeros([im_x, im_y], np.float32)
-        
-        nx = len(x_steps)
-        ny = len(y_steps)
-        n_wins = nx*ny
-        
+
         '''
-        Create slice object from the positions
+        Calculate the size of a given batch that will fit in the available memory.
+        Each window needs its data plus the flat image index and weight of every pixel
         '''
-        win_slices = [[slice(x, x+win_x), slice(y, y+win_y)] for x, y in np.array([np.tile(x_steps, nx),
-                                                                                   np.repeat(y_steps, ny)]).T]
-        
+        mem_per_win = win_x*win_y*(h5_win.dtype.itemsize+16)
+        batch_size = max(1, int((self.max_memory-2*accum.nbytes)/mem_per_win))
+        batch_slices = gen_batches(n_wins, batch_size)
+
         '''
-        Loop over all windows.  Increment counts for window positions and 
-        add current window to total.
+        Loop over all batches, adding each block of windows to the total
         '''
-        ones = np.ones([win_x, win_y], dtype=counts.dtype)
-        for islice, this_slice in enumerate(win_slices):
-            selected = islice%np.rint(n_wins/10) == 0
-            if selected:
-                per_done = np.rint(100*(islice)/(n_wins))
-                print('Reconstructing Image...{}% -- step # {}'.format(per_done,islice))
-            counts[this_slice]+= ones
-    
-            accum[this_slice]+= h5_win[islice].reshape(win_x,win_y)
+        for batch in batch_slices:
+            per_done = np.rint(100*batch.start/n_wins)
+            print('Reconstructing Image...{}% -- windows {}-{}'.format(per_done, batch.start, batch.stop))
+
+            batch_wins = h5_win[batch]
+            if batch_wins.dtype.names is not None:
+                batch_wins = batch_wins['Image Data']
+
+            self._overlap_add(accum, batch_wins, ds_win_pos[batch], win_x, win_y)
 
         clean_image = accum/counts
         
@@ -830,54 +925,42 @@ class ImageWindow(object):
         win_y = h5_win.parent.attrs['win_y']
 
         '''
-        Initialize arrays to hold summed windows and counts for each position
-        '''
-        counts = np.zeros([im_x, im_y], np.uint32)
-        accum = np.zeros([im_x, im_y], np.float32)
-
-        '''
-        Create slice object from the positions
+        Read the window origins and compute the number of windows covering each pixel
         '''
         ds_win_pos = h5_win.file[h5_win.attrs['Position_Indices']][()]
-        win_slices = [[slice(x, x+win_x), slice(y, y+win_y)] for x, y in ds_win_pos]
         n_wins = ds_win_pos.shape[0]
+        counts = self._get_window_counts(ds_win_pos, win_x, win_y, im_x, im_y)
+        accum = np.zeros([im_x, im_y], np.float32)
+
         '''
-        Create a matrix to add when counting.
         h5_V is usually small so go ahead and take S.V
         '''
-        ones = np.ones([win_x, win_y], dtype=counts.dtype)
         ds_V = np.dot(np.diag(h5_S[comp_slice]), h5_V['Image Data'][comp_slice, :])
 
         '''
-        Calculate the size of a given batch that will fit in the available memory
+        Calculate the size of a given batch that will fit in the available memory.
+        Each window needs its data plus the flat image index and weight of every pixel
         '''
-        mem_per_win = ds_V.itemsize*ds_V.shape[1]
+        mem_per_win = ds_V.shape[1]*(ds_V.itemsize+16)
         if self.cores is None:
             free_mem = self.max_memory-ds_V.size*ds_V.itemsize
         else:
             free_mem = self.max_memory*2-ds_V.size*ds_V.itemsize
-        batch_size = int(free_mem/mem_per_win)
+        batch_size = max(1, int((free_mem-2*accum.nbytes)/mem_per_win))
         batch_slices = gen_batches(n_wins, batch_size)
 
         print('Reconstructing in batches of {} windows.'.format(batch_size))
 
         '''
-        Loop over all batches.  Increment counts for window positions and
-        add current window to total.
+        Loop over all batches, adding each block of rebuilt windows to the total
         '''
-        for ibatch, batch in enumerate(batch_slices):
-            ds_U = h5_U[batch, comp_slice]
-            batch_wins = np.dot(ds_U, ds_V).reshape([-1, win_x, win_y])
-            del ds_U
-            for islice, this_slice in enumerate(win_slices[batch]):
-                iwin = ibatch*batch_size+islice
-                if iwin % np.rint(n_wins / 10) == 0:
-                    per_done = np.rint(100 * iwin / n_wins)
-                    print('Reconstructing Image...{}% -- step # {}'.format(per_done, islice))
+        for batch in batch_slices:
+            per_done = np.rint(100*batch.start/n_wins)
+            print('Reconstructing Image...{}% -- windows {}-{}'.format(per_done, batch.start, batch.stop))
 
-                counts[this_slice] += ones
+            batch_wins = np.dot(h5_U[batch, comp_slice], ds_V)
 
-                accum[this_slice] += batch_wins[islice]
+            self._overlap_add(accum, batch_wins, ds_win_pos[batch], win_x, win_y)
 
         clean_image = np.divide(accum, counts)
 
@@ -891,6 +974,28 @@ class ImageWindow(object):
             clean_image = clean_image/np.max(clean_image)
         
 
+        return self._write_clean_image(clean_image, win_svd.name[1:], comp_slice)
+
+    def _write_clean_image(self, clean_image, parent_path, comp_slice):
+        """
+        Calculate the removed noise and the FFTs of the cleaned image and the noise
+        and write them all to the file
+
+        Parameters
+        ----------
+        clean_image : numpy.ndarray
+            The cleaned image
+        parent_path : str
+            HDF5 path of the group under which the results will be written
+        comp_slice : slice or list of uint
+            Components that were used to build the cleaned image
+
+        Returns
+        -------
+        h5_clean : HDF5 Dataset
+            The cleaned image
+
+        """
         '''
         Calculate the removed noise and FFTs
         '''
@@ -903,7 +1008,7 @@ class ImageWindow(object):
         '''
         Create datasets for results, link them properly, and write them to file
         '''
-        clean_grp = MicroDataGroup('Cleaned_Image_', win_svd.name[1:])
+        clean_grp = MicroDataGroup('Cleaned_Image_', parent_path)
         ds_clean = MicroDataset('Cleaned_Image', clean_image.reshape(self.h5_raw.shape))
         ds_noise = MicroDataset('Removed_Noise', removed_noise.reshape(self.h5_raw.shape))
         ds_fft_clean = MicroDataset('FFT_Cleaned_Image', fft_clean.reshape(self.h5_raw.shape))
@@ -934,6 +1039,226 @@ class ImageWindow(object):
 
         return h5_clean
 
+    def clean_and_build_fused(self, win_x=None, win_y=None, win_step_x=1, win_step_y=1, components=None,
+                              save_svd=False, *args, **kwargs):
+        """
+        Window the image, perform SVD on the windows, and rebuild the cleaned image from the
+        selected components without ever writing the windows to the file.
+
+        The windows are streamed twice from a strided view of the image.  The first pass
+        accumulates the Gram matrix of the windows, whose eigenvectors are the right
+        singular vectors V.  The second pass projects each block of windows onto the selected
+        components and adds the rebuilt windows straight into the cleaned image.
+
+        Parameters
+        ----------
+        win_x : int, optional
+            size of the window, in pixels, in the horizontal direction
+            Default None, a guess will be made based on the FFT of the image
+        win_y : int, optional
+            size of the window, in pixels, in the vertical direction
+            Default None, a guess will be made based on the FFT of the image
+        win_step_x : int, optional
+            step size, in pixels, to take between windows in the horizontal direction
+            Default 1
+        win_step_y : int, optional
+            step size, in pixels, to take between windows in the vertical direction
+            Default 1
+        components : {int, iterable of int, slice} optional
+            Defines which components to keep
+            Default - None, all components kept
+
+            Input Types
+            integer : Components less than the input will be kept
+            length 2 iterable of integers : Integers define start and stop of component slice to retain
+            other iterable of integers or slice : Selection of component indices to retain
+        save_svd : Boolean, optional
+            Should U, S, and V of the kept components be written to the file.  The windows
+            themselves are never written.
+            Default False
+
+        Returns
+        -------
+        h5_clean : HDF5 Dataset
+            The cleaned image
+
+        """
+        h5_main = self.h5_raw
+        comp_slice = _get_component_slice(components)
+
+        if win_x is None or win_y is None:
+            win_test, _ = self.window_size_extract(*args, **kwargs)
+            if win_x is None:
+                win_x = win_test
+            if win_y is None:
+                win_y = win_test
+
+        image, win_step_x, win_step_y, win_x, win_y = self._check_win_parameters(h5_main, win_step_x, win_step_y,
+                                                                                 win_x, win_y)
+        win_x, win_y = int(win_x), int(win_y)
+        win_step_x, win_step_y = int(win_step_x), int(win_step_y)
+        im_x, im_y = image.shape
+
+        win_view = self._get_window_view(image, win_x, win_y, win_step_x, win_step_y)
+        nx, ny = win_view.shape[:2]
+        n_wins = nx*ny
+        win_pix = win_x*win_y
+
+        '''
+        Calculate the size of a given batch that will fit in the available memory.
+        Each window needs its data, its rebuilt data, and the flat image index and
+        weight of every pixel for the overlap-add
+        '''
+        mem_per_win = win_pix*np.float64(0).itemsize*4
+        free_mem = self.max_memory - 3*image.size*np.float64(0).itemsize - 2*win_pix**2*np.float64(0).itemsize
+        batch_size = max(1, int(free_mem/mem_per_win))
+
+        def __get_batch(batch):
+            iwins = np.arange(batch.start, batch.stop)
+            return win_view[iwins // ny, iwins % ny].reshape(-1, win_pix).astype(np.float64)
+
+        '''
+        First pass: accumulate the Gram matrix of the windows and take its eigenvectors
+        '''
+        print('Computing SVD of {} windows of {}x{} pixels.'.format(n_wins, win_x, win_y))
+        gram = np.zeros([win_pix, win_pix], dtype=np.float64)
+        for batch in gen_batches(n_wins, batch_size):
+            batch_wins = __get_batch(batch)
+            gram += np.dot(batch_wins.T, batch_wins)
+
+        eig_vals, eig_vecs = np.linalg.eigh(gram)
+        del gram
+        S = np.sqrt(np.clip(eig_vals[::-1], 0, None))
+        V = eig_vecs[:, ::-1].T
+
+        S = S[comp_slice]
+        V = V[comp_slice]
+        num_comps = len(S)
+        s_inv = np.divide(1.0, S, out=np.zeros_like(S), where=S > 0)
+
+        if save_svd:
+            h5_U, svd_path = self._setup_fused_svd_h5(image, S, V, win_x, win_y, win_step_x, win_step_y,
+                                                      comp_slice)
+        else:
+            h5_U = None
+            svd_path = h5_main.parent.name[1:]
+
+        '''
+        Second pass: project each block of windows onto the kept components and add
+        the rebuilt windows to the image
+        '''
+        win_pos = np.array([np.repeat(np.arange(nx)*win_step_x, ny),
+                            np.tile(np.arange(ny)*win_step_y, nx)], dtype=np.int64).T
+        counts = self._get_window_counts(win_pos, win_x, win_y, im_x, im_y)
+        accum = np.zeros([im_x, im_y], np.float32)
+
+        for batch in gen_batches(n_wins, batch_size):
+            per_done = np.rint(100*batch.start/n_wins)
+            print('Reconstructing Image...{}% -- windows {}-{}'.format(per_done, batch.start, batch.stop))
+
+            batch_us = np.dot(__get_batch(batch), V.T)
+            if h5_U is not None:
+                h5_U[batch] = np.float32(batch_us*s_inv)
+
+            self._overlap_add(accum, np.dot(batch_us, V), win_pos[batch], win_x, win_y)
+
+        if h5_U is not None:
+            self.hdf.flush()
+
+        clean_image = np.divide(accum, counts)
+
+        clean_image[np.isnan(clean_image)] = 0
+
+        if self.h5_file.attrs.get('normalized', False):
+            '''
+            Renormalize the cleaned image
+            '''
+            clean_image -= np.min(clean_image)
+            clean_image = clean_image/np.max(clean_image)
+
+        print('Rebuilt image from {} components.'.format(num_comps))
+
+        return self._write_clean_image(clean_image, svd_path, comp_slice)
+
+    def _setup_fused_svd_h5(self, image, S, V, win_x, win_y, win_step_x, win_step_y, comp_slice):
+        """
+        Write S and V from the fused cleaning to the file and allocate space for U
+
+        Parameters
+        ----------
+        image : numpy.ndarray
+            Raw Image
+        S : numpy.ndarray
+            Singular values of the kept components
+        V : numpy.ndarray
+            Right singular vectors of the kept components
+        win_x : uint
+            Size of the window in the x-direction.
+        win_y : uint
+            Size of the window in the y-direction.
+        win_step_x : uint
+            Step size in the x-direction between windows.
+        win_step_y : uint
+            Step size in the y-direction between windows.
+        comp_slice : slice or list of uint
+            Components that were kept
+
+        Returns
+        -------
+        h5_U : HDF5 Dataset
+            Empty dataset for the left singular vectors of the windows
+        svd_path : str
+            HDF5 path of the group holding U, S, and V
+
+        """
+        ds_pix_inds, ds_pix_vals, ds_pos_inds, ds_pos_vals, win_pos_mat = self._get_window_pos_spec(
+            image, win_step_x, win_step_y, win_x, win_y)
+        n_wins = win_pos_mat.shape[0]
+        num_comps = len(S)
+
+        ds_S = MicroDataset('S', data=np.float32(S))
+        ds_S.attrs['labels'] = {'Principal Component': [slice(0, None)]}
+        ds_S.attrs['units'] = ''
+        ds_inds = MicroDataset('Component_Indices', data=np.uint32(np.arange(num_comps)))
+        ds_inds.attrs['labels'] = {'Principal Component': [slice(0, None)]}
+        ds_inds.attrs['units'] = ''
+
+        V_out = np.empty(V.shape, dtype=windata32)
+        V_out['Image Data'] = V
+        ds_V = MicroDataset('V', data=V_out, chunking=calc_chunks(V.shape, windata32.itemsize))
+
+        ds_U = MicroDataset('U', data=[], maxshape=[n_wins, num_comps], dtype=np.float32,
+                            chunking=calc_chunks([n_wins, num_comps], np.float32(0).itemsize))
+
+        basename = self.h5_raw.name.split('/')[-1]
+        svd_grp = MicroDataGroup(basename + '-Windowed_SVD_', self.h5_raw.parent.name[1:])
+        svd_grp.addChildren([ds_U, ds_S, ds_V, ds_inds, ds_pos_inds, ds_pos_vals, ds_pix_inds, ds_pix_vals])
+        svd_grp.attrs['num_components'] = num_comps
+        svd_grp.attrs['svd_method'] = 'windowed-gram'
+        svd_grp.attrs['win_x'] = win_x
+        svd_grp.attrs['win_y'] = win_y
+        svd_grp.attrs['win_step_x'] = win_step_x
+        svd_grp.attrs['win_step_y'] = win_step_y
+        svd_grp.attrs['image_x'] = image.shape[0]
+        svd_grp.attrs['image_y'] = image.shape[1]
+        if isinstance(comp_slice, slice):
+            svd_grp.attrs['components_used'] = '{}-{}'.format(comp_slice.start, comp_slice.stop)
+        else:
+            svd_grp.attrs['components_used'] = comp_slice
+
+        svd_refs = self.hdf.writeData(svd_grp)
+
+        h5_U, h5_S, h5_V, h5_comp_inds, h5_pos_inds, h5_pos_vals, h5_pix_inds, h5_pix_vals = getH5DsetRefs(
+            ['U', 'S', 'V', 'Component_Indices', 'Position_Indices', 'Position_Values',
+             'Spectroscopic_Indices', 'Spectroscopic_Values'], svd_refs)
+
+        link_as_main(h5_U, h5_pos_inds, h5_pos_vals, h5_comp_inds, h5_S)
+        link_as_main(h5_V, h5_comp_inds, h5_S, h5_pix_inds, h5_pix_vals)
+
+        self.hdf.flush()
+
+        return h5_U, h5_S.parent.name[1:]
+
     def clean_and_build_separate_components(self, h5_win=None, components=None):
         """
         Rebuild the Image from the SVD results on the windows
@@ -6,14 +6,25 @@ Created on Tue Oct  6 15:34:12 2015
 """
 
 from __future__ import division, print_function, absolute_import
-from skimage.feature import match_descriptors, register_translation
+from skimage.feature import match_descriptors
+try:
+    from skimage.registration import phase_cross_correlation
+except ImportError:
+    # scikit-image < 0.17
+    from skimage.feature import register_translation as phase_cross_correlation
 from skimage.measure import ransac
 from skimage.transform import warp, SimilarityTransform
 import warnings
 import h5py
 import numpy as np
-import skimage.feature
-import multiprocessing as mp
+from sklearn.utils import gen_batches
+
+from ..io.hdf_utils import getH5DsetRefs, copyAttributes, calc_chunks
+from ..io.io_hdf5 import ioHDF5
+from ..io.microdata import MicroDataGroup, MicroDataset
+from .feature_extraction import StackPool, share_stack, get_worker_inputs
+# The feature extractors used to live in this module and are re-exported so that existing imports keep working
+from .feature_extraction import pickle_keypoints, FeatureExtractorParallel, FeatureExtractorSerial
 
 
 class ImageTransformation(object):
@@ -25,299 +36,353 @@ class ImageTransformation(object):
 
     pass
 
-# TODO: Docstrings following numpy standard.
+#TODO: Docstrings following numpy standard.
 
-#### Functions
-def pickle_keypoints(keypoints):
+# Functions
+def euclidMatch(Matches, keypts1, keypts2, misalign):
     """
-    Function to pickle cv2.sift keypoint objects
+    Function that thresholds the matches, found from a comparison of
+    their descriptors, by the maximum expected misalignment.
     """
-    kpArray = np.array([])
-    for point in keypoints:
-        kpArray = np.append(kpArray, [point.pt[1], point.pt[0]])
-    kpArray = np.reshape(kpArray, (int(kpArray.size / 2), 2))
-    return kpArray
-
+    filteredMatches = np.array([])
+    deltaX =(keypts1[Matches[:,0],:][:,0]-keypts2[Matches[:,1],:][:,0])**2
+    deltaY =(keypts1[Matches[:,0],:][:,1]-keypts2[Matches[:,1],:][:,1])**2
+    dist = np.apply_along_axis(np.sqrt, 0, deltaX + deltaY)
+    filteredMatches = np.where(dist[:] < misalign, True, False)
+    return filteredMatches
 
-# Class to do feature extraction. This is a wrapper on scikit-image and openCV feature extraction detectors.
-# TODO: Add support for opencV or implement sift.
-# TODO: Add io operations for extracted features.
-# TODO: Memory checking, since some of the features are quite large.
 
-class FeatureExtractorParallel(object):
+def _match_task(pair_ind):
     """
-    This is an Object used to contain a data set and has methods to perform
-    feature extraction on the data set that are detector based.
-    Begin by loading a detector for features and a computer vision library.
+    Matches the descriptors of a pair of consecutive frames using the features given to this worker
 
     Parameters
     ----------
-    detector_name : (string)
-        name of detector.
-    lib : (string)
-        computer vision library to use (opencv or skimage)
+    pair_ind : unsigned int
+        Index of the first frame of the pair
 
-        The following can be used for:
-        lib = opencv: SIFT, ORB, SURF
-        lib = skimage: ORB, BRIEF, CENSURE
+    Returns
+    -------
+    matches : numpy.ndarray
+        Indices of the matching descriptors
+    """
+    _, worker_args = get_worker_inputs()
+    desc = worker_args['features'][-1]
+    return match_descriptors(desc[pair_ind], desc[pair_ind + 1], cross_check=True)
 
+
+def _ransac_task(task):
     """
+    Finds the transformation between a pair of consecutive frames from their matching keypoints
 
-    def __init__(self, detector_name, lib):
-        self.data = []
-        self.lib = lib
+    Parameters
+    ----------
+    task : tuple
+        Index of the first frame of the pair, matches, skimage.transform object and kwargs for ransac
 
-        try:
-            if self.lib == 'opencv':
-                pass
-                #                detector = cv2.__getattribute__(detector_name)
-            elif self.lib == 'skimage':
-                self.detector = skimage.feature.__getattribute__(detector_name)
-        except AttributeError:
-            print('Error: The Library does not contain the specified detector')
+    Returns
+    -------
+    output : list
+        Transformation and inlier matches
+    """
+    pair_ind, match, transform, kwargs = task
+    _, worker_args = get_worker_inputs()
+    keypts = worker_args['features'][0]
+    robustTrans, inliers = ransac((keypts[pair_ind][match[:, 0]], keypts[pair_ind + 1][match[:, 1]]),
+                                  transform, **kwargs)
+    return [robustTrans, inliers]
 
-    def clearData(self):
-        del self.data
-        self.data = []
 
-    def loadData(self, dataset):
-        """
-        This is a Method that loads h5 Dataset to be corrected.
+def _register_task(pair_ind):
+    """
+    Finds the translation between a pair of consecutive frames of the shared stack by cross-correlation
 
-        Parameters
-        ----------
-        dataset : h5py.Dataset
-            Dataset to be corrected
-        """
-        if not isinstance(dataset, h5py.Dataset):
-            warnings.warn('Error: Data must be an h5 Dataset object')
-        else:
-            self.data = dataset
-            dim = int(np.sqrt(self.data.shape[-1]))
-            self.data = self.data.reshape(-1, dim, dim)
+    Parameters
+    ----------
+    pair_ind : unsigned int
+        Index of the first frame of the pair
 
-    def getData(self):
-        """
-        This is a Method that returns the loaded h5 Dataset.
+    Returns
+    -------
+    shifts : numpy.ndarray
+        Translation between the frames
+    """
+    stack, _ = get_worker_inputs()
+    shifts, _, _ = phase_cross_correlation(stack[pair_ind], stack[pair_ind + 1])
+    return shifts
 
-        """
-        return self.data
 
-    def getFeatures(self, **kwargs):
-        """
-        This is a Method that returns features (keypoints and descriptors)
-        that are obtained by using the FeatureExtractor.Detector object.
+def _warp_task(task):
+    """
+    Applies a transformation to a frame of the shared stack
 
-        Parameters
-        ----------
-        processors : int, optional
-                    Number of processors to use, default = 1.
-        mask : boolean, optional, default False.
-            Whether to use
+    Parameters
+    ----------
+    task : tuple
+        Index of the frame and the skimage.transform object to apply
 
-        Returns
-        -------
-        keypts :
-            keypoints
-        descs :
-            descriptors
+    Returns
+    -------
+    transimp : numpy.ndarray
+        Transformed frame
+    """
+    frame_ind, transform = task
+    stack, _ = get_worker_inputs()
+    return warp(stack[frame_ind], inverse_map=transform, output_shape=stack.shape[1:],
+                cval=0, preserve_range=True)
 
-        """
-        detector = self.detector
-        dset = self.data
-        lib = self.lib
-        processes = kwargs.get('processors', 1)
-        mask = kwargs.get('mask', False)
-        origin = kwargs.get('origin', [0, 0])
-        winSize = kwargs.get('window_size', 0)
-
-        if mask:
-            def mask_func(x, winSize):
-                x[origin[0] - winSize / 2: origin[0] + winSize / 2,
-                origin[1] - winSize / 2: origin[1] + winSize / 2] = 2
-                x = x - 1
-                return x
-
-            mask_ind = np.mask_indices(dset.shape[-1], mask_func, winSize)
-            self.data = np.array([imp[mask_ind].reshape(winSize, winSize) for imp in dset])
-
-        # detect and compute keypoints
-        def detect(image):
-            if lib == 'opencv':
-                image = (image - image.mean()) / image.std()
-                image = image.astype('uint8')
-                k_obj, d_obj = detector.detectAndCompute(image, None)
-                keypts, descs = pickle_keypoints(k_obj), pickle_keypoints(d_obj)
-
-            elif lib == 'skimage':
-                imp = (image - image.mean()) / np.std(image)
-                imp[imp < 0] = 0
-                imp.astype('float32')
-                detector.detect_and_extract(imp)
-                keypts, descs = detector.keypoints, detector.descriptors
-
-            return keypts, descs
-
-        # start pool of workers
-        print('launching %i kernels...' % (processes))
-        pool = mp.Pool(processes)
-        tasks = [(imp) for imp in self.data]
-        chunk = int(self.data.shape[0] / processes)
-        jobs = pool.imap(detect, tasks, chunksize=chunk)
-
-        # get keypoints and descriptors
-        results = []
-        print('Extracting features...')
-        try:
-            for j in jobs:
-                results.append(j)
-        except ValueError:
-            warnings.warn('ValueError something about 2d-image. Probably some of the detector input params are wrong.')
 
-        keypts = [itm[0].astype('int') for itm in results]
-        desc = [itm[1] for itm in results]
+def _upsampled_dft(data, upsampled_region_size, upsample_factor, axis_offsets):
+    """
+    Upsampled DFT of a 2D array by matrix multiplication, evaluated only in a small region around the
+    requested offsets. This is much faster than zero-padding the full FFT.
 
-        # close the pool
-        print('Closing down the kernels... \n')
-        pool.close()
+    Parameters
+    ----------
+    data : 2D numpy.ndarray of complex
+        The input data array (DFT of the original data) to upsample
+    upsampled_region_size : int
+        The size of the region to be sampled
+    upsample_factor : int
+        The upsampling factor
+    axis_offsets : array-like of floats
+        The offsets of the region to be sampled
 
-        return keypts, desc
+    Returns
+    -------
+    output : 2D numpy.ndarray of complex
+        The upsampled DFT of the specified region
+    """
+    region = int(upsampled_region_size)
+    col_kernel = np.exp((-1j * 2 * np.pi / (data.shape[1] * upsample_factor)) *
+                        (np.fft.ifftshift(np.arange(data.shape[1]))[:, None] -
+                         np.floor(data.shape[1] / 2)).dot(np.arange(region)[None, :] - axis_offsets[1]))
+    row_kernel = np.exp((-1j * 2 * np.pi / (data.shape[0] * upsample_factor)) *
+                        (np.arange(region)[:, None] - axis_offsets[0]).dot(
+                            np.fft.ifftshift(np.arange(data.shape[0]))[None, :] - np.floor(data.shape[0] / 2)))
+    return row_kernel.dot(data).dot(col_kernel)
 
 
-class FeatureExtractorSerial(object):
+def _find_shifts(src_freqs, target_freqs, upsample_factor=1):
     """
-    This is an Object used to contain a data set and has methods to perform
-    feature extraction on the data set that are detector based.
-    Begin by loading a detector for features and a computer vision library.
+    Finds the translations that register a block of target images with their source images from the
+    peaks of the normalized cross-power spectra. The whole pixel peaks of all pairs in the block are found
+    at once. Each pair is then refined with an upsampled DFT around its peak if upsample_factor > 1.
 
     Parameters
     ----------
-    detector_name : (string)
-        name of detector.
-    lib : (string)
-        computer vision library to use (opencv or skimage)
-
-        The following can be used for:
-        lib = opencv: SIFT, ORB, SURF
-        lib = skimage: ORB, BRIEF, CENSURE
+    src_freqs : 3D numpy.ndarray of complex
+        FFTs of the source (reference) images arranged as [pair, row, column].
+        May also be a single 2D FFT that is shared by all pairs
+    target_freqs : 3D numpy.ndarray of complex
+        FFTs of the images to be registered arranged as [pair, row, column]
+    upsample_factor : unsigned int, optional
+        Images will be registered to within 1 / upsample_factor of a pixel. Default 1
 
+    Returns
+    -------
+    shifts : 2D numpy.ndarray of floats
+        Translation (row, column) required to register each target image with its source image
     """
+    shape = np.array(target_freqs.shape[-2:])
+    num_pairs = target_freqs.shape[0]
 
-    def __init__(self, detector_name, lib):
-        self.data = []
-        self.lib = lib
+    cross_power = src_freqs * target_freqs.conj()
+    cross_power /= np.maximum(np.abs(cross_power), np.finfo(np.float64).tiny)
+    cross_corr = np.abs(np.fft.ifft2(cross_power, axes=(-2, -1)))
 
-        try:
-            if self.lib == 'opencv':
-                pass
-                #                detector = cv2.__getattribute__(detector_name)
-            elif self.lib == 'skimage':
-                self.detector = skimage.feature.__getattribute__(detector_name)
-        except AttributeError:
-            print('Error: The Library does not contain the specified detector')
+    flat_peaks = np.argmax(cross_corr.reshape(num_pairs, -1), axis=1)
+    peaks = np.column_stack(np.unravel_index(flat_peaks, tuple(shape)))
+    shifts = np.where(peaks > np.fix(shape / 2), peaks - shape, peaks).astype(np.float64)
 
-    def clearData(self):
-        del self.data
-        self.data = []
+    if upsample_factor <= 1:
+        return shifts
 
-    def loadData(self, dataset):
-        """
-        This is a Method that loads h5 Dataset to be corrected.
+    upsampled_region_size = np.ceil(upsample_factor * 1.5)
+    dftshift = np.fix(upsampled_region_size / 2.0)
+    for pair in range(num_pairs):
+        sample_region_offset = dftshift - shifts[pair] * upsample_factor
+        upsampled_corr = np.abs(_upsampled_dft(cross_power[pair].conj(), upsampled_region_size, upsample_factor,
+                                               sample_region_offset))
+        maxima = np.unravel_index(np.argmax(upsampled_corr), upsampled_corr.shape)
+        shifts[pair] += (np.array(maxima, dtype=np.float64) - dftshift) / upsample_factor
 
-        Parameters
-        ----------
-        dataset : h5py.Dataset
+    return shifts
 
-        """
-        if not isinstance(dataset, h5py.Dataset):
-            warnings.warn('Error: Data must be an h5 Dataset object')
-        else:
-            self.data = dataset
-            dim = int(np.sqrt(self.data.shape[-1]))
-            self.data = self.data.reshape(-1, dim, dim)
 
-    def getData(self):
-        """
-        This is a Method that returns the loaded h5 Dataset.
-        """
-        return self.data
+def register_stack(stack, reference=None, upsample_factor=1, max_mem_mb=256):
+    """
+    Finds the rigid translations between the images of a stack by phase correlation. The FFT of each
+    image is computed only once and the correlation peaks of all pairs in a block are found at once.
 
-    def getFeatures(self, **kwargs):
-        """
-        This is a Method that returns features (keypoints and descriptors)
-        that are obtained by using the FeatureExtractor.Detector object.
+    Parameters
+    ----------
+    stack : 3D numpy.ndarray or h5py.Dataset
+        Stack of images arranged as [frame, row, column]
+    reference : unsigned int, optional
+        Index of the frame that all frames are registered with.
+        Default - None - consecutive frames are registered with each other
+    upsample_factor : unsigned int, optional
+        Images will be registered to within 1 / upsample_factor of a pixel. Default 1
+    max_mem_mb : unsigned int, optional
+        Maximum memory in MB to use for the FFTs of a block of frames. Default 256
 
-        Parameters
-        ----------
-        mask : boolean, optional
-            Whether to use, default False.
+    Returns
+    -------
+    shifts : 2D numpy.ndarray of floats
+        Translations (row, column). If reference is None, shifts[i] registers frame i+1 with frame i
+        and there are one fewer shifts than frames. Otherwise, shifts[i] registers frame i with the reference
+    """
+    num_frames = stack.shape[0]
+    frame_shape = stack.shape[1:]
+
+    # FFT, cross-power spectrum and cross-correlation of each frame are all complex128
+    batch_size = max(1, int(max_mem_mb * 1024 ** 2 / (3 * 16 * np.prod(frame_shape))))
+
+    if reference is None:
+        shifts = np.zeros(shape=(num_frames - 1, 2), dtype=np.float64)
+        ref_freq = None
+    else:
+        shifts = np.zeros(shape=(num_frames, 2), dtype=np.float64)
+        ref_freq = np.fft.fft2(np.asarray(stack[reference], dtype=np.float64))
+
+    prev_freq = None
+    for batch in gen_batches(num_frames, batch_size):
+        freqs = np.fft.fft2(np.asarray(stack[batch], dtype=np.float64), axes=(-2, -1))
+        if reference is not None:
+            shifts[batch] = _find_shifts(ref_freq, freqs, upsample_factor=upsample_factor)
+            continue
+
+        '''
+        The last FFT of the previous batch is carried over so that no frame is transformed twice
+        '''
+        if prev_freq is not None:
+            src_freqs = np.concatenate((prev_freq[None], freqs[:-1]), axis=0)
+            shifts[batch.start - 1: batch.stop - 1] = _find_shifts(src_freqs, freqs,
+                                                                  upsample_factor=upsample_factor)
+        elif freqs.shape[0] > 1:
+            shifts[batch.start: batch.stop - 1] = _find_shifts(freqs[:-1], freqs[1:],
+                                                              upsample_factor=upsample_factor)
+        prev_freq = freqs[-1]
+
+    return shifts
+
+
+def _get_absolute_shifts(shifts, num_frames, origin=None):
+    """
+    Converts the shifts from register_stack to the shift of every frame with respect to the origin
 
-        Returns
-        -------
-        keypts :
-            descriptors
-        descs :
-            keypoints
+    Parameters
+    ----------
+    shifts : 2D numpy.ndarray of floats
+        Translations returned by register_stack
+    num_frames : unsigned int
+        Number of frames in the stack
+    origin : unsigned int, optional
+        Frame that stays in place when the shifts are between consecutive frames.
+        Default - the center frame of the stack
 
-        """
-        detector = self.detector
-        dset = self.data
-        lib = self.lib
-        mask = kwargs.get('mask', False)
-        origin = kwargs.get('origin', [0, 0])
-        winSize = kwargs.get('window_size', 0)
+    Returns
+    -------
+    abs_shifts : 2D numpy.ndarray of floats
+        Translation (row, column) that registers each frame with the origin
+    """
+    if len(shifts) == num_frames:
+        return np.asarray(shifts, dtype=np.float64)
+    if origin is None:
+        origin = int(num_frames / 2)
+    cum_shifts = np.vstack((np.zeros((1, 2)), np.cumsum(shifts, axis=0)))
+    return cum_shifts - cum_shifts[origin]
 
-        if mask:
-            def mask_func(x, winSize):
-                x[origin[0] - winSize / 2: origin[0] + winSize / 2,
-                origin[1] - winSize / 2: origin[1] + winSize / 2] = 2
-                x = x - 1
-                return x
 
-            mask_ind = np.mask_indices(dset.shape[-1], mask_func, winSize)
-            self.data = np.array([imp[mask_ind].reshape(winSize, winSize) for imp in dset])
+def shift_frames(frames, shifts):
+    """
+    Translates a block of frames in frequency space. Pixels that would wrap around the edges are set to zero.
 
-        # detect and compute keypoints
-        def detect(image):
-            if lib == 'opencv':
-                image = (image - image.mean()) / image.std()
-                image = image.astype('uint8')
-                k_obj, d_obj = detector.detectAndCompute(image, None)
-                keypts, descs = pickle_keypoints(k_obj), pickle_keypoints(d_obj)
+    Parameters
+    ----------
+    frames : 3D numpy.ndarray
+        Frames arranged as [frame, row, column]
+    shifts : 2D numpy.ndarray of floats
+        Translation (row, column) for each frame
 
-            elif lib == 'skimage':
-                imp = (image - image.mean()) / np.std(image)
-                imp[imp < 0] = 0
-                imp.astype('float32')
-                detector.detect_and_extract(imp)
-                keypts, descs = detector.keypoints, detector.descriptors
+    Returns
+    -------
+    shifted : 3D numpy.ndarray of floats
+        Translated frames
+    """
+    num_rows, num_cols = frames.shape[1:]
+    row_freqs = np.fft.fftfreq(num_rows)[None, :, None]
+    col_freqs = np.fft.fftfreq(num_cols)[None, None, :]
+    phase = np.exp(-2j * np.pi * (row_freqs * shifts[:, 0, None, None] + col_freqs * shifts[:, 1, None, None]))
+    shifted = np.fft.ifft2(np.fft.fft2(frames, axes=(-2, -1)) * phase, axes=(-2, -1)).real
+
+    for frame, (row_shift, col_shift) in zip(shifted, shifts):
+        if row_shift > 0:
+            frame[:int(np.ceil(row_shift))] = 0
+        elif row_shift < 0:
+            frame[num_rows + int(np.floor(row_shift)):] = 0
+        if col_shift > 0:
+            frame[:, :int(np.ceil(col_shift))] = 0
+        elif col_shift < 0:
+            frame[:, num_cols + int(np.floor(col_shift)):] = 0
+
+    return shifted
+
+
+def write_aligned_stack(stack, h5_source, shifts, origin=None, max_mem_mb=256):
+    """
+    Applies the translations to the stack one block of frames at a time and writes the aligned frames
+    to a new group next to the source dataset, so that the aligned stack never needs to fit in memory.
 
-            return keypts, descs
+    Parameters
+    ----------
+    stack : 3D numpy.ndarray or h5py.Dataset
+        Stack of images arranged as [frame, row, column]
+    h5_source : h5py.Dataset
+        Dataset the stack was read from. The aligned stack will have the same shape and attributes
+    shifts : 2D numpy.ndarray of floats
+        Translations returned by register_stack
+    origin : unsigned int, optional
+        Frame that stays in place when the shifts are between consecutive frames.
+        Default - the center frame of the stack
+    max_mem_mb : unsigned int, optional
+        Maximum memory in MB to use for a block of frames. Default 256
 
-        # start pool of workers
-        results = [detect(imp) for imp in self.data]
+    Returns
+    -------
+    h5_aligned : h5py.Dataset
+        Aligned stack
+    """
+    num_frames = stack.shape[0]
+    abs_shifts = _get_absolute_shifts(shifts, num_frames, origin=origin)
 
-        # get keypoints and descriptors
-        keypts = [itm[0].astype('int') for itm in results]
-        desc = [itm[1] for itm in results]
+    ds_aligned = MicroDataset('Aligned_Data', data=[], maxshape=h5_source.shape, dtype=np.float32,
+                              chunking=calc_chunks(h5_source.shape, np.float32(0).itemsize))
+    ds_shifts = MicroDataset('Shifts', data=np.float32(abs_shifts))
+    ds_shifts.attrs['labels'] = {'Row': (slice(None), slice(0, 1)), 'Column': (slice(None), slice(1, 2))}
+    ds_shifts.attrs['units'] = 'pixels'
 
-        return keypts, desc
+    basename = h5_source.name.split('/')[-1]
+    reg_grp = MicroDataGroup(basename + '-Rigid_Registration_', h5_source.parent.name[1:])
+    reg_grp.addChildren([ds_aligned, ds_shifts])
+    reg_grp.attrs['registration_method'] = 'phase correlation'
+    reg_grp.attrs['pairs'] = 'consecutive' if len(shifts) < num_frames else 'reference'
 
+    hdf = ioHDF5(h5_source.file)
+    reg_refs = hdf.writeData(reg_grp)
+    h5_aligned = getH5DsetRefs(['Aligned_Data'], reg_refs)[0]
+    copyAttributes(h5_source, h5_aligned, skip_refs=False)
 
-#TODO: Docstrings following numpy standard.
+    batch_size = max(1, int(max_mem_mb * 1024 ** 2 / (3 * 16 * np.prod(stack.shape[1:]))))
+    print('Writing aligned frames...')
+    for batch in gen_batches(num_frames, batch_size):
+        frames = np.asarray(stack[batch], dtype=np.float64)
+        aligned = shift_frames(frames, abs_shifts[batch])
+        h5_aligned[batch] = np.reshape(aligned, (aligned.shape[0],) + h5_source.shape[1:])
+        hdf.flush()
 
-# Functions
-def euclidMatch(Matches, keypts1, keypts2, misalign):
-    """
-    Function that thresholds the matches, found from a comparison of
-    their descriptors, by the maximum expected misalignment.
-    """
-    filteredMatches = np.array([])
-    deltaX =(keypts1[Matches[:,0],:][:,0]-keypts2[Matches[:,1],:][:,0])**2
-    deltaY =(keypts1[Matches[:,0],:][:,1]-keypts2[Matches[:,1],:][:,1])**2
-    dist = np.apply_along_axis(np.sqrt, 0, deltaX + deltaY)
-    filteredMatches = np.where(dist[:] < misalign, True, False)
-    return filteredMatches
+    return h5_aligned
 
 
 # function is taken as is from scikit-image.
@@ -726,19 +791,34 @@ class geoTransformerParallel(object):
     + Homography by feature extraction.
     + Intensity-based image registration.
     + Projection Correction.
+
+    The images are placed in shared memory and the pool of workers is kept alive between
+    calls. Call closePool() or clearData() when done.
     """
 
     def __init__(self):
         self.__init__
         self.data = []
+        self.shared_data = None
+        self.h5_source = None
         self.features = []
+        self.pool = StackPool()
 
     def clearData(self):
         """
         This is a Method to clear the data from the object.
         """
+        self.closePool()
         del self.data
         self.data = []
+        self.shared_data = None
+        self.h5_source = None
+
+    def closePool(self):
+        """
+        This is a Method that shuts down the pool of workers.
+        """
+        self.pool.close()
 
     def loadData(self, dataset):
         """
@@ -752,9 +832,8 @@ class geoTransformerParallel(object):
         if not isinstance(dataset, h5py.Dataset):
             warnings.warn( 'Error: Data must be an h5 Dataset object'   )
         else:
-            self.data = dataset
-            dim = int(np.sqrt(self.data.shape[-1]))
-            self.data = self.data.reshape(-1,dim,dim)
+            self.data, self.shared_data = share_stack(dataset)
+            self.h5_source = dataset
 
     def loadFeatures(self, features):
         """
@@ -773,6 +852,15 @@ class geoTransformerParallel(object):
         """
         self.features = features
 
+    def _getPool(self, processes):
+        """
+        Returns the pool of workers that can see the images and the features
+        """
+        if self.shared_data is None and len(self.data) > 0:
+            self.data, self.shared_data = share_stack(np.asarray(self.data))
+        stack = self.data if self.shared_data is not None else None
+        return self.pool.get(stack, self.shared_data, processes, worker_args={'features': self.features})
+
     def matchFeatures(self, **kwargs):
         """
         This is a Method that computes similarity between keypoints based on their
@@ -797,18 +885,10 @@ class geoTransformerParallel(object):
         processes = kwargs.get('processors', 1)
         maxDis = kwargs.get('maximum_distance', np.infty)
 
-        def match(desc):
-            desc1, desc2 = desc[0], desc[1]
-            matches = match_descriptors(desc1, desc2, cross_check=True)
-            return matches
-
-        # start pool of workers
-        pool = mp.Pool(processes)
-        print('launching %i kernels...'%(processes))
-
-        tasks = [ (desc1, desc2) for desc1, desc2 in zip(desc[:],desc[1:]) ]
-        chunk = int(len(desc)/processes)
-        jobs = pool.imap(match, tasks, chunksize = chunk)
+        # get the pool of workers. The workers already have the descriptors so only the pair indices are sent
+        pool = self._getPool(processes)
+        chunk = max(1, int(len(desc) / (4 * processes)))
+        jobs = pool.imap(_match_task, range(len(desc) - 1), chunksize = chunk)
 
         # get matches
         print('Extracting Matches From the Descriptors...')
@@ -817,10 +897,6 @@ class geoTransformerParallel(object):
         for j in jobs:
             matches.append(j)
 
-        # close the pool
-        print('Closing down the kernels...\n')
-        pool.close()
-
         # impose maximum_distance misalignment constraints on matches
         filt_matches = []
         for match, key1, key2 in zip(matches, keypts[:],keypts[1:]):
@@ -852,18 +928,11 @@ class geoTransformerParallel(object):
 
         keypts = self.features[0]
 
-        def optimization(Pts):
-            robustTrans, inliers = ransac((Pts[0], Pts[1]), transform, **kwargs)
-            output = [robustTrans, inliers]
-            return output
-
-         # start pool of workers
-        print('launching %i kernels...'%(processes))
-        pool = mp.Pool(processes)
-        tasks = [ (key1[match[:, 0]], key2[match[:, 1]])
-                    for match, key1, key2 in zip(matches,keypts[:],keypts[1:]) ]
-        chunk = int(len(keypts)/processes)
-        jobs = pool.imap(optimization, tasks, chunksize = chunk)
+        # get the pool of workers. The workers already have the keypoints so only the matches are sent
+        pool = self._getPool(processes)
+        tasks = [(pair_ind, match, transform, kwargs) for pair_ind, match in enumerate(matches)]
+        chunk = max(1, int(len(keypts) / (4 * processes)))
+        jobs = pool.imap(_ransac_task, tasks, chunksize = chunk)
 
         # get Transforms and inlier matches
         transforms, trueMatches =[], []
@@ -875,13 +944,8 @@ class geoTransformerParallel(object):
         except np.linalg.LinAlgError:
             pass
 
-        # close the pool
-        pool.close()
-        print('Closing down the kernels...\n')
-
         return transforms, trueMatches
 
-    #TODO: Need parallel version for transforming stack of images.
     def applyTransformation(self, transforms, **kwargs):
         """
         This is the method that takes the list of transformation found by findTransformation
@@ -900,7 +964,6 @@ class geoTransformerParallel(object):
              default, center image in the stack.
         processors : int, optional
             Number of processors to use, default = 1.
-            Currently,only one processor is used.
 
         Returns
         -------
@@ -972,36 +1035,22 @@ class geoTransformerParallel(object):
 #                T = SimilarityTransform(rotation = params, translation = (0,0))
                 chainTransforms.append(T)
 
-        # Use the chain transformations to transform the dataset
-        output_shape = dset[0].shape
-#        output_shape = (2048, 2048)
-        def warping(datum):
-            imp, transform  = datum[0], datum[1]
-            transimp = warp(imp, inverse_map= transform, output_shape = output_shape,
-                            cval = 0, preserve_range = True)
-            return transimp
-
-#          #start pool of workers
-#         #somehow wrap function crashes when run in parallel! run sequentially for now.
-#        pool = mp.Pool(processes)
-#        print('launching %i kernels...'%(processes))
-#        tasks = [ (imp, transform) for imp, transform in zip(dset, chainTransforms) ]
-#        chunk = int(dset.shape[0]/processes)
-#        jobs = pool.imap(warping, tasks, chunksize = 1)
-#        #close the pool
-#        pool.close()
-#        print('Closing down the kernels... \n')
-#
-        # get transformed images and pack into 3d np.ndarray
+        # Use the chain transformations to transform the dataset.
+        # The workers read the frames from shared memory and the transformed frames are streamed back
         print('Transforming Images...')
-        transImages = np.copy(dset[:])
+        transImages = np.empty_like(dset)
+        if processes > 1:
+            pool = self._getPool(processes)
+            chunk = max(1, int(len(chainTransforms) / (4 * processes)))
+            jobs = pool.imap(_warp_task, enumerate(chainTransforms), chunksize = chunk)
+        else:
+            jobs = (warp(imp, inverse_map = transform, output_shape = dset[0].shape, cval = 0, preserve_range = True)
+                    for imp, transform in zip(dset, chainTransforms))
 
-        for imp, transform, itm in zip( transImages, chainTransforms, range(0,transImages.shape[0])):
-            transimp = warping([imp, transform])
+        for itm, transimp in enumerate(jobs):
             transImages[itm] = transimp
             print('Image #%i'%(itm))
 
-
         return transImages, chainTransforms
 
     def correlationTransformation(self, **kwargs):
@@ -1021,20 +1070,11 @@ class geoTransformerParallel(object):
 
         processes = kwargs.get('processors', 1)
 
-        pool = mp.Pool(processes)
-        print('launching %i kernels...'%(processes))
-
-        def register(images):
-            imp1, imp2 = images[0], images[1]
-            shifts, _, _ = register_translation(imp1,imp2)
-            return shifts
-
-        dim = int(np.sqrt(self.data.shape[-1]))
-        tasks = [ (imp1, imp2)
-                    for imp1, imp2 in zip(self.data[:], self.data[1:]) ]
-
-        chunk = int((self.data.shape[0] - 1)/processes)
-        jobs = pool.imap(register, tasks, chunksize = chunk)
+        # get the pool of workers. The workers read the frames from shared memory so only the pair indices are sent
+        pool = self._getPool(processes)
+        num_pairs = self.data.shape[0] - 1
+        chunk = max(1, int(num_pairs / (4 * processes)))
+        jobs = pool.imap(_register_task, range(num_pairs), chunksize = chunk)
 
         # get Transforms and inlier matches
         results = []
@@ -1045,11 +1085,52 @@ class geoTransformerParallel(object):
         except:
             warnings.warn('Skipped Some Entry... dunno why!!')
 
-        # close the pool
-        pool.close()
-
         return results
 
+    def batchCorrelationTransformation(self, **kwargs):
+        """
+        Uses phase correlation to find the translations between all the images at once.
+        The FFT of each image is only computed once.
+
+        Parameters
+        ----------
+        reference: int, optional
+            Index of the image that all images are registered with.
+            default, None - consecutive images are registered with each other.
+        upsample_factor: int, optional
+            Images are registered to within 1 / upsample_factor of a pixel, default = 1.
+
+        Returns
+        -------
+        Translations as a numpy.ndarray.
+
+        """
+        return register_stack(self.data, reference=kwargs.get('reference', None),
+                              upsample_factor=kwargs.get('upsample_factor', 1))
+
+    def alignStack(self, shifts, **kwargs):
+        """
+        Applies the translations found by batchCorrelationTransformation and writes the
+        aligned images to the file one block at a time.
+
+        Parameters
+        ----------
+        shifts: numpy.ndarray
+            Translations from batchCorrelationTransformation.
+        origin: int, optional
+            The position in the data to take as origin, i.e. don't transform.
+            default, center image in the stack.
+
+        Returns
+        -------
+        Aligned h5py.Dataset
+
+        """
+        if self.h5_source is None:
+            warnings.warn('Error: Data must be loaded from an h5 Dataset object')
+            return
+        return write_aligned_stack(self.data, self.h5_source, shifts, origin=kwargs.get('origin', None))
+
 
 class geoTransformerSerial(object):
     """
@@ -1063,6 +1144,7 @@ class geoTransformerSerial(object):
     def __init__(self):
         self.__init__
         self.data = []
+        self.h5_source = None
         self.features = []
 
     def clearData(self):
@@ -1071,6 +1153,7 @@ class geoTransformerSerial(object):
         """
         del self.data
         self.data = []
+        self.h5_source = None
 
     def loadData(self, dataset):
         """
@@ -1084,9 +1167,9 @@ class geoTransformerSerial(object):
         if not isinstance(dataset, h5py.Dataset):
             warnings.warn( 'Error: Data must be an h5 Dataset object'   )
         else:
-            self.data = dataset
-            dim = int(np.sqrt(self.data.shape[-1]))
-            self.data = self.data.reshape(-1,dim,dim)
+            dim = int(np.sqrt(dataset.shape[-1]))
+            self.data = np.reshape(dataset[()], (-1, dim, dim))
+            self.h5_source = dataset
 
     def loadFeatures(self, features):
         """
@@ -1125,32 +1208,12 @@ class geoTransformerSerial(object):
         desc = self.features[-1]
         keypts = self.features[0]
         maxDis = kwargs.get('maximum_distance', np.infty)
-        processes = kwargs.get('processes', 2)
-
-
-        def match(desc):
-            desc1, desc2 = desc[0], desc[1]
-            matches = match_descriptors(desc1, desc2, cross_check=True)
-            return matches
-
-        # start pool of workers
-        pool = mp.Pool(processes)
-        print('launching %i kernels...'%(processes))
-
-        tasks = [ (desc1, desc2) for desc1, desc2 in zip(desc[:],desc[1:]) ]
-        chunk = int(len(desc)/processes)
-        jobs = pool.imap(match, tasks, chunksize = chunk)
 
         # get matches
         print('Extracting Matches From the Descriptors...')
 
-        matches =[]
-        for j in jobs:
-            matches.append(j)
-
-        # close the pool
-        print('Closing down the kernels...\n')
-        pool.close()
+        matches = [match_descriptors(desc1, desc2, cross_check=True)
+                   for desc1, desc2 in zip(desc[:], desc[1:])]
 
         # impose maximum_distance misalignment constraints on matches
         filt_matches = []
@@ -1184,21 +1247,14 @@ class geoTransformerSerial(object):
 
         keypts = self.features[0]
 
-        def optimization(Pts):
-            robustTrans, inliers = ransac((Pts[0], Pts[1]), transform, **kwargs)
-            output = [robustTrans, inliers]
-            return output
-
-        results = [optimization(key1[match[:, 0]], key2[match[:, 1]])
-                    for match, key1, key2 in zip(matches,keypts[:],keypts[1:])]
-
         # get Transforms and inlier matches
         transforms, trueMatches =[], []
         print('Extracting Inlier Matches with RANSAC...')
         try:
-            for res in results:
-                transforms.append(res[0])
-                trueMatches.append(res[1])
+            for match, key1, key2 in zip(matches, keypts[:], keypts[1:]):
+                robustTrans, inliers = ransac((key1[match[:, 0]], key2[match[:, 1]]), transform, **kwargs)
+                transforms.append(robustTrans)
+                trueMatches.append(inliers)
         except np.linalg.LinAlgError:
             print('Error: Inverse of the transformation failed!!!')
 
@@ -1325,18 +1381,52 @@ class geoTransformerSerial(object):
 
         """
 
-        processes = kwargs.get('processors', 1)
+        results = [phase_cross_correlation(imp1, imp2)[0]
+                   for imp1, imp2 in zip(self.data[:], self.data[1:])]
 
-        pool = mp.Pool(processes)
-        print('launching %i kernels...'%(processes))
+        return results
 
-        def register(images):
-            imp1, imp2 = images[0], images[1]
-            shifts, _, _ = register_translation(imp1,imp2)
-            return shifts
+    def batchCorrelationTransformation(self, **kwargs):
+        """
+        Uses phase correlation to find the translations between all the images at once.
+        The FFT of each image is only computed once.
 
-        results = [register((imp1, imp2))
-                    for imp1, imp2 in zip(self.data[:], self.data[1:])]
+        Parameters
+        ----------
+        reference: int, optional
+            Index of the image that all images are registered with.
+            default, None - consecutive images are registered with each other.
+        upsample_factor: int, optional
+            Images are registered to within 1 / upsample_factor of a pixel, default = 1.
 
-        return results
+        Returns
+        -------
+        Translations as a numpy.ndarray.
+
+        """
+        return register_stack(self.data, reference=kwargs.get('reference', None),
+                              upsample_factor=kwargs.get('upsample_factor', 1))
+
+    def alignStack(self, shifts, **kwargs):
+        """
+        Applies the translations found by batchCorrelationTransformation and writes the
+        aligned images to the file one block at a time.
+
+        Parameters
+        ----------
+        shifts: numpy.ndarray
+            Translations from batchCorrelationTransformation.
+        origin: int, optional
+            The position in the data to take as origin, i.e. don't transform.
+            default, center image in the stack.
+
+        Returns
+        -------
+        Aligned h5py.Dataset
+
+        """
+        if self.h5_source is None:
+            warnings.warn('Error: Data must be loaded from an h5 Dataset object')
+            return
+        return write_aligned_stack(self.data, self.h5_source, shifts, origin=kwargs.get('origin', None))
 
@@ -111,14 +111,19 @@ def __scale_and_discretize(y_hist, N_y_bins, max_resp, min_resp, debug=False):
     -------
     y_hist numpy.ndarray
     """
-    y_hist = y_hist.flatten()
-    y_hist = np.clip(y_hist, min_resp, max_resp)
-    y_hist = np.add(y_hist, -min_resp)
-    y_hist = np.dot(y_hist, 1.0/(max_resp - min_resp))
+    '''
+    clip makes the only copy. Everything else is done in place
+    '''
+    y_hist = np.clip(np.ravel(y_hist), min_resp, max_resp)
+    if not np.issubdtype(y_hist.dtype, np.floating):
+        y_hist = y_hist.astype(np.float64)
+    y_hist -= min_resp
+    y_hist *= 1.0/(max_resp - min_resp)
     '''
     Discretize y_hist
     '''
-    y_hist = np.rint(y_hist * (N_y_bins - 1))
+    y_hist *= N_y_bins - 1
+    np.rint(y_hist, out=y_hist)
     if debug:
         print('ymin', min(y_hist), 'ymax', max(y_hist))
 
@@ -14,12 +14,13 @@ from sklearn.utils import gen_batches
 from sklearn.utils.extmath import randomized_svd
 
 from ..io.hdf_utils import getH5DsetRefs, checkAndLinkAncillary, findH5group, create_empty_dataset, \
-    getH5RegRefIndices, createRefFromIndices, checkIfMain, calc_chunks, copy_main_attributes, copyAttributes
+    getH5RegRefIndices, createRefFromIndices, checkIfMain, calc_chunks, copy_main_attributes, copyAttributes, \
+    get_real_view
 from ..io.io_hdf5 import ioHDF5
 from ..io.io_utils import check_dtype, transformToTargetType, getAvailableMem
 from ..io.microdata import MicroDataset, MicroDataGroup
 
-def doSVD(h5_main, num_comps=None):
+def doSVD(h5_main, num_comps=None, use_real_view=False, var_target=None, n_oversamples=10, n_iter=3):
     """
     Does SVD on the provided dataset and writes the result. File is not closed
 
@@ -28,7 +29,20 @@ def doSVD(h5_main, num_comps=None):
     h5_main : h5py.Dataset reference
         Reference to the dataset on which SVD will be performed
     num_comps : Unsigned integer (Optional)
-        Number of principal components of interest
+        Number of principal components of interest.
+        If var_target is provided, this is the maximum number of components that will be computed
+    use_real_view : Boolean (Optional. Default = False)
+        Whether or not to read the data from the cached float32 real view of h5_main (see hdf_utils.get_real_view)
+        instead of converting the complex / compound values in h5_main again
+    var_target : float (Optional. Default = None)
+        Fraction of the total energy (squared Frobenius norm) of the data, between 0 and 1, that the retained
+        components should explain. If provided, the rank of the decomposition is increased until this target is
+        reached and only the smallest number of components that meets the target are kept. Eg - 0.999
+    n_oversamples : Unsigned integer (Optional. Default = 10)
+        Number of additional random vectors used to sample the range of the data in the randomized SVD
+    n_iter : Unsigned integer (Optional. Default = 3)
+        Number of power iterations used in the randomized SVD. More iterations improve the accuracy for data whose
+        singular values decay slowly
 
     Returns
     -------
@@ -66,10 +80,43 @@ def doSVD(h5_main, num_comps=None):
     '''
     print('Performing SVD decomposition')
 
-    U, S, V = randomized_svd(func(h5_main), num_comps, n_iter=3)
+    if use_real_view:
+        real_data = get_real_view(h5_main)[()]
+    else:
+        real_data = func(h5_main)
+
+    # Accumulated in double precision since the residual is the difference of two similar numbers
+    total_energy = 0.0
+    for batch in gen_batches(real_data.shape[0], 1024):
+        total_energy += np.sum(np.square(real_data[batch], dtype=np.float64))
+
+    if var_target is None:
+        U, S, V = randomized_svd(real_data, num_comps, n_oversamples=n_oversamples, n_iter=n_iter)
+    else:
+        # Double the rank until the target is met instead of always computing the maximum number of components
+        rank = min(num_comps, 16)
+        while True:
+            U, S, V = randomized_svd(real_data, rank, n_oversamples=n_oversamples, n_iter=n_iter)
+            explained = np.cumsum(np.square(S, dtype=np.float64)) / total_energy
+            if explained[-1] >= var_target or rank == num_comps:
+                break
+            rank = min(2 * rank, num_comps)
+        num_comps = int(min(len(S), np.searchsorted(explained, var_target) + 1))
+        U, S, V = U[:, :num_comps], S[:num_comps], V[:num_comps]
+    del real_data
 
     svd_type = 'sklearn-randomized'
 
+    '''
+    U*S*V is the orthogonal projection of the data onto the span of U. So the norm of the residual
+    follows from the norms of the data and of S without another pass over the data
+    '''
+    kept_energy = np.sum(np.square(S, dtype=np.float64))
+    residual_norm = np.sqrt(max(0.0, total_energy - kept_energy))
+    explained_var = kept_energy / total_energy if total_energy > 0 else 1.0
+    print('{} components explain {:.4%} of the data. Residual norm: {:.4g}'.format(len(S), explained_var,
+                                                                                   residual_norm))
+
     print('SVD took {} seconds.  Writing results to file.'.format(round(time.time() - t1, 2)))
 
     '''
@@ -123,6 +170,11 @@ def doSVD(h5_main, num_comps=None):
     '''
     svd_grp.attrs['num_components'] = num_comps
     svd_grp.attrs['svd_method'] = svd_type
+    svd_grp.attrs['n_oversamples'] = n_oversamples
+    svd_grp.attrs['n_iter'] = n_iter
+    svd_grp.attrs['explained_variance'] = explained_var
+    svd_grp.attrs['residual_norm'] = residual_norm
+    svd_grp.attrs['variance_target'] = var_target
 
     '''
     Write the data and retrieve the HDF5 objects then delete the Microdatasets
@@ -0,0 +1,47 @@
+from unittest import TestCase
+
+import numpy as np
+from scipy.ndimage import fourier_shift, gaussian_filter
+
+from pycroscopy.processing.image_transformation import register_stack, phase_cross_correlation
+
+
+class TestRegisterStack(TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        base = gaussian_filter(rng.rand(64, 64), 2)
+        self.true_shifts = np.array([[0.3, -1.2], [1.0, 2.1], [-3.1, 1.0], [2.2, -0.4]])
+        frames = [base]
+        for shift in self.true_shifts:
+            frames.append(np.fft.ifftn(fourier_shift(np.fft.fftn(base), shift)).real)
+        self.stack = np.array(frames)
+
+    def __compare_with_skimage(self, upsample_factor, reference):
+        shifts = register_stack(self.stack, reference=reference, upsample_factor=upsample_factor)
+        for ind in range(1, self.stack.shape[0]):
+            if reference is None:
+                src, target, ours = self.stack[ind - 1], self.stack[ind], shifts[ind - 1]
+            else:
+                src, target, ours = self.stack[reference], self.stack[ind], shifts[ind]
+            expected = phase_cross_correlation(src, target, upsample_factor=upsample_factor)[0]
+            self.assertTrue(np.all(np.abs(ours - expected) <= 0.5 / upsample_factor + 1E-9),
+                            msg='pair {}: {} vs skimage {}'.format(ind, ours, expected))
+
+    def test_subpixel_consecutive(self):
+        for upsample_factor in [4, 20]:
+            self.__compare_with_skimage(upsample_factor, None)
+
+    def test_subpixel_reference(self):
+        for upsample_factor in [4, 20]:
+            self.__compare_with_skimage(upsample_factor, 0)
+
+    def test_subpixel_accuracy(self):
+        shifts = register_stack(self.stack, reference=0, upsample_factor=20)
+        # Frame i was shifted by true_shifts[i - 1]. Registering it back takes the opposite shift
+        self.assertTrue(np.all(np.abs(shifts[1:] + self.true_shifts) <= 0.5 / 20 + 1E-9),
+                        msg='{}'.format(shifts[1:]))
+
+    def test_whole_pixels(self):
+        shifts = register_stack(self.stack, reference=0, upsample_factor=1)
+        self.assertTrue(np.all(shifts == np.round(shifts)))